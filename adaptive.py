@@ -0,0 +1,322 @@
+import argparse
+import os
+import random
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import eventlog
+from callbacks import STAGE_BRANCH, STAGE_FINAL, STAGE_FIRST
+from content import DEFAULT_DIR, ContentError, ContentLibrary
+from render import KeyboardRegistry
+
+ANSWERS = (1, 2, 3, 4, 5)
+TOP_N = 3
+
+
+def _beaten(p: int, hi: int, lo: Sequence[int]) -> bool:
+    """Программа p с баллами не выше hi точно не попадёт в топ: её обгоняют TOP_N других"""
+    ahead = 0
+    for r, value in enumerate(lo):
+        if r != p and (value > hi or (value == hi and r < p)):
+            ahead += 1
+            if ahead >= TOP_N:
+                return True
+    return False
+
+
+def _top(engine, scores: Sequence[int]) -> List[int]:
+    return [p for p, _ in engine.top_programs(scores, TOP_N)]
+
+
+# ==================== ПЛАНИРОВЩИК ====================
+class AdaptivePlanner:
+    """
+    Какой вопрос этапа задать следующим, а какие уже не могут изменить итог.
+
+    Точная часть работает всегда: по ответам считаются границы итоговых баллов
+    каждой программы (неотвеченный вопрос даёт от 1 до 5), и вопрос пропускается,
+    если все программы его строки заведомо вне топа, а на общем этапе ещё и
+    лидирующая ветка уже не может смениться. Такой пропуск не меняет ни ветку,
+    ни топ-3 вместе с баллами — результат тот же, что у полного опроса.
+
+    С ``confidence < 1`` этап останавливается раньше: оставшиеся ответы
+    разыгрываются ``samples`` раз по распределению ``prior`` (веса ответов 1–5),
+    и если топ-3 совпадает с топом «остановки сейчас» не реже ``confidence``,
+    остальные вопросы этапа не задаются.
+    """
+
+    def __init__(
+        self,
+        confidence: float = 1.0,
+        samples: int = 200,
+        prior: Optional[Sequence[float]] = None,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.confidence = confidence
+        self.samples = samples
+        self.prior = list(prior) if prior else [1.0] * len(ANSWERS)
+        self._random = random.Random(seed)
+
+    @property
+    def sampling(self) -> bool:
+        return self.confidence < 1.0
+
+    def _draw(self, k: int) -> List[int]:
+        return self._random.choices(ANSWERS, self.prior, k=k)
+
+    # ---------- общий этап ----------
+    def next_first(self, engine, answers: Sequence[int], index: int) -> Tuple[int, Optional[float]]:
+        """
+        Индекс следующего общего вопроса начиная с index (len(answers) — этап окончен)
+        и уверенность в итоге при остановке сейчас (None без розыгрыша).
+        """
+        n = len(answers)
+        if index >= n:
+            return n, None
+        confidence = None
+        if self.sampling:
+            confidence = self.first_confidence(engine, answers, index)
+            if confidence >= self.confidence:
+                return n, confidence
+        settled = self._settled_first(engine, answers, index)
+        for q in range(index, n):
+            if q not in settled:
+                return q, confidence
+        return n, confidence
+
+    def _settled_first(self, engine, answers: Sequence[int], index: int) -> set:
+        """Общие вопросы из оставшихся, ответ на которые не меняет ни ветку, ни топ-3"""
+        rows = engine.first_stage_weights
+        lo = [0] * engine.num_programs
+        hi = [0] * engine.num_programs
+        for q, row in enumerate(rows):
+            for p, w in enumerate(row):
+                if w:
+                    lo[p] += w * (answers[q] if q < index else ANSWERS[0])
+                    hi[p] += w * (answers[q] if q < index else ANSWERS[-1])
+        branch_lo = engine.branch_scores(lo)
+        branch_hi = engine.branch_scores(hi)
+        leader = max(branch_lo, key=branch_lo.get)
+        if any(branch_lo[leader] - branch_hi[b] <= engine.tie_threshold for b in branch_hi if b != leader):
+            return set()
+        # Ветка решена — её вопросы тоже разойдутся по программам лидера
+        for row in engine.branch_weights[leader]:
+            for p, w in enumerate(row):
+                lo[p] += w * ANSWERS[0]
+                hi[p] += w * ANSWERS[-1]
+        leader_programs = set(engine.branch_programs[leader])
+        # Вопросы ветки-лидера не пропускаются: на них держится её отрыв
+        return {
+            q for q in range(index, len(rows))
+            if all(not w or (p not in leader_programs and _beaten(p, hi[p], lo)) for p, w in enumerate(rows[q]))
+        }
+
+    def first_confidence(self, engine, answers: Sequence[int], index: int) -> float:
+        """Доля розыгрышей, в которых остановка общего этапа сейчас даёт тот же топ-3"""
+        n = len(answers)
+        stopped = engine.first_stage_scores(list(answers[:index]) + [0] * (n - index))
+        stopped_branches = sorted(engine.top_branches(engine.branch_scores(stopped)))
+        agree = 0
+        for _ in range(self.samples):
+            full = engine.first_stage_scores(list(answers[:index]) + self._draw(n - index))
+            branches = sorted(engine.top_branches(engine.branch_scores(full)))
+            if branches != stopped_branches:
+                continue
+            # Из пары близких веток выбирает пользователь — одинаково в обоих исходах
+            branch = self._random.choice(branches)
+            extra = self._draw(len(engine.branch_weights[branch]))
+            for j, value in enumerate(extra):
+                engine.add_branch_answer(full, branch, j, value)
+            stopped_full = list(stopped)
+            for j, value in enumerate(extra):
+                engine.add_branch_answer(stopped_full, branch, j, value)
+            agree += _top(engine, full) == _top(engine, stopped_full)
+        return agree / self.samples
+
+    # ---------- этап ветки ----------
+    def next_branch(self, engine, scores: Sequence[int], branch: str, asked: int) -> Tuple[int, Optional[float]]:
+        """
+        Индекс следующего вопроса ветки начиная с asked (число вопросов ветки — этап окончен)
+        и уверенность в итоге при остановке сейчас (None без розыгрыша).
+        """
+        rows = engine.branch_weights[branch]
+        count = len(rows)
+        if asked >= count:
+            return count, None
+        confidence = None
+        if self.sampling:
+            confidence = self.branch_confidence(engine, scores, branch, asked)
+            if confidence >= self.confidence:
+                return count, confidence
+        lo = list(scores)
+        hi = list(scores)
+        for row in rows[asked:]:
+            for p, w in enumerate(row):
+                lo[p] += w * ANSWERS[0]
+                hi[p] += w * ANSWERS[-1]
+        for j in range(asked, count):
+            # Вопросы сверх числа программ ветки (пустая строка) баллов не дают
+            if not all(not w or _beaten(p, hi[p], lo) for p, w in enumerate(rows[j])):
+                return j, confidence
+        return count, confidence
+
+    def branch_confidence(self, engine, scores: Sequence[int], branch: str, asked: int) -> float:
+        """Доля розыгрышей, в которых остановка этапа ветки сейчас даёт тот же топ-3"""
+        count = len(engine.branch_weights[branch])
+        stopped = _top(engine, scores)
+        agree = 0
+        for _ in range(self.samples):
+            full = list(scores)
+            for j, value in zip(range(asked, count), self._draw(count - asked)):
+                engine.add_branch_answer(full, branch, j, value)
+            agree += _top(engine, full) == stopped
+        return agree / self.samples
+
+
+def fit_prior(sessions: Iterable[Dict[str, Any]]) -> List[float]:
+    """Распределение ответов 1–5 по записанным сессиям (со сглаживанием Лапласа)"""
+    counts = [1] * len(ANSWERS)
+    for record in sessions:
+        for value in list(record["first"]) + list(record["extra"]):
+            counts[value - ANSWERS[0]] += 1
+    total = sum(counts)
+    return [c / total for c in counts]
+
+
+# ==================== ОФЛАЙН-ОЦЕНКА ====================
+def recorded_sessions(events: Iterable[Dict[str, Any]], library: ContentLibrary) -> List[Dict[str, Any]]:
+    """
+    Завершённые сессии полного опроса из журнала: ответы общего этапа,
+    выбранная ветка и ответы на все её вопросы. Сессии, прошедшие с пропусками,
+    и незавершённые не берутся — с ними сравнивать не с чем.
+    """
+    records = []
+    for session_events in eventlog.group_sessions(events).values():
+        session_events.sort(key=lambda e: e["t"])
+        start = next((e for e in session_events if e["k"] == eventlog.START), None)
+        try:
+            engine = library.get(start.get("v") if start else None).scoring
+        except ContentError:
+            # Версии контента, на которой прошла сессия, больше нет
+            continue
+        record = {"engine": engine, "first": {}, "extra": {}, "branch": None, "tie": False, "finals": 0, "top": None}
+        for e in session_events:
+            kind = e["k"]
+            if kind == eventlog.SKIP:
+                record = None
+                break
+            if kind == eventlog.ANSWER and e["g"] == STAGE_FIRST:
+                record["first"][e["i"]] = e["v"]
+            elif kind == eventlog.ANSWER and e["g"] == STAGE_BRANCH:
+                record["extra"][e["i"]] = e["v"]
+            elif (kind == eventlog.ANSWER and e["g"] == STAGE_FINAL) or kind == eventlog.OPTION:
+                record["finals"] += 1
+            elif kind in (eventlog.BRANCH, eventlog.TIE_CHOICE):
+                record["branch"] = e["b"]
+                record["tie"] = kind == eventlog.TIE_CHOICE
+            elif kind == eventlog.FINISH:
+                record["top"] = e["p"]
+        if record is None or record["top"] is None or record["branch"] is None:
+            continue
+        n = len(engine.first_stage_weights)
+        count = len(engine.branch_weights[record["branch"]])
+        if sorted(record["first"]) != list(range(n)) or sorted(record["extra"]) != list(range(count)):
+            continue
+        record["first"] = [record["first"][q] for q in range(n)]
+        record["extra"] = [record["extra"][j] for j in range(count)]
+        records.append(record)
+    return records
+
+
+def simulate(planner: AdaptivePlanner, record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Проходит записанную сессию адаптивно: задаются только вопросы, которые
+    выбирает планировщик, ответы берутся из записи. Если ветки оказались близки,
+    считается, что пользователь выбрал бы записанную ветку (если она в паре).
+    """
+    engine = record["engine"]
+    full = engine.first_stage_scores(record["first"])
+    for j, value in enumerate(record["extra"]):
+        engine.add_branch_answer(full, record["branch"], j, value)
+    full_top = engine.top_programs(full, TOP_N)
+    full_asked = len(record["first"]) + record["tie"] + len(record["extra"]) + record["finals"]
+
+    n = len(record["first"])
+    answers = [0] * n
+    asked = index = 0
+    while True:
+        q, _ = planner.next_first(engine, answers, index)
+        if q >= n:
+            break
+        answers[q] = record["first"][q]
+        asked += 1
+        index = q + 1
+    scores = engine.first_stage_scores(answers)
+    branches = engine.top_branches(engine.branch_scores(scores))
+    asked += len(branches) > 1
+    result = {"full": full_asked, "adaptive": asked + record["finals"], "branch": record["branch"] in branches,
+              "top": False, "scores": False}
+    if not result["branch"]:
+        return result
+
+    branch = record["branch"]
+    count = len(record["extra"])
+    asked_branch = 0
+    while True:
+        j, _ = planner.next_branch(engine, scores, branch, asked_branch)
+        if j >= count:
+            break
+        engine.add_branch_answer(scores, branch, j, record["extra"][j])
+        asked += 1
+        asked_branch = j + 1
+    top = engine.top_programs(scores, TOP_N)
+    result.update(adaptive=asked + record["finals"], top=[p for p, _ in top] == [p for p, _ in full_top],
+                  scores=top == full_top)
+    return result
+
+
+def evaluate(planner: AdaptivePlanner, records: Sequence[Dict[str, Any]]) -> Dict[str, float]:
+    """Среднее число вопросов полного и адаптивного опроса и доля совпадений итога"""
+    results = [simulate(planner, record) for record in records]
+    total = len(results) or 1
+    full = sum(r["full"] for r in results) / total
+    adaptive = sum(r["adaptive"] for r in results) / total
+    return {
+        "sessions": len(results),
+        "full": full,
+        "adaptive": adaptive,
+        "saved": 1 - adaptive / full if full else 0.0,
+        "branch": sum(r["branch"] for r in results) / total,
+        "top": sum(r["top"] for r in results) / total,
+        "scores": sum(r["scores"] for r in results) / total,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Офлайн-оценка адаптивного опроса на записанных сессиях")
+    parser.add_argument("--dir", default=os.getenv("EVENT_LOG_DIR", "events"), help="каталог журнала")
+    parser.add_argument("--content", default=os.getenv("CONTENT_DIR", DEFAULT_DIR), help="каталог контента бота")
+    parser.add_argument("--confidence", type=float, nargs="+", default=[1.0, 0.99, 0.95, 0.9],
+                        help="пороги уверенности; 1 — только точные пропуски")
+    parser.add_argument("--samples", type=int, default=200, help="розыгрышей на оценку уверенности")
+    parser.add_argument("--fit", action="store_true", help="распределение ответов — по журналу, а не равномерное")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    library = ContentLibrary(args.content, KeyboardRegistry())
+    records = recorded_sessions(eventlog.read_events(args.dir), library)
+    if not records:
+        raise SystemExit(f"В {args.dir} нет завершённых сессий полного опроса")
+    prior = fit_prior(records) if args.fit else None
+    if prior:
+        print(f"ADAPTIVE_PRIOR={','.join(f'{w:.3f}' for w in prior)}")
+    print(f"Сессий: {len(records)}")
+    print(f"{'порог':>6} {'вопросов':>9} {'адаптивно':>10} {'экономия':>9} {'ветка':>7} {'топ-3':>7} {'баллы':>7}")
+    for confidence in args.confidence:
+        planner = AdaptivePlanner(confidence, args.samples, prior, args.seed)
+        r = evaluate(planner, records)
+        print(f"{confidence:6.2f} {r['full']:9.2f} {r['adaptive']:10.2f} {r['saved']:8.1%} "
+              f"{r['branch']:7.1%} {r['top']:7.1%} {r['scores']:7.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import csv
+import json
+import os
+from itertools import combinations
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    # NumPy ускоряет подсчёт пачками; без него счётчики — обычные списки
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+import eventlog
+from callbacks import STAGE_BRANCH, STAGE_FINAL, STAGE_FIRST
+from content import DEFAULT_DIR, ContentLibrary
+from render import KeyboardRegistry
+from scoring import BRANCHES
+
+TIE_PAIRS = ["".join(pair) for pair in combinations(BRANCHES, 2)]
+TOP_RANKS = 3
+CHECKPOINT_VERSION = 1
+
+
+# ==================== АГРЕГАТОР ====================
+class FunnelAggregator:
+    """
+    Потоковая агрегация журнала событий (eventlog) в счётчики:
+    воронка по вопросам, распределение топ-программ, выбор веток, тай-брейки.
+
+    События читаются один раз, пачками по ``chunk_size``: из пачки строятся
+    массивы индексов, и каждый счётчик увеличивается одним bincount.
+    Счётчики и смещения в сегментах сохраняются в контрольную точку, поэтому
+    повторный запуск читает только то, что дописано после неё.
+    """
+
+    def __init__(
+        self,
+        num_programs: int,
+        first_questions: int,
+        branch_question_counts: Dict[str, int],
+        final_questions: int,
+        chunk_size: int = 50000,
+    ) -> None:
+        self.num_programs = num_programs
+        self.chunk_size = chunk_size
+        self.layout = {
+            "programs": num_programs,
+            "first": first_questions,
+            "branch": {b: branch_question_counts[b] for b in BRANCHES},
+            "final": final_questions,
+        }
+        self.max_branch = max(branch_question_counts.values())
+
+        # Шаги воронки: старт, общие вопросы, вопросы ветки (по номеру), финальные, завершение
+        self.funnel_steps = (
+            ["start"]
+            + [f"first:{i}" for i in range(first_questions)]
+            + [f"branch:{j}" for j in range(self.max_branch)]
+            + [f"final:{k}" for k in range(final_questions)]
+            + ["finish"]
+        )
+        self._branch_step = 1 + first_questions
+        self._final_step = self._branch_step + self.max_branch
+
+        # Плоские счётчики; матрицы хранятся построчно
+        self.shapes = {
+            "funnel": (len(self.funnel_steps),),
+            "branch_funnel": (len(BRANCHES), self.max_branch),
+            "top_programs": (TOP_RANKS, num_programs),
+            "branch_chosen": (2, len(BRANCHES)),       # по баллам / после тай-брейка
+            "ties": (len(TIE_PAIRS), 3),               # задан / выбран вариант 1 / вариант 2
+        }
+        self.counters = {name: self._zeros(shape) for name, shape in self.shapes.items()}
+        self.offsets: Dict[str, int] = {}
+        self.events_read = 0
+
+    @staticmethod
+    def _zeros(shape):
+        size = 1
+        for dim in shape:
+            size *= dim
+        return np.zeros(size, dtype=np.int64) if np is not None else [0] * size
+
+    def _bump(self, name: str, indices: List[int]) -> None:
+        if not indices:
+            return
+        counter = self.counters[name]
+        if np is not None:
+            counter += np.bincount(np.asarray(indices, dtype=np.int64), minlength=len(counter))
+        else:
+            for i in indices:
+                counter[i] += 1
+
+    # ---------- контрольная точка ----------
+    def load(self, path: str) -> None:
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("version") != CHECKPOINT_VERSION or checkpoint.get("layout") != self.layout:
+            raise ValueError(f"Контрольная точка {path} собрана для другого набора вопросов, нужен --reset")
+        self.offsets = checkpoint["offsets"]
+        for name, values in checkpoint["counters"].items():
+            self.counters[name] = np.asarray(values, dtype=np.int64) if np is not None else list(values)
+
+    def save(self, path: str) -> None:
+        checkpoint = {
+            "version": CHECKPOINT_VERSION,
+            "layout": self.layout,
+            "offsets": self.offsets,
+            "counters": {name: [int(v) for v in values] for name, values in self.counters.items()},
+        }
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        # Счётчики и смещения заменяются вместе: после падения либо старая точка, либо новая
+        os.replace(tmp, path)
+
+    # ---------- чтение журнала ----------
+    def consume(self, directory: str) -> int:
+        """Дочитывает все сегменты с сохранённых смещений; возвращает число новых событий"""
+        before = self.events_read
+        for path in eventlog.segment_paths(directory):
+            name = os.path.basename(path)
+            chunk: List[Dict[str, Any]] = []
+            offset = self.offsets.get(name, 0)
+            for offset, event in eventlog.read_segment(path, offset):
+                chunk.append(event)
+                if len(chunk) >= self.chunk_size:
+                    self._process(chunk)
+                    self.offsets[name] = offset
+                    chunk = []
+            self._process(chunk)
+            self.offsets[name] = offset
+        return self.events_read - before
+
+    def _process(self, events: List[Dict[str, Any]]) -> None:
+        funnel, branch_funnel, top, chosen, ties = [], [], [], [], []
+        max_branch = self.max_branch
+        for e in events:
+            kind = e["k"]
+            if e["s"] is None:
+                continue  # нажатие вне сессии
+            if kind in (eventlog.ANSWER, eventlog.SKIP):
+                # Пропущенный адаптивным режимом вопрос пройден, а не брошен
+                stage = e["g"]
+                if stage == STAGE_FIRST:
+                    funnel.append(1 + e["i"])
+                elif stage == STAGE_BRANCH:
+                    funnel.append(self._branch_step + e["i"])
+                    branch_funnel.append(BRANCHES.index(e["b"]) * max_branch + e["i"])
+                elif stage == STAGE_FINAL:
+                    funnel.append(self._final_step + e["i"])
+            elif kind == eventlog.OPTION:
+                funnel.append(self._final_step + e["q"])
+            elif kind == eventlog.START:
+                funnel.append(0)
+            elif kind == eventlog.FINISH:
+                funnel.append(len(self.funnel_steps) - 1)
+                top.extend(rank * self.num_programs + p for rank, p in enumerate(e["p"][:TOP_RANKS]))
+            elif kind == eventlog.BRANCH:
+                chosen.append(BRANCHES.index(e["b"]))
+            elif kind == eventlog.TIE:
+                ties.append(TIE_PAIRS.index(e["p"]) * 3)
+            elif kind == eventlog.TIE_CHOICE:
+                chosen.append(len(BRANCHES) + BRANCHES.index(e["b"]))
+                ties.append(TIE_PAIRS.index(e["p"]) * 3 + e["v"])
+
+        self._bump("funnel", funnel)
+        self._bump("branch_funnel", branch_funnel)
+        self._bump("top_programs", top)
+        self._bump("branch_chosen", chosen)
+        self._bump("ties", ties)
+        self.events_read += len(events)
+
+    # ---------- сводные таблицы ----------
+    def rows(self, name: str) -> List[List[int]]:
+        values = [int(v) for v in self.counters[name]]
+        cols = self.shapes[name][-1]
+        return [values[i:i + cols] for i in range(0, len(values), cols)]
+
+    def write_tables(self, out_dir: str, program_names: Optional[Sequence[str]] = None) -> None:
+        os.makedirs(out_dir, exist_ok=True)
+        names = program_names or [str(p) for p in range(self.num_programs)]
+
+        funnel = self.rows("funnel")[0]
+        started = funnel[0] or 1
+        table = []
+        for i, (step, reached) in enumerate(zip(self.funnel_steps, funnel)):
+            prev = funnel[i - 1] if i else reached
+            drop = (prev - reached) / prev if prev else 0.0
+            table.append([step, reached, f"{drop:.4f}", f"{reached / started:.4f}"])
+        _write_csv(os.path.join(out_dir, "funnel.csv"), ["step", "reached", "drop_off", "of_started"], table)
+
+        branch_funnel = self.rows("branch_funnel")
+        _write_csv(
+            os.path.join(out_dir, "branch_funnel.csv"),
+            ["branch"] + [f"q{j}" for j in range(self.max_branch)],
+            [[b] + row for b, row in zip(BRANCHES, branch_funnel)],
+        )
+
+        ranks = self.rows("top_programs")
+        finished = sum(ranks[0]) or 1
+        _write_csv(
+            os.path.join(out_dir, "top_programs.csv"),
+            ["program", "name", "rank1", "rank2", "rank3", "top3", "rank1_share"],
+            [
+                [p, names[p], *(ranks[r][p] for r in range(TOP_RANKS)),
+                 sum(ranks[r][p] for r in range(TOP_RANKS)), f"{ranks[0][p] / finished:.4f}"]
+                for p in range(self.num_programs)
+            ],
+        )
+
+        by_score, by_tie = self.rows("branch_chosen")
+        total = sum(by_score) + sum(by_tie) or 1
+        _write_csv(
+            os.path.join(out_dir, "branches.csv"),
+            ["branch", "by_score", "by_tie", "share"],
+            [[b, s, t, f"{(s + t) / total:.4f}"] for b, s, t in zip(BRANCHES, by_score, by_tie)],
+        )
+
+        ties = self.rows("ties")
+        decided = sum(by_score) + sum(row[0] for row in ties) or 1
+        _write_csv(
+            os.path.join(out_dir, "ties.csv"),
+            ["pair", "offered", "chose_first", "chose_second", "of_decisions"],
+            [[pair, *row, f"{row[0] / decided:.4f}"] for pair, row in zip(TIE_PAIRS, ties)],
+        )
+
+
+def _write_csv(path: str, header: List[str], rows: List[List[Any]]) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(tmp, path)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Инкрементальная сводка по журналу событий диагностики")
+    parser.add_argument("--dir", default=os.getenv("EVENT_LOG_DIR", "events"), help="каталог журнала")
+    parser.add_argument("--out", default="analytics", help="каталог для сводных таблиц и контрольной точки")
+    parser.add_argument("--reset", action="store_true", help="пересчитать всё с начала журнала")
+    parser.add_argument("--content", default=os.getenv("CONTENT_DIR", DEFAULT_DIR), help="каталог контента бота")
+    args = parser.parse_args(argv)
+
+    # Размеры опроса — по последней версии контента
+    bundle = ContentLibrary(args.content, KeyboardRegistry()).current
+    aggregator = FunnelAggregator(
+        num_programs=len(bundle.programs),
+        first_questions=len(bundle.first_questions),
+        branch_question_counts={b: len(q) for b, q in bundle.branch_questions.items()},
+        final_questions=len(bundle.final_questions),
+    )
+    checkpoint = os.path.join(args.out, "checkpoint.json")
+    if not args.reset:
+        aggregator.load(checkpoint)
+    new_events = aggregator.consume(args.dir)
+    os.makedirs(args.out, exist_ok=True)
+    aggregator.write_tables(args.out, bundle.programs)
+    aggregator.save(checkpoint)
+    print(f"Новых событий: {new_events}, таблицы в {args.out}")
+
+
+if __name__ == "__main__":
+    main()
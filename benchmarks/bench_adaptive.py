@@ -0,0 +1,115 @@
+"""
+Адаптивный опрос на синтетическом журнале: сколько вопросов экономится
+и как часто итог совпадает с полным опросом.
+
+У каждого синтетического пользователя есть склонность к каждой ветке и
+к каждой программе (1–5); ответ — склонность плюс шум, округлённая в 1–5.
+Сессии пишутся в журнал событий так же, как их пишет бот, и читаются
+adaptive.recorded_sessions. Кроме совпадений печатается время одного
+решения планировщика — столько добавляется к ответу на каждый вопрос.
+
+    python benchmarks/bench_adaptive.py [--sessions 2000] [--noise 0.8]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import eventlog
+from adaptive import AdaptivePlanner, evaluate, fit_prior, recorded_sessions
+from callbacks import STAGE_BRANCH, STAGE_FINAL, STAGE_FIRST
+from content import DEFAULT_DIR, ContentLibrary
+from render import KeyboardRegistry
+from scoring import BRANCHES
+
+library = ContentLibrary(DEFAULT_DIR, KeyboardRegistry())
+bundle = library.current
+scoring = bundle.scoring
+
+
+def answer(rng: random.Random, mean: float, noise: float) -> int:
+    return min(5, max(1, round(rng.gauss(mean, noise))))
+
+
+def session_events(rng: random.Random, chat_id: int, t: int, noise: float) -> list:
+    s = eventlog.new_session_id()
+    out = [{"k": eventlog.START, "t": t, "c": chat_id, "s": s, "v": bundle.version}]
+
+    def step(**event) -> None:
+        out.append({"t": t + len(out), "c": chat_id, "s": s, **event})
+
+    branch_mean = {b: rng.uniform(1, 5) for b in BRANCHES}
+    program_mean = [rng.uniform(1, 5) for _ in bundle.programs]
+    answers = []
+    for i, b in enumerate(bundle.first_stage_branches):
+        answers.append(answer(rng, branch_mean[b], noise))
+        step(k=eventlog.ANSWER, g=STAGE_FIRST, i=i, v=answers[-1])
+    scores = scoring.first_stage_scores(answers)
+    top = sorted(scoring.top_branches(scoring.branch_scores(scores)))
+    if len(top) == 1:
+        branch = top[0]
+        step(k=eventlog.BRANCH, b=branch)
+    else:
+        step(k=eventlog.TIE, p="".join(top))
+        branch = max(top, key=branch_mean.get)
+        step(k=eventlog.TIE_CHOICE, p="".join(top), v=top.index(branch) + 1, b=branch)
+    programs = scoring.branch_programs[branch]
+    for j in range(len(bundle.branch_questions[branch])):
+        value = answer(rng, program_mean[programs[j]], noise) if j < len(programs) else rng.randint(1, 5)
+        scoring.add_branch_answer(scores, branch, j, value)
+        step(k=eventlog.ANSWER, g=STAGE_BRANCH, i=j, v=value, b=branch)
+    step(k=eventlog.ANSWER, g=STAGE_FINAL, i=0, v=rng.randint(1, 10))
+    for q in range(1, len(bundle.final_questions)):
+        step(k=eventlog.OPTION, q=q, v=rng.randint(0, 3))
+    step(k=eventlog.FINISH, p=[p for p, _ in scoring.top_programs(scores, 3)], sc=scores)
+    return out
+
+
+def plan_time(planner: AdaptivePlanner, records: list) -> float:
+    """Среднее время next_first + next_branch на середине опроса"""
+    calls = 0
+    started = time.perf_counter()
+    for record in records[:200]:
+        engine = record["engine"]
+        half = len(record["first"]) // 2
+        planner.next_first(engine, record["first"][:half] + [0] * (len(record["first"]) - half), half)
+        scores = engine.first_stage_scores(record["first"])
+        planner.next_branch(engine, scores, record["branch"], 1)
+        calls += 2
+    return (time.perf_counter() - started) / calls
+
+
+def main(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "main-000001.jsonl"), "w", encoding="utf-8") as f:
+            for n in range(args.sessions):
+                for event in session_events(rng, n, 1_700_000_000_000 + n * 100, args.noise):
+                    f.write(json.dumps(event, separators=(",", ":")) + "\n")
+        records = recorded_sessions(eventlog.read_events(tmp), library)
+    prior = fit_prior(records)
+    print(f"{len(records)} сессий, шум ответа {args.noise}, розыгрышей {args.samples}")
+    print(f"{'порог':>6} {'распр.':>7} {'вопросов':>9} {'адаптивно':>10} {'экономия':>9} "
+          f"{'ветка':>7} {'топ-3':>7} {'баллы':>7} {'решение':>9}")
+    for confidence in (1.0, 0.99, 0.95, 0.9, 0.8):
+        for fitted in ((False,) if confidence >= 1 else (False, True)):
+            planner = AdaptivePlanner(confidence, args.samples, prior if fitted else None, args.seed)
+            r = evaluate(planner, records)
+            per_plan = plan_time(planner, records)
+            print(f"{confidence:6.2f} {'журнал' if fitted else 'равн.':>7} {r['full']:9.2f} {r['adaptive']:10.2f} "
+                  f"{r['saved']:8.1%} {r['branch']:7.1%} {r['top']:7.1%} {r['scores']:7.1%} "
+                  f"{per_plan * 1000:7.2f}мс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Адаптивный опрос: экономия вопросов и совпадение итога")
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--noise", type=float, default=0.8, help="разброс ответа вокруг склонности")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    main(parser.parse_args())
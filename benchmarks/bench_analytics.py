@@ -0,0 +1,125 @@
+"""
+Потоковая сводка по журналу: полный проход и дочитывание после контрольной точки.
+
+Журнал синтетический: сессии проходят опрос с отвалом ~3% на каждом шаге,
+ответы случайные, ветка и топ-программы считаются настоящим ScoringEngine.
+
+    python benchmarks/bench_analytics.py [сессий]
+"""
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import eventlog
+from analytics import FunnelAggregator
+from callbacks import STAGE_BRANCH, STAGE_FINAL, STAGE_FIRST
+from content import DEFAULT_DIR, ContentLibrary
+from render import KeyboardRegistry
+
+bundle = ContentLibrary(DEFAULT_DIR, KeyboardRegistry()).current
+scoring = bundle.scoring
+
+DROP = 0.03
+
+
+def session_events(rng: random.Random, chat_id: int, t: int) -> list:
+    s = eventlog.new_session_id()
+    out = [{"k": eventlog.START, "t": t, "c": chat_id, "s": s}]
+
+    def step(**event) -> bool:
+        out.append({"t": t + len(out), "c": chat_id, "s": s, **event})
+        return rng.random() > DROP
+
+    answers = []
+    for i in range(len(bundle.first_questions)):
+        answers.append(rng.randint(1, 5))
+        if not step(k=eventlog.ANSWER, g=STAGE_FIRST, i=i, v=answers[-1]):
+            return out
+    scores = scoring.first_stage_scores(answers)
+    top = sorted(scoring.top_branches(scoring.branch_scores(scores)))
+    if len(top) == 1:
+        branch = top[0]
+        step(k=eventlog.BRANCH, b=branch)
+    else:
+        step(k=eventlog.TIE, p="".join(top))
+        choice = rng.randint(1, 2)
+        branch = top[choice - 1]
+        if not step(k=eventlog.TIE_CHOICE, p="".join(top), v=choice, b=branch):
+            return out
+    for j in range(len(bundle.branch_questions[branch])):
+        value = rng.randint(1, 5)
+        scoring.add_branch_answer(scores, branch, j, value)
+        if not step(k=eventlog.ANSWER, g=STAGE_BRANCH, i=j, v=value, b=branch):
+            return out
+    if not step(k=eventlog.ANSWER, g=STAGE_FINAL, i=0, v=rng.randint(1, 10)):
+        return out
+    for q in range(1, len(bundle.final_questions)):
+        if not step(k=eventlog.OPTION, q=q, v=rng.randint(0, 3)):
+            return out
+    step(k=eventlog.FINISH, p=[p for p, _ in scoring.top_programs(scores, 3)], sc=scores)
+    return out
+
+
+def write_segment(directory: str, seq: int, rng: random.Random, sessions: int, first_chat: int) -> int:
+    lines = 0
+    with open(os.path.join(directory, f"main-{seq:06d}.jsonl"), "w", encoding="utf-8") as f:
+        for n in range(sessions):
+            for event in session_events(rng, first_chat + n, 1_700_000_000_000 + n * 100):
+                f.write(json.dumps(event, separators=(",", ":")) + "\n")
+                lines += 1
+    return lines
+
+
+def aggregator() -> FunnelAggregator:
+    return FunnelAggregator(
+        num_programs=len(bundle.programs),
+        first_questions=len(bundle.first_questions),
+        branch_question_counts={b: len(q) for b, q in bundle.branch_questions.items()},
+        final_questions=len(bundle.final_questions),
+    )
+
+
+def main(sessions: int) -> None:
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        events_dir = os.path.join(tmp, "events")
+        out_dir = os.path.join(tmp, "analytics")
+        os.makedirs(events_dir)
+        total = write_segment(events_dir, 1, rng, sessions, 0)
+        size = os.path.getsize(os.path.join(events_dir, "main-000001.jsonl"))
+        print(f"журнал: {sessions} сессий, {total} событий, {size / 1e6:.1f} МБ")
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        agg = aggregator()
+        agg.consume(events_dir)
+        agg.write_tables(out_dir, bundle.programs)
+        agg.save(os.path.join(out_dir, "checkpoint.json"))
+        elapsed = time.perf_counter() - started
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(f"полный проход: {elapsed:.2f} с ({total / elapsed:,.0f} событий/с), "
+              f"прирост пиковой памяти {(rss_after - rss_before) / 1024:.1f} МБ")
+
+        # Новый день: дописывается сегмент в 10% объёма, повторный запуск читает только его
+        extra = write_segment(events_dir, 2, rng, max(1, sessions // 10), sessions)
+        started = time.perf_counter()
+        agg = aggregator()
+        agg.load(os.path.join(out_dir, "checkpoint.json"))
+        new_events = agg.consume(events_dir)
+        agg.write_tables(out_dir, bundle.programs)
+        agg.save(os.path.join(out_dir, "checkpoint.json"))
+        elapsed = time.perf_counter() - started
+        print(f"дочитывание: {new_events} новых событий из {extra} дописанных за {elapsed:.2f} с")
+
+        with open(os.path.join(out_dir, "funnel.csv"), encoding="utf-8") as f:
+            print("".join(f.readlines()[:4]), end="")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
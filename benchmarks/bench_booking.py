@@ -0,0 +1,168 @@
+"""
+Запись на консультации: пропускная способность при конкурентной записи.
+
+--users пользователей одновременно проходят запись: открывают календарь
+месяца, выбирают день со свободным временем, открывают его слоты и занимают
+случайный; если слот успели занять — выбирают заново. Все целятся в первые
+--hot дней, так что конфликтов много. Сравниваются BookingStore (индекс
+свободных слотов в памяти, готовые клавиатуры) и наивный вариант, который
+на каждый показ спрашивает базу и собирает клавиатуру заново. Затем
+--procs процессов с общим файлом базы занимают одни и те же слоты:
+проверяется, что ни один слот не отдан дважды.
+
+    python benchmarks/bench_booking.py [--users 2000] [--hot 30] [--procs 4]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from booking import BookingStore, Schedule, month_key
+from render import KeyboardRegistry
+
+
+class NaiveStore(BookingStore):
+    """
+    Без индекса: свободные дни и слоты — запросы к базе, клавиатуры собираются
+    на каждый показ, слот занимается вставкой, которая упирается в первичный ключ
+    """
+
+    def _busy_slots(self, day: int) -> List[int]:
+        return [slot for slot, in self._conn.execute("SELECT slot FROM bookings WHERE day = ?", (day,))]
+
+    def _full_days(self, first: int, last: int) -> List[int]:
+        return [day for day, in self._conn.execute(
+            "SELECT day FROM bookings WHERE day BETWEEN ? AND ? GROUP BY day HAVING COUNT(*) >= ?",
+            (first, last, self.schedule.slots_per_day),
+        )]
+
+    async def free_days(self, days: List[int]) -> List[int]:
+        full = set(await self._run(self._full_days, days[0], days[-1]))
+        free = [day for day in days if day not in full]
+        self.registry.markup([[(str(day), f"bday:{day}")] for day in free])
+        return free
+
+    async def free_slots(self, day: int) -> List[int]:
+        busy = set(await self._run(self._busy_slots, day))
+        slots = [slot for slot in range(self.schedule.slots_per_day) if slot not in busy]
+        self.registry.markup([[(self.schedule.slot_time(slot), f"bslot:{day}:{slot}")] for slot in slots])
+        return slots
+
+    async def reserve(self, day: int, slot: int, user_id: int, service: str, name: str, phone: str) -> bool:
+        won = await self._run(self._insert, (day, slot, user_id, service, name, phone, time.time()))
+        if won:
+            self.reserved += 1
+        else:
+            self.conflicts += 1
+        return won
+
+
+class IndexedFlow:
+    """Те же шаги через индекс BookingStore"""
+
+    def __init__(self, store: BookingStore) -> None:
+        self.store = store
+
+    async def free_days(self, days: List[int]) -> List[int]:
+        self.store.month_keyboard(month_key(date.fromordinal(days[0])))
+        return self.store.calendar.free_days(days[0], days[-1])
+
+    async def free_slots(self, day: int) -> List[int]:
+        self.store.day_keyboard(day)
+        return self.store.open_slots(day)
+
+
+async def book(flow, store: BookingStore, rng: random.Random, user_id: int, hot: List[int]) -> None:
+    """Один пользователь: выбирает день и время, пока не займёт слот или не кончатся места"""
+    while True:
+        days = await flow.free_days(hot)
+        if not days:
+            return
+        day = rng.choice(days)
+        slots = await flow.free_slots(day)
+        if slots and await store.reserve(day, rng.choice(slots), user_id, "book_consult", "Имя", "+79001234567"):
+            return
+
+
+async def run(path: str, users: int, hot_days: int, naive: bool, seed: int = 1, start_at: float = 0.0) -> dict:
+    schedule = Schedule(weekdays=frozenset(range(1, 8)), days_ahead=60)
+    store = (NaiveStore if naive else BookingStore)(path, schedule, KeyboardRegistry())
+    flow = store if naive else IndexedFlow(store)
+    today, _ = store.today()
+    # С завтрашнего дня: сегодняшние слоты могут уже закончиться
+    hot = list(range(today + 1, today + 1 + hot_days))
+    rng = random.Random(seed)
+    # Процессы стартуют одновременно, после медленного импорта aiogram
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    started = time.perf_counter()
+    await asyncio.gather(*(book(flow, store, rng, seed * 100000 + i, hot) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    result = {
+        "seconds": elapsed,
+        "reserved": store.reserved,
+        "conflicts": store.conflicts,
+        "capacity": hot_days * schedule.slots_per_day,
+    }
+    await store.close()
+    return result
+
+
+def check(path: str) -> Tuple[int, int]:
+    """Строки в базе и различные (day, slot) среди них"""
+    conn = sqlite3.connect(path)
+    rows, distinct = conn.execute("SELECT COUNT(*), COUNT(DISTINCT day * 100 + slot) FROM bookings").fetchone()
+    conn.close()
+    return rows, distinct
+
+
+def process_main(path: str, users: int, hot_days: int, seed: int, start_at: float, queue: multiprocessing.Queue) -> None:
+    # Каждый процесс — свой индекс в памяти над общим файлом, как воркеры кластера
+    result = asyncio.run(run(path, users, hot_days, naive=False, seed=seed, start_at=start_at))
+    queue.put((result["reserved"], result["conflicts"]))
+
+
+def main(args: argparse.Namespace) -> None:
+    print(f"{args.users} пользователей, {args.hot} дн. по 9 слотов")
+    print(f"{'вариант':<10} {'время':>8} {'записей/с':>10} {'записано':>9} {'конфликтов':>11} {'дублей':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for title, naive in (("наивный", True), ("индекс", False)):
+            path = os.path.join(tmp, f"{title}.sqlite3")
+            r = asyncio.run(run(path, args.users, args.hot, naive))
+            rows, distinct = check(path)
+            print(f"{title:<10} {r['seconds']:7.2f}с {r['reserved'] / r['seconds']:10.0f} "
+                  f"{r['reserved']:5d}/{r['capacity']:<3d} {r['conflicts']:11d} {rows - distinct:7d}")
+
+        path = os.path.join(tmp, "shared.sqlite3")
+        # Создаём базу заранее, чтобы процессы не спорили за CREATE TABLE и WAL
+        asyncio.run(run(path, 0, args.hot, naive=False))
+        queue: multiprocessing.Queue = multiprocessing.Queue()
+        start_at = time.time() + 10
+        procs = [multiprocessing.Process(target=process_main, args=(path, args.users, args.hot, seed + 1, start_at, queue))
+                 for seed in range(args.procs)]
+        for proc in procs:
+            proc.start()
+        outcomes = [queue.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+        rows, distinct = check(path)
+        reserved = [r for r, _ in outcomes]
+        print(f"{args.procs} процессов, общий файл: записали {reserved} = {sum(reserved)}, "
+              f"конфликтов {sum(c for _, c in outcomes)}, строк {rows}, различных слотов {distinct}, "
+              f"дублей {rows - distinct}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Конкурентная запись на консультации")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--hot", type=int, default=30, help="сколько ближайших дней разбирают")
+    parser.add_argument("--procs", type=int, default=4)
+    main(parser.parse_args())
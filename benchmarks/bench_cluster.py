@@ -0,0 +1,125 @@
+"""
+Нагрузочный тест многопроцессного режима (WEB_WORKERS): пропускная способность
+при 1, 2, 4 ... воркерах за одним портом.
+
+Бот запускается как есть (python bot.py) с Bot API, подменённым на FakeBotAPI.
+Генератор шлёт /start от разных чатов; обновление считается обработанным,
+когда до фейкового API дошёл ответный sendMessage.
+
+    python benchmarks/bench_cluster.py [обновлений] [воркеры через запятую]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, ClientError
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_PORT = 18081
+BOT_PORT = 18100
+SECRET = "bench"
+
+
+def start_update(update_id: int, chat_id: int) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": "Load"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": user,
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+async def post(http: ClientSession, update: dict) -> None:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    while True:
+        try:
+            async with http.post(f"http://127.0.0.1:{BOT_PORT}/webhook", json=update, headers=headers) as response:
+                await response.read()
+                if response.status == 200:
+                    return
+        except ClientError:
+            pass
+        # Как и Telegram, повторяем доставку, пока бот не примет апдейт
+        await asyncio.sleep(0.05)
+
+
+async def wait_processed(api: FakeBotAPI, expected: int, timeout: float = 300) -> None:
+    deadline = time.perf_counter() + timeout
+    while api.calls["sendmessage"] < expected:
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"обработано {api.calls['sendmessage']} из {expected}")
+        await asyncio.sleep(0.01)
+
+
+async def run(api: FakeBotAPI, workers: int, total: int, concurrency: int = 64) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "BOT_TOKEN": "123456:BENCHMARK",
+            "TELEGRAM_API_URL": f"http://127.0.0.1:{API_PORT}",
+            "WEBHOOK_URL": "http://127.0.0.1",
+            "WEBHOOK_SECRET": SECRET,
+            "PORT": str(BOT_PORT),
+            "WORKER_BASE_PORT": str(BOT_PORT + 1),
+            "WEB_WORKERS": str(workers),
+            "FSM_DB_PATH": os.path.join(tmp, "fsm.sqlite3"),
+            # Меряем обработку, а не общий лимит Telegram в 30 сообщений/с
+            "TELEGRAM_GLOBAL_RATE": "1000000",
+        }
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, "bot.py"), env=env,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            async with ClientSession() as http:
+                # Прогрев: по одному апдейту на каждый воркер
+                api.reset()
+                await asyncio.gather(*(post(http, start_update(i, i)) for i in range(workers * 4)))
+                await wait_processed(api, workers * 4)
+                api.reset()
+
+                queue = asyncio.Queue()
+                for i in range(total):
+                    queue.put_nowait(start_update(1000 + i, 1000 + i))
+
+                async def client():
+                    while not queue.empty():
+                        await post(http, queue.get_nowait())
+
+                started = time.perf_counter()
+                await asyncio.gather(*(client() for _ in range(concurrency)))
+                await wait_processed(api, total)
+                return total / (time.perf_counter() - started)
+        finally:
+            process.terminate()
+            await process.wait()
+
+
+async def main(total: int, worker_counts: list) -> None:
+    api = FakeBotAPI()
+    await api.start(port=API_PORT)
+    print(f"CPU: {os.cpu_count()}")
+    baseline = None
+    for workers in worker_counts:
+        rate = await run(api, workers, total)
+        baseline = baseline or rate
+        print(f"воркеров={workers:<3} {rate:8.1f} обновлений/с  (x{rate / baseline:.2f})")
+    await api.stop()
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    counts = [int(x) for x in sys.argv[2].split(",")] if len(sys.argv) > 2 else [1, 2, 4]
+    asyncio.run(main(total, counts))
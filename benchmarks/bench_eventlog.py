@@ -0,0 +1,67 @@
+"""
+Журнал событий: цена emit в хендлере и пропускная способность записи на диск.
+
+Пользователи отвечают параллельно, каждый ответ — одно событие ANSWER.
+Для сравнения — запись каждого события отдельным write+fsync без группировки.
+
+    python benchmarks/bench_eventlog.py [пользователей] [ответов]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import eventlog
+from eventlog import EventLog
+
+
+async def grouped(directory: str, users: int, answers: int) -> None:
+    log = EventLog(directory=directory)
+    timings = []
+
+    async def user(chat_id: int) -> None:
+        session = eventlog.new_session_id()
+        for i in range(answers):
+            started = time.perf_counter()
+            log.emit(eventlog.ANSWER, chat_id, session, g=0, i=i % 10, v=3)
+            timings.append(time.perf_counter() - started)
+            await asyncio.sleep(0.001)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(chat_id) for chat_id in range(users)))
+    await log.close()
+    total = time.perf_counter() - started
+
+    timings.sort()
+    written = sum(1 for _ in eventlog.read_events(directory))
+    print(f"emit: среднее={statistics.mean(timings) * 1e6:.1f} мкс  p99={timings[int(len(timings) * 0.99) - 1] * 1e6:.1f} мкс")
+    print(f"групповой коммит: {written} событий за {total:.2f} с, {len(eventlog.segment_paths(directory))} сегм.")
+
+
+def one_by_one(directory: str, count: int) -> None:
+    path = os.path.join(directory, "single.jsonl")
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    line = b'{"k":"A","t":0,"c":1,"s":"x","g":0,"i":0,"v":3}\n'
+    started = time.perf_counter()
+    for _ in range(count):
+        os.write(fd, line)
+        os.fsync(fd)
+    os.close(fd)
+    elapsed = time.perf_counter() - started
+    print(f"fsync на событие: {count} событий за {elapsed:.2f} с ({count / elapsed:.0f}/с)")
+
+
+async def main(users: int, answers: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        await grouped(os.path.join(tmp, "events"), users, answers)
+        one_by_one(tmp, min(users * answers, 2000))
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    answers = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    asyncio.run(main(users, answers))
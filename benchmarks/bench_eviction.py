@@ -0,0 +1,82 @@
+"""
+Вытеснение брошенных сессий: накладные расходы и ограничение памяти.
+
+Через ExpiringStorage поверх MemoryStorage проходит поток пользователей,
+половина из которых бросает диагностику на середине. Меряется: надбавка
+обёртки на операцию хранилища, время одного прохода очистки по куче
+и сколько сессий остаётся в памяти с вытеснением и без него.
+
+    python benchmarks/bench_eviction.py [пользователей]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from storage import ExpiringStorage
+
+DATA = {"session": "AQAAAAD/////////AAAAAAAAAAAAAAAKAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"}
+
+
+async def per_op(storage, keys) -> float:
+    started = time.perf_counter()
+    for key in keys:
+        await storage.get_data(key)
+        await storage.set_data(key, DATA)
+    return (time.perf_counter() - started) / (2 * len(keys))
+
+
+async def churn(storage, users: int, rng: random.Random) -> None:
+    """Каждый пользователь делает 5 ответов; половина не доходит до конца"""
+    for n in range(users):
+        key = StorageKey(bot_id=1, chat_id=n, user_id=n)
+        for _ in range(5):
+            await storage.get_data(key)
+            await storage.set_data(key, DATA)
+        if rng.random() < 0.5:
+            await storage.set_state(key, None)
+            await storage.set_data(key, {})
+
+
+async def main(users: int) -> None:
+    keys = [StorageKey(bot_id=1, chat_id=n, user_id=n) for n in range(10000)]
+    bare = MemoryStorage()
+    await per_op(bare, keys)
+    bare_op = await per_op(bare, keys)
+    wrapped = ExpiringStorage(MemoryStorage(), ttl=3600)
+    # Первое обращение к ключу ставит его в кучу, дальше — только обновление времени
+    first = await per_op(wrapped, keys)
+    wrapped_op = await per_op(wrapped, keys)
+    print(f"операция хранилища: {bare_op * 1e6:.2f} мкс, с учётом сроков +{(wrapped_op - bare_op) * 1e6:.2f} мкс "
+          f"(первое обращение к сессии +{(first - bare_op) * 1e6:.2f} мкс)")
+    await wrapped.close()
+
+    plain = MemoryStorage()
+    await churn(plain, users, random.Random(1))
+    print(f"без вытеснения: {len(plain.storage)} записей после {users} пользователей")
+
+    evicted = []
+    expiring = ExpiringStorage(MemoryStorage(), ttl=0, max_sessions=users // 20, on_evict=evicted.append)
+    await churn(expiring, users, random.Random(1))
+    print(f"с пределом {users // 20}: {len(expiring.inner.storage)} записей, вытеснено по LRU {len(evicted)}")
+
+    # Срок истекает у всех брошенных сразу: один проход очистки по куче
+    expiring = ExpiringStorage(MemoryStorage(), ttl=0.5, interval=3600)
+    await churn(expiring, users, random.Random(1))
+    await asyncio.sleep(0.6)
+    started = time.perf_counter()
+    count = await expiring.sweep()
+    elapsed = time.perf_counter() - started
+    print(f"очистка по TTL: {count} сессий за {elapsed * 1000:.1f} мс "
+          f"({elapsed / max(count, 1) * 1e6:.1f} мкс на сессию), осталось {len(expiring.inner.storage)}")
+    await expiring.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000))
@@ -0,0 +1,154 @@
+"""
+Стоимость логов на апдейт: basicConfig в stderr против очереди (LogPipeline).
+
+Настоящий Dispatcher.feed_update с хендлером, который логирует как
+process_answer и ask_question (четыре записи) плюс строка aiogram.event
+на каждый апдейт. Вывод — файл (быстрый диск) и «медленный stderr»:
+каждая строка пишется --slow мс, как в заполненный пайп, который не
+успевает читать сборщик логов. Меряется время feed_update (среднее,
+p99, max) — столько цикл событий занят апдейтом, — процессорное время
+потока цикла на апдейт (без ожидания GIL, который забирает поток вывода)
+и сколько строк в итоге записано или отброшено.
+
+    python benchmarks/bench_logging.py [--updates 20000] [--slow 0.2]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from logs import LogContextMiddleware, LogPipeline
+
+logger = logging.getLogger("bench")
+
+
+class SlowStream:
+    """Поток, запись в который занимает delay секунд на строку"""
+
+    def __init__(self, stream, delay: float) -> None:
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, text: str) -> int:
+        time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+
+def callback_update(update_id: int) -> Update:
+    user = User(id=update_id % 500, is_bot=False, first_name="Load")
+    chat = Chat(id=user.id, type="private")
+    message = Message(message_id=1, date=datetime.now(), chat=chat, from_user=user, text="?")
+    query = CallbackQuery(id=str(update_id), from_user=user, chat_instance="c", message=message, data="q:0:2:3")
+    return Update(update_id=update_id, callback_query=query)
+
+
+def build_dispatcher(structured: bool) -> Dispatcher:
+    dp = Dispatcher()
+    if structured:
+        dp.update.outer_middleware(LogContextMiddleware())
+
+    @dp.callback_query()
+    async def handler(callback: CallbackQuery) -> None:
+        stage, index, score, question_index = "first", 3, 2, 3
+        if structured:
+            logger.info(
+                "process_answer: stage_code=%s, score=%s, index=%s, stage=%s, question_index=%s",
+                0, score, index, stage, question_index,
+                extra={"stage": stage, "index": index, "score": score},
+            )
+            logger.info("Первый этап: сохранен ответ %s на вопрос %s, новый индекс %s", score, index, index + 1)
+            logger.info(
+                "ask_question: stage=%s, index=%s, branch=%s", stage, index + 1, None,
+                extra={"stage": stage, "index": index + 1, "branch": None},
+            )
+        else:
+            logger.info(f"process_answer: stage_code={0}, score={score}, index={index}, stage={stage}, question_index={question_index}")
+            logger.info(f"Первый этап: сохранен ответ {score} на вопрос {index}, новый индекс {index + 1}")
+            logger.info(f"ask_question: stage={stage}, index={index + 1}, branch={None}")
+        logger.debug("Отладка: %s", callback.data)
+
+    return dp
+
+
+async def feed(dp: Dispatcher, bot: Bot, updates: int) -> dict:
+    times = []
+    cpu = 0.0
+    for i in range(updates):
+        update = callback_update(i)
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        await dp.feed_update(bot, update)
+        times.append(time.perf_counter() - started)
+        cpu += time.thread_time() - cpu_started
+        if i % 20 == 0:
+            # Апдейты приходят по сети: между ними цикл успевает другое
+            await asyncio.sleep(0)
+    mean = sum(times) / len(times)
+    times.sort()
+    return {"mean": mean, "cpu": cpu / updates, "p99": times[int(len(times) * 0.99)], "max": times[-1]}
+
+
+def run(args: argparse.Namespace, mode: str, slow: bool, directory: str) -> dict:
+    path = os.path.join(directory, f"{mode}-{slow}.log")
+    root = logging.getLogger()
+    with open(path, "w", encoding="utf-8") as file:
+        stream = SlowStream(file, args.slow / 1000) if slow else file
+        output = logging.StreamHandler(stream)
+        pipeline = None
+        if mode in ("без логов", "basicConfig"):
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+            output.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+            root.addHandler(output)
+            root.setLevel(logging.WARNING if mode == "без логов" else logging.INFO)
+        else:
+            sample = {"aiogram.event": 0.1, "handler": 0.1} if mode == "очередь 10%" else {}
+            pipeline = LogPipeline(sample=sample, output=output)
+            pipeline.install()
+        dp = build_dispatcher(structured=mode.startswith("очередь"))
+        bot = Bot("123456:BENCHMARK")
+        result = asyncio.run(feed(dp, bot, args.updates))
+        drained = time.perf_counter()
+        if pipeline is not None:
+            pipeline.stop()
+            result["dropped"] = pipeline.dropped
+        else:
+            result["dropped"] = 0
+        result["drain"] = time.perf_counter() - drained
+        root.removeHandler(output)
+        if pipeline is not None:
+            root.removeHandler(pipeline.handler)
+    with open(path, encoding="utf-8") as file:
+        result["lines"] = sum(1 for _ in file)
+    return result
+
+
+def main(args: argparse.Namespace) -> None:
+    print(f"{args.updates} апдейтов, 4 записи на апдейт; медленный вывод — {args.slow} мс на строку")
+    print(f"{'вывод':<10} {'вариант':<13} {'апдейт':>9} {'CPU':>9} {'p99':>9} {'max':>9} {'строк':>7} "
+          f"{'отброшено':>10} {'дописывал':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for slow in (False, True):
+            for mode in ("без логов", "basicConfig", "очередь", "очередь 10%"):
+                r = run(args, mode, slow, tmp)
+                print(f"{'медленный' if slow else 'файл':<10} {mode:<13} {r['mean'] * 1e6:6.0f}мкс {r['cpu'] * 1e6:6.0f}мкс "
+                      f"{r['p99'] * 1e6:6.0f}мкс {r['max'] * 1000:7.1f}мс {r['lines']:7d} "
+                      f"{r['dropped']:10d} {r['drain']:9.2f}с")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Логи: basicConfig против очереди")
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--slow", type=float, default=0.2, help="мс на строку медленного вывода")
+    main(parser.parse_args())
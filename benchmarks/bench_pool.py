@@ -0,0 +1,162 @@
+"""
+Ответ на вебхук при медленных хендлерах: после обработки и сразу (UpdatePool).
+
+Диспетчер aiogram с одним хендлером, который «работает» --slow секунд
+(и каждый двадцатый апдейт — в десять раз дольше, как отправка результатов),
+принимает апдейты через aiohttp тем же путём, что и бот. Генератор шлёт
+--rate апдейтов в секунду от --chats чатов и меряет время до HTTP-ответа —
+его видит Telegram и по нему сбавляет доставку, — время до конца обработки
+и число отказов 503. Порядок апдейтов в каждом чате проверяется.
+
+Варианты: inline — SimpleRequestHandler без фона, pool — PooledRequestHandler
+с --workers воркерами и очередью --depth; маленькая очередь показывает
+обратное давление.
+
+    python benchmarks/bench_pool.py [--rate 200] [--seconds 10] [--slow 0.2] [--workers 64] [--depth 1000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import ClientSession, web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pool import PooledRequestHandler, UpdatePool
+
+PORT = 18400
+SECRET = "bench"
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def message_update(update_id: int, chat_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "text": str(update_id),
+        },
+    }
+
+
+async def run(args: argparse.Namespace, mode: str, workers: int = 0, depth: int = 0) -> Dict[str, float]:
+    dp = Dispatcher()
+    bot = Bot("123456:BENCHMARK")
+    done: Dict[int, float] = {}
+    order: Dict[int, List[int]] = defaultdict(list)
+    rng = random.Random(1)
+
+    @dp.message()
+    async def slow_handler(message: Message) -> None:
+        await asyncio.sleep(args.slow * (10 if rng.random() < 0.05 else 1))
+        order[message.chat.id].append(message.message_id)
+        done[message.message_id] = time.perf_counter()
+
+    app = web.Application()
+    if mode == "pool":
+        pool = UpdatePool(workers=workers, depth=depth)
+        handler = PooledRequestHandler(dp, bot, pool, secret_token=SECRET)
+        pool.start(handler.feed)
+    else:
+        pool = None
+        handler = SimpleRequestHandler(dp, bot, secret_token=SECRET, handle_in_background=False)
+    app.router.add_post("/webhook", handler.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    acks: List[float] = []
+    sent: Dict[int, float] = {}
+    rejected = 0
+
+    async def deliver(http: ClientSession, update: dict) -> None:
+        # Как Telegram: на 503 повторяем через Retry-After
+        nonlocal rejected
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        while True:
+            started = time.perf_counter()
+            async with http.post(f"http://127.0.0.1:{PORT}/webhook", json=update, headers=headers) as response:
+                await response.read()
+                acks.append(time.perf_counter() - started)
+                if response.status == 200:
+                    return
+                rejected += 1
+                await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+
+    total = int(args.rate * args.seconds)
+    # Апдейты одного чата Telegram шлёт по одному: следующий — после ответа на предыдущий
+    chats: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async def user(http: ClientSession, update_id: int, chat_id: int) -> None:
+        # Обработка считается от нажатия, включая ожидание доставки за предыдущими апдейтами чата
+        sent[update_id] = time.perf_counter()
+        async with chats[chat_id]:
+            await deliver(http, message_update(update_id, chat_id))
+
+    async with ClientSession() as http:
+        tasks = []
+        started = time.perf_counter()
+        for i in range(1, total + 1):
+            tasks.append(asyncio.create_task(user(http, i, 1000 + rng.randrange(args.chats))))
+            await asyncio.sleep(max(0.0, started + i / args.rate - time.perf_counter()))
+        await asyncio.gather(*tasks)
+        while len(done) < total:
+            await asyncio.sleep(0.01)
+
+    if pool is not None:
+        await pool.stop()
+    await runner.cleanup()
+    await bot.session.close()
+
+    processed = [done[i] - sent[i] for i in done]
+    in_order = all(ids == sorted(ids) for ids in order.values())
+    return {
+        "ack_p50": percentile(acks, 0.5) * 1000,
+        "ack_p99": percentile(acks, 0.99) * 1000,
+        "ack_max": max(acks) * 1000,
+        "done_p50": percentile(processed, 0.5) * 1000,
+        "done_p99": percentile(processed, 0.99) * 1000,
+        "rejected": rejected,
+        "in_order": in_order,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(f"{args.rate:.0f} апдейтов/с, {args.seconds:.0f} с, {args.chats} чатов, хендлер {args.slow * 1000:.0f} мс "
+          f"(5% — {args.slow * 10000:.0f} мс)")
+    variants = [
+        ("inline", "inline", 0, 0),
+        (f"pool {args.workers}/{args.depth}", "pool", args.workers, args.depth),
+        (f"pool {args.workers}/{args.workers}", "pool", args.workers, args.workers),
+    ]
+    print(f"{'вариант':<16} {'ответ p50':>10} {'p99':>8} {'max':>8}   {'обработка p50':>13} {'p99':>8}   503   порядок")
+    for title, mode, workers, depth in variants:
+        r = await run(args, mode, workers, depth)
+        print(f"{title:<16} {r['ack_p50']:8.1f}мс {r['ack_p99']:6.1f}мс {r['ack_max']:6.1f}мс   "
+              f"{r['done_p50']:11.1f}мс {r['done_p99']:6.1f}мс {r['rejected']:5d}   {'да' if r['in_order'] else 'НЕТ'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ответ на вебхук: после обработки и через пул")
+    parser.add_argument("--rate", type=float, default=200.0, help="апдейтов в секунду")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--slow", type=float, default=0.2, help="время работы хендлера, с")
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--depth", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,64 @@
+"""
+Стоимость подготовки вопроса к отправке: сборка на лету против кэша отрисовки.
+
+«На лету» повторяет прежний ask_question: форматирование текста, новая
+InlineKeyboardMarkup и её сериализация сессией. «Кэш» — поиск в renders бандла контента
+и готовый JSON клавиатуры из PreparedMarkupSession.
+
+    python benchmarks/bench_render.py [повторов]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+os.environ.setdefault("FSM_STORAGE", "memory")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot import bot, content
+from callbacks import STAGE_FIRST, pack
+
+plain_session = AiohttpSession()
+bundle = content.current
+
+
+def on_the_fly(index: int) -> tuple:
+    text = f"Вопрос {index + 1}:\n\n{bundle.first_questions[index]}"
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=str(i), callback_data=pack("q", STAGE_FIRST, i, index))] for i in range(1, 6)
+    ])
+    return text, plain_session.prepare_value(keyboard, bot, {})
+
+
+def cached(index: int) -> tuple:
+    text, keyboard = bundle.renders[("first", None, index)]
+    return text, bot.session.prepare_value(keyboard, bot, {})
+
+
+def measure(func, n: int) -> tuple:
+    count = len(bundle.first_questions)
+    started = time.perf_counter()
+    for i in range(n):
+        func(i % count)
+    per_call = (time.perf_counter() - started) / n
+
+    tracemalloc.start()
+    for i in range(1000):
+        func(i % count)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return per_call, peak
+
+
+def main(n: int) -> None:
+    for name, func in (("на лету", on_the_fly), ("кэш", cached)):
+        per_call, peak = measure(func, n)
+        print(f"{name:<8} {per_call * 1e6:7.2f} мкс на вопрос, пик памяти за 1000 вопросов {peak / 1024:7.1f} КиБ")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,68 @@
+"""
+Хранилище результатов: волна завершивших и повторный показ.
+
+N пользователей завершают диагностику одновременно. Меряется время put
+в цикле событий, опоздание цикла во время фоновой записи пачками,
+затем get из LRU и с диска (после вытеснения из кэша).
+
+    python benchmarks/bench_results.py [пользователей]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from results import Result, ResultsStore
+
+
+async def lag_probe(stop: asyncio.Event, lags: list) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(0.001)
+        lags.append(loop.time() - started - 0.001)
+
+
+async def main(users: int) -> None:
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ResultsStore(os.path.join(tmp, "results.sqlite3"), capacity=users // 2)
+        stop, lags = asyncio.Event(), []
+        probe = asyncio.create_task(lag_probe(stop, lags))
+
+        started = time.perf_counter()
+        for user_id in range(users):
+            scores = [rng.randint(0, 30) for _ in range(18)]
+            top = sorted(range(18), key=lambda p: -scores[p])[:3]
+            store.put(Result(user_id, "1", time.time() - 300, time.time(), scores, top,
+                             {"intensity": 7, "frequency": 1, "sphere": 2}))
+            if user_id % 100 == 0:
+                # Завершения приходят апдейтами, между ними цикл свободен
+                await asyncio.sleep(0)
+        put = (time.perf_counter() - started) / users
+        await store.flush()
+        flushed = time.perf_counter() - started
+        stop.set()
+        await probe
+
+        lags.sort()
+        print(f"{users} результатов: put {put * 1e6:.1f} мкс, всё на диске через {flushed:.2f} с")
+        print(f"опоздание цикла во время записи: p50 {lags[len(lags) // 2] * 1000:.2f} мс, "
+              f"max {lags[-1] * 1000:.2f} мс")
+
+        # Вторая половина в кэше, первая вытеснена и читается с диска
+        for title, ids in (("LRU", range(users // 2, users)), ("диск", range(users // 2))):
+            sample = rng.sample(list(ids), min(5000, len(ids)))
+            started = time.perf_counter()
+            for user_id in sample:
+                await store.get(user_id)
+            print(f"get ({title}): {(time.perf_counter() - started) / len(sample) * 1e6:.1f} мкс")
+        await store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
@@ -0,0 +1,123 @@
+"""
+Стоимость диспетчеризации callback-запроса: цепочка lambda-фильтров против CallbackRouter.
+
+Оба варианта прогоняются через настоящий aiogram Dispatcher.feed_update
+с пустыми хендлерами, так что в замер входит всё, кроме самой логики бота.
+
+    python benchmarks/bench_router.py [обновлений]
+"""
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from callbacks import STAGE_BRANCH, STAGE_FINAL, STAGE_FIRST, CallbackRouter, pack
+
+# (старый callback_data, новый callback_data) для каждого хендлера
+SAMPLES = [
+    ("about_method", pack("about")),
+    ("show_legal", pack("legal")),
+    ("back_to_main", pack("menu")),
+    ("start_diagnostics", pack("start")),
+    ("confirm_consent", pack("consent")),
+    ("first_3_2", pack("q", STAGE_FIRST, 3, 2)),
+    ("branch_4_1", pack("q", STAGE_BRANCH, 4, 1)),
+    ("final_7_0", pack("q", STAGE_FINAL, 7, 0)),
+    ("final_option1_2", pack("opt", 1, 2)),
+    ("tie_branch_1", pack("tie", 1)),
+    ("get_descriptions", pack("descs")),
+    ("desc_2", pack("desc", 2)),
+    ("cancel_desc", pack("desc_cancel")),
+]
+
+
+async def noop(*args, **kwargs):
+    pass
+
+
+def legacy_dispatcher() -> Dispatcher:
+    """Хендлеры и фильтры в том порядке, в каком они были в bot.py"""
+    dp = Dispatcher()
+
+    async def process_answer(callback: CallbackQuery, state: FSMContext):
+        data = callback.data
+        if data.startswith(("final_option1_", "final_option2_")):
+            int(data.split("_")[2])
+            return
+        parts = data.split("_")
+        int(parts[1]), int(parts[2])
+
+    async def process_branch_tie(callback: CallbackQuery, state: FSMContext):
+        callback.data.split("_")[2]
+
+    async def process_desc_count(callback: CallbackQuery):
+        int(callback.data.split("_")[1])
+
+    dp.callback_query.register(noop, lambda c: c.data == "about_method")
+    dp.callback_query.register(noop, lambda c: c.data == "show_legal")
+    dp.callback_query.register(noop, lambda c: c.data == "back_to_main")
+    dp.callback_query.register(noop, lambda c: c.data == "start_diagnostics")
+    dp.callback_query.register(noop, lambda c: c.data == "confirm_consent")
+    dp.callback_query.register(process_answer, lambda c: c.data.startswith(("first_", "branch_", "final_", "final_option1_", "final_option2_")))
+    dp.callback_query.register(process_branch_tie, lambda c: c.data.startswith("tie_branch_"))
+    dp.callback_query.register(noop, lambda c: c.data == "get_descriptions")
+    dp.callback_query.register(process_desc_count, lambda c: c.data.startswith("desc_"))
+    dp.callback_query.register(noop, lambda c: c.data == "cancel_desc")
+    return dp
+
+
+def routed_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+    router = CallbackRouter()
+    for tag, arity in [("about", 0), ("legal", 0), ("menu", 0), ("start", 0), ("consent", 0), ("q", 3),
+                       ("opt", 2), ("tie", 1), ("descs", 0), ("desc", 1), ("desc_cancel", 0)]:
+        router.route(tag, arity)(noop)
+
+    @dp.callback_query()
+    async def route_callback(callback: CallbackQuery, state: FSMContext):
+        return await router.dispatch(callback, state)
+
+    return dp
+
+
+def make_update(update_id: int, data: str) -> Update:
+    user = User(id=42, is_bot=False, first_name="Bench")
+    message = Message(message_id=1, date=datetime.now(), chat=Chat(id=42, type="private"))
+    return Update(
+        update_id=update_id,
+        callback_query=CallbackQuery(id=str(update_id), from_user=user, chat_instance="bench", message=message, data=data),
+    )
+
+
+async def measure(dp: Dispatcher, bot: Bot, updates: list) -> float:
+    for update in updates[:200]:  # прогрев
+        await dp.feed_update(bot, update)
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / len(updates)
+
+
+async def main(n: int) -> None:
+    bot = Bot(token="123456:BENCHMARK")
+    for column, name, dp in ((0, "lambda-фильтры", legacy_dispatcher()), (1, "CallbackRouter", routed_dispatcher())):
+        print(name)
+        total = []
+        for sample in SAMPLES:
+            updates = [make_update(i, sample[column]) for i in range(n)]
+            per_update = await measure(dp, bot, updates)
+            total.append(per_update)
+            print(f"  {sample[column]:<20} {per_update * 1e6:7.1f} мкс")
+        print(f"  {'среднее':<20} {sum(total) / len(total) * 1e6:7.1f} мкс")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
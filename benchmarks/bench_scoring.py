@@ -0,0 +1,49 @@
+"""
+Пакетный пересчёт баллов: ScoringEngine.score_batch против подсчёта по одной сессии.
+
+    python benchmarks/bench_scoring.py [сессий]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scoring as scoring_module
+from content import DEFAULT_DIR, ContentLibrary
+from render import KeyboardRegistry
+
+bundle = ContentLibrary(DEFAULT_DIR, KeyboardRegistry()).current
+scoring = bundle.scoring
+
+
+def main(n: int) -> None:
+    rng = random.Random(42)
+    first = [[rng.randint(1, 5) for _ in bundle.first_questions] for _ in range(n)]
+    branches = [rng.randrange(4) for _ in range(n)]
+    extra = [[rng.randint(1, 5) for _ in range(len(bundle.branch_questions["A"]))] for _ in range(n)]
+
+    started = time.perf_counter()
+    expected = scoring._score_batch_python(first, branches, extra)
+    expected_top = [[p for p, _ in scoring.top_programs(row)] for row in expected]
+    python_time = time.perf_counter() - started
+    print(f"по одной сессии: {n} сессий за {python_time:.2f} с")
+
+    if scoring_module.np is None:
+        print("NumPy не установлен — пакетный путь совпадает с построчным")
+        return
+
+    started = time.perf_counter()
+    batch = scoring.score_batch(first, branches, extra)
+    top = scoring.top_programs_batch(batch)
+    batch_time = time.perf_counter() - started
+    print(f"score_batch:     {n} сессий за {batch_time:.2f} с (x{python_time / batch_time:.1f})")
+
+    assert batch.tolist() == expected
+    assert top.tolist() == expected_top
+    print("результаты совпадают")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300_000)
@@ -0,0 +1,118 @@
+"""
+Память и стоимость доступа: сессия-словарь против упакованной Session.
+
+Меряется, сколько занимают N незавершённых сессий в середине ветки
+(tracemalloc) в трёх видах: прежний словарь FSM, словарь FSM с одной
+base64-строкой (так сессия лежит в хранилище) и живой объект Session.
+Затем — размер записи в хранилище и цикл ответа на вопрос через
+MemoryStorage: get_data → изменить → update_data.
+
+    python benchmarks/bench_session.py [сессий]
+"""
+import asyncio
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from scoring import BRANCHES
+from session import SESSION_KEY, Session, load_session, save_session
+
+PROGRAMS = 18
+FIRST_QUESTIONS = 10
+
+
+def dict_session(rng: random.Random, n: int) -> dict:
+    """Словарь в том виде, в каком его раньше держал бот"""
+    return {
+        "session_id": f"{n:012x}",
+        "consent_given": True,
+        "scores": [rng.randint(0, 30) for _ in range(PROGRAMS)],
+        "first_stage_answers": [rng.randint(1, 5) for _ in range(FIRST_QUESTIONS)],
+        "question_index": 10,
+        "stage": "branch",
+        "branch_questions_asked": rng.randint(0, 5),
+        "final_answers": {},
+        "current_branch": rng.choice(BRANCHES),
+        "start_time": "2024-05-01T12:00:00.000000",
+    }
+
+
+def packed_session(rng: random.Random, n: int) -> Session:
+    session = Session.new(PROGRAMS, FIRST_QUESTIONS, f"{n:012x}")
+    session.first_stage_answers[:] = bytes(rng.randint(1, 5) for _ in range(FIRST_QUESTIONS))
+    session.scores = [rng.randint(0, 30) for _ in range(PROGRAMS)]
+    session.question_index = 10
+    session.stage = "branch"
+    session.branch_questions_asked = rng.randint(0, 5)
+    session.current_branch = rng.choice(BRANCHES)
+    return session
+
+
+def measure(build, n: int) -> float:
+    """Байт на сессию, которые остаются занятыми после построения n сессий"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = [build(i) for i in range(n)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del items
+    return used / n
+
+
+async def answer_cycle(n: int) -> None:
+    storage = MemoryStorage()
+    key = StorageKey(bot_id=1, chat_id=1, user_id=1)
+    state = FSMContext(storage, key)
+    rng = random.Random(1)
+
+    await storage.set_data(key, dict_session(rng, 1))
+    started = time.perf_counter()
+    for i in range(n):
+        data = await state.get_data()
+        scores = data["scores"]
+        scores[i % PROGRAMS] += 1
+        await state.update_data(scores=scores, branch_questions_asked=data["branch_questions_asked"] + 1)
+    per_dict = (time.perf_counter() - started) / n
+
+    await storage.set_data(key, {SESSION_KEY: packed_session(rng, 1).dumps()})
+    started = time.perf_counter()
+    for i in range(n):
+        session = await load_session(state)
+        session.scores[i % PROGRAMS] = (session.scores[i % PROGRAMS] + 1) % 200
+        session.branch_questions_asked = (session.branch_questions_asked + 1) % 200
+        await save_session(state, session)
+    per_packed = (time.perf_counter() - started) / n
+
+    print(f"ответ на вопрос (get_data + update_data): словарь {per_dict * 1e6:.1f} мкс, "
+          f"Session {per_packed * 1e6:.1f} мкс")
+
+
+def main(n: int) -> None:
+    rng = random.Random(42)
+    as_dict = measure(lambda i: dict_session(rng, i), n)
+    as_fsm = measure(lambda i: {SESSION_KEY: packed_session(rng, i).dumps()}, n)
+    as_object = measure(lambda i: packed_session(rng, i), n)
+    print(f"сессий: {n}")
+    for title, per in (("словарь FSM", as_dict), ("FSM с упакованной строкой", as_fsm), ("объект Session", as_object)):
+        print(f"  {title:<28} {per:7.0f} Б/сессия  {per * n / 2**20:7.1f} МБ")
+    print(f"  экономия в хранилище: x{as_dict / as_fsm:.1f}")
+    # Столько байт на сессию пишут SQLite и Redis при каждом сбросе
+    as_json = len(json.dumps(dict_session(rng, 1)))
+    packed_json = len(json.dumps({SESSION_KEY: packed_session(rng, 1).dumps()}))
+    print(f"  JSON в хранилище: словарь {as_json} Б, упакованная {packed_json} Б")
+    asyncio.run(answer_cycle(100000))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,66 @@
+"""
+Замер задержки FSM-хранилища на одно обновление: MemoryStorage против SQLiteStorage.
+
+Каждое «обновление» повторяет то, что делает process_answer → ask_question:
+get_data, update_data, get_data. Запуск:
+
+    python benchmarks/bench_storage.py [пользователей] [ответов]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from storage import SQLiteStorage
+
+
+async def run(storage, users: int, answers: int) -> list:
+    keys = [StorageKey(bot_id=1, chat_id=i, user_id=i) for i in range(users)]
+    for key in keys:
+        await storage.set_data(key, {"scores": [0] * 18, "first_stage_answers": [0] * 10, "question_index": 0})
+
+    timings = []
+
+    async def user(key):
+        for i in range(answers):
+            started = time.perf_counter()
+            data = await storage.get_data(key)
+            data["first_stage_answers"][i % 10] = 3
+            await storage.update_data(key, {"first_stage_answers": data["first_stage_answers"], "question_index": i + 1})
+            await storage.get_data(key)
+            timings.append(time.perf_counter() - started)
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(user(key) for key in keys))
+    return timings
+
+
+def report(name: str, timings: list) -> None:
+    timings = sorted(timings)
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(f"{name:<14} обновлений={len(timings):>7}  среднее={statistics.mean(timings) * 1e6:8.1f} мкс  p99={p99 * 1e6:8.1f} мкс")
+
+
+async def main(users: int, answers: int) -> None:
+    report("MemoryStorage", await run(MemoryStorage(), users, answers))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SQLiteStorage(path=os.path.join(tmp, "bench.sqlite3"))
+        started = time.perf_counter()
+        timings = await run(storage, users, answers)
+        report("SQLiteStorage", timings)
+        await storage.close()
+        print(f"SQLiteStorage: всего с финальным сбросом на диск {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    answers = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    asyncio.run(main(users, answers))
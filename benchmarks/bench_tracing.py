@@ -0,0 +1,95 @@
+"""
+Цена трассировки на апдейт: выключена, включена с разной долей выборки.
+
+Настоящий Dispatcher.feed_update с FSM-хранилищем в памяти и хендлером,
+похожим на process_answer: чтение и запись данных состояния, подсчёт
+баллов в спане, вложенный вызов ask_question. Трассировка подключается
+так же, как в bot.py: TracingMiddleware, TracedStorage и traced только
+при включённой трассировке. Спаны пишутся в JSONL во временный файл.
+Кроме времени на апдейт печатается процессорное время потока цикла:
+экспорт идёт в своём потоке и в тесте без пауз отнимает у цикла GIL.
+
+    python benchmarks/bench_tracing.py [апдейтов]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from tracing import JsonlExporter, TracedStorage, Tracer, TracingMiddleware
+
+
+def callback_update(update_id: int) -> Update:
+    user = User(id=update_id % 500, is_bot=False, first_name="Load")
+    chat = Chat(id=user.id, type="private")
+    message = Message(message_id=1, date=datetime.now(), chat=chat, from_user=user, text="?")
+    query = CallbackQuery(id=str(update_id), from_user=user, chat_instance="c", message=message, data="q:0:2:3")
+    return Update(update_id=update_id, callback_query=query)
+
+
+def build(tracer: Tracer) -> Dispatcher:
+    storage = MemoryStorage()
+    dp = Dispatcher(storage=TracedStorage(storage, tracer) if tracer.enabled else storage)
+    if tracer.enabled:
+        dp.update.outer_middleware(TracingMiddleware(tracer))
+
+    @tracer.traced()
+    async def ask_question(state: FSMContext) -> None:
+        await state.get_data()
+
+    @dp.callback_query()
+    @tracer.traced("process_answer")
+    async def handler(callback: CallbackQuery, state: FSMContext) -> None:
+        data = await state.get_data()
+        with tracer.span("scoring.add_branch_answer"):
+            scores = data.get("scores", [0] * 18)
+            scores[callback.from_user.id % 18] += 1
+        await state.update_data(scores=scores)
+        await ask_question(state)
+
+    return dp
+
+
+async def run(sample: float, updates: int, path: str) -> tuple:
+    if os.path.exists(path):
+        os.remove(path)
+    exporter = JsonlExporter(path) if sample > 0 else None
+    tracer = Tracer(sample=sample, exporter=exporter)
+    dp = build(tracer)
+    bot = Bot("123456:BENCHMARK")
+    # Прогрев: данные состояния всех чатов уже есть
+    for i in range(500):
+        await dp.feed_update(bot, callback_update(i))
+    batch = [callback_update(i) for i in range(updates)]
+    started, cpu_started = time.perf_counter(), time.thread_time()
+    for update in batch:
+        await dp.feed_update(bot, update)
+    elapsed, cpu = time.perf_counter() - started, time.thread_time() - cpu_started
+    if exporter is not None:
+        exporter.close()
+    return elapsed / updates, cpu / updates
+
+
+async def main(updates: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = None
+        for title, sample in (("выключена", 0.0), ("1%", 0.01), ("10%", 0.1), ("100%", 1.0)):
+            path = os.path.join(tmp, f"{sample}.jsonl")
+            per_update, cpu = min([await run(sample, updates, path) for _ in range(3)])
+            baseline = baseline or cpu
+            spans = sum(1 for _ in open(path, encoding="utf-8")) if os.path.exists(path) else 0
+            print(f"трассировка {title:<10} {per_update * 1e6:7.1f} мкс/апдейт, поток цикла {cpu * 1e6:7.1f} мкс "
+                  f"(+{(cpu - baseline) * 1e6:5.1f}), спанов записано: {spans}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000))
@@ -0,0 +1,139 @@
+"""
+Локальная замена Telegram Bot API для нагрузочных тестов.
+
+Подключается к боту через TELEGRAM_API_URL (aiogram TelegramAPIServer.from_base).
+Отвечает на любой метод правдоподобным результатом, считает вызовы по методам
+и запоминает последнюю клавиатуру каждого чата (и сообщение, к которому она
+прикреплена), чтобы генератор нагрузки мог «нажимать» настоящие кнопки.
+Запрос, который бот вернул в ответе на вебхук, выполняется так же, как вызов
+(см. apply_webhook_response).
+"""
+import asyncio
+import json
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+from aiohttp import ClientResponse, MultipartReader, web
+
+# Методы, которые возвращают объект Message
+MESSAGE_METHODS = {"sendmessage", "editmessagetext", "editmessagereplymarkup", "sendphoto", "senddocument"}
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0, transit: float = 0.0) -> None:
+        # latency — задержка ответа на вызов, transit — путь запроса до «Telegram»
+        self.latency = latency
+        self.transit = transit
+        self.calls: Counter = Counter()
+        self.webhook_calls: Counter = Counter()
+        self.bytes_in = 0
+        self.keyboards: Dict[int, List[str]] = {}
+        self.keyboard_message: Dict[int, int] = {}
+        self.keyboard_version: Counter = Counter()
+        self.messages: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        # Время (perf_counter) последнего answerCallbackQuery по чату
+        self.answered: Dict[int, float] = {}
+        self.events: Dict[int, asyncio.Event] = defaultdict(asyncio.Event)
+        self._message_id = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> str:
+        app = web.Application(client_max_size=10 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f"http://{host}:{port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def reset(self) -> None:
+        self.calls.clear()
+        self.webhook_calls.clear()
+        self.bytes_in = 0
+        self.keyboards.clear()
+        self.keyboard_message.clear()
+        self.keyboard_version.clear()
+        self.messages.clear()
+        self.answered.clear()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        body = await request.read()
+        self.bytes_in += len(body)
+        params = await self._params(request, body)
+        self.calls[method] += 1
+        if self.transit:
+            await asyncio.sleep(self.transit)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": self.record(method, params)})
+
+    def record(self, method: str, params: Dict[str, Any]) -> Any:
+        """Запоминает вызов и возвращает результат, как его вернул бы Telegram"""
+        method = method.lower()
+        if method == "answercallbackquery":
+            chat_id = int(params.get("callback_query_id", "0").split(":")[0] or 0)
+            self.answered[chat_id] = time.perf_counter()
+            self.events[chat_id].set()
+        if method not in MESSAGE_METHODS:
+            return True
+        chat_id = int(params.get("chat_id") or 0)
+        markup = params.get("reply_markup")
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        self._message_id += 1
+        message_id = int(params.get("message_id") or self._message_id)
+        if markup and "inline_keyboard" in markup:
+            self.keyboards[chat_id] = [b["callback_data"] for row in markup["inline_keyboard"] for b in row]
+            self.keyboard_message[chat_id] = message_id
+            self.keyboard_version[chat_id] += 1
+        elif method == "editmessagetext" and self.keyboard_message.get(chat_id) == message_id:
+            # Клавиатура была у отредактированного сообщения и исчезла вместе с ним
+            self.keyboards.pop(chat_id, None)
+        self.messages[chat_id].append({
+            "method": method, "text": params.get("text", ""), "message_id": message_id, "at": time.perf_counter(),
+        })
+        self.events[chat_id].set()
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+    async def apply_webhook_response(self, response: ClientResponse) -> None:
+        """Выполняет запрос из тела ответа бота на вебхук, как это делает Telegram"""
+        if not response.content_type.startswith("multipart/"):
+            return
+        params: Dict[str, Any] = {}
+        async for part in MultipartReader.from_response(response):
+            params[part.name] = await part.text()
+        method = params.pop("method", None)
+        if method is None:
+            return
+        self.webhook_calls[method.lower()] += 1
+        if self.transit:
+            await asyncio.sleep(self.transit)
+        self.record(method, params)
+
+    @staticmethod
+    async def _params(request: web.Request, body: bytes) -> Dict[str, Any]:
+        if request.content_type.startswith("multipart/") or request.content_type == "application/x-www-form-urlencoded":
+            return dict(await request.post())
+        return json.loads(body) if body else {}
+
+
+async def main(port: int) -> None:
+    api = FakeBotAPI()
+    url = await api.start(port=port)
+    print(f"Fake Bot API: {url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    import sys
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 8081))
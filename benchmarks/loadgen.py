@@ -0,0 +1,372 @@
+"""
+Сквозной нагрузочный тест: тысячи пользователей проходят диагностику целиком.
+
+Бот запускается как есть (python bot.py) с Bot API, подменённым на FakeBotAPI
+через TELEGRAM_API_URL. Каждый виртуальный пользователь шлёт на /webhook
+настоящие апдейты: /start → «Начать» → согласие → общие вопросы → ветка
+(и тай-брейк) → финальные вопросы — и нажимает кнопки из клавиатур, которые
+бот на самом деле прислал. Диагностика считается пройденной, когда пришла
+клавиатура с результатами.
+
+Задержка обработки — время от отправки апдейта до первого запроса бота
+к Bot API в этот чат. Паузы, которые бот выдерживает намеренно (первый
+вопрос, результаты), ждутся отдельно и в задержку не входят. Для нажатий
+кнопок опроса отдельно считается время до следующего вопроса и до ответа
+на нажатие (пока его нет, клиент Telegram крутит индикатор на кнопке).
+
+--webhook-reply both прогоняет бота дважды, с WEBHOOK_REPLY=0 и 1, и сравнивает;
+--api-transit задаёт путь запроса до Telegram, без него выигрыш не виден.
+
+--update-workers 0,16 сравнивает ответ на вебхук после обработки и сразу
+(пул воркеров); медленные хендлеры даёт --api-latency.
+
+--restart-every N перезапускает бота под нагрузкой (SIGTERM и новый процесс)
+через N секунд после каждого запуска. Апдейт, на который бот не ответил 200,
+доставляется повторно, как это делает Telegram; нажатие, принятое, но оставшееся без ответа, —
+потерянное: такая сессия зависает и считается прерванной.
+
+    python benchmarks/loadgen.py --users 1000 [--ramp 10] [--think 2] [--workers 1]
+    python benchmarks/loadgen.py --users 200 --webhook-reply both --api-transit 0.03 --api-latency 0.03
+    python benchmarks/loadgen.py --users 300 --think 1 --restart-every 8
+    python benchmarks/loadgen.py --users 300 --think 1 --update-workers 0,16 --api-latency 0.3
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from aiohttp import ClientError, ClientSession, TCPConnector
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET = "loadgen"
+STEP_TIMEOUT = 60.0
+# Кнопки, которые ведут по опросу; остальные (меню, документы) пользователь не нажимает
+FLOW_PREFIXES = ("q:", "opt:", "tie:")
+RESULT_DATA = "descs"
+
+
+def message_update(update_id: int, chat_id: int, text: str) -> dict:
+    entities = [{"type": "bot_command", "offset": 0, "length": len(text)}] if text.startswith("/") else None
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "text": text,
+            **({"entities": entities} if entities else {}),
+        },
+    }
+
+
+def callback_update(update_id: int, chat_id: int, message_id: int, data: str) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": "Load"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            # По id ответа на нажатие фейковый API находит чат
+            "id": f"{chat_id}:{update_id}",
+            "from": user,
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bot"},
+                "text": "…",
+            },
+        },
+    }
+
+
+class LoadGenerator:
+    def __init__(self, api: FakeBotAPI, url: str, think: float, seed: int = 42) -> None:
+        self.api = api
+        self.url = url
+        self.think = think
+        self.rng = random.Random(seed)
+        self.latencies: List[float] = []
+        self.question_latencies: List[float] = []
+        self.answer_latencies: List[float] = []
+        # Время до HTTP-ответа на вебхук: столько Telegram ждёт, прежде чем слать следующий апдейт
+        self.ack_latencies: List[float] = []
+        self.updates = 0
+        self.redeliveries = 0
+        self.completed = 0
+        self.failed = 0
+        self._update_id = 0
+        self._http: Optional[ClientSession] = None
+
+    async def _post(self, update: dict) -> None:
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        backoff = 0.05
+        while True:
+            started = time.perf_counter()
+            try:
+                async with self._http.post(self.url, json=update, headers=headers) as response:
+                    self.ack_latencies.append(time.perf_counter() - started)
+                    if response.status == 200:
+                        self.updates += 1
+                        await self.api.apply_webhook_response(response)
+                        return
+                    await response.read()
+            except ClientError:
+                pass
+            self.redeliveries += 1
+            # Как и Telegram, повторяем доставку с нарастающей паузой, пока бот не примет апдейт
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 1.0)
+
+    async def _wait(self, chat_id: int, predicate) -> None:
+        event = self.api.events[chat_id]
+        deadline = time.perf_counter() + STEP_TIMEOUT
+        while True:
+            event.clear()
+            if predicate():
+                return
+            await asyncio.wait_for(event.wait(), deadline - time.perf_counter())
+
+    async def _send(self, chat_id: int, update: dict) -> float:
+        """Отправляет апдейт и ждёт первого ответа бота в чат; пишет задержку"""
+        messages = self.api.messages[chat_id]
+        sent = len(messages)
+        started = time.perf_counter()
+        await self._post(update)
+        await self._wait(chat_id, lambda: len(messages) > sent)
+        self.latencies.append(messages[sent]["at"] - started)
+        return started
+
+    async def _tap(self, chat_id: int, data: str) -> int:
+        """Нажимает кнопку и возвращает версию клавиатуры на момент нажатия"""
+        version = self.api.keyboard_version[chat_id]
+        self._update_id += 1
+        message_id = self.api.keyboard_message[chat_id]
+        sent = len(self.api.messages[chat_id])
+        started = await self._send(chat_id, callback_update(self._update_id, chat_id, message_id, data))
+        if data.startswith(FLOW_PREFIXES):
+            self.question_latencies.append(self.api.messages[chat_id][sent]["at"] - started)
+            await self._wait(chat_id, lambda: self.api.answered.get(chat_id, 0) > started)
+            self.answer_latencies.append(self.api.answered[chat_id] - started)
+        return version
+
+    async def _next_keyboard(self, chat_id: int, version: int) -> List[str]:
+        await self._wait(chat_id, lambda: self.api.keyboard_version[chat_id] > version and chat_id in self.api.keyboards)
+        return self.api.keyboards[chat_id]
+
+    async def user(self, chat_id: int) -> None:
+        try:
+            self._update_id += 1
+            await self._send(chat_id, message_update(self._update_id, chat_id, "/start"))
+            await self._wait(chat_id, lambda: chat_id in self.api.keyboards)
+            for data in ("start", "consent"):
+                version = await self._tap(chat_id, data)
+                if data == "start":
+                    await self._next_keyboard(chat_id, version)
+            # Первый вопрос приходит после паузы — ждём его клавиатуру
+            buttons = await self._next_keyboard(chat_id, version)
+            while RESULT_DATA not in buttons:
+                if self.think:
+                    # Быстрее ~1 ответа в секунду упрёмся в початовый лимит Telegram, а не в бота
+                    await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.think)
+                choices = [b for b in buttons if b.startswith(FLOW_PREFIXES)]
+                version = await self._tap(chat_id, self.rng.choice(choices))
+                buttons = await self._next_keyboard(chat_id, version)
+            self.completed += 1
+        except (asyncio.TimeoutError, IndexError, KeyError) as e:
+            self.failed += 1
+            print(f"чат {chat_id}: сессия прервана ({type(e).__name__})", file=sys.stderr)
+
+    async def run(self, users: int, ramp: float, first_chat: int = 10_000) -> float:
+        async with ClientSession(connector=TCPConnector(limit=256)) as http:
+            self._http = http
+            started = time.perf_counter()
+            tasks = []
+            for n in range(users):
+                tasks.append(asyncio.create_task(self.user(first_chat + n)))
+                if ramp:
+                    await asyncio.sleep(ramp / users)
+            await asyncio.gather(*tasks)
+            return time.perf_counter() - started
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def report(gen: LoadGenerator, api: FakeBotAPI, elapsed: float) -> Dict[str, float]:
+    calls = sum(api.calls.values())
+    completed = gen.completed or 1
+    lat = gen.latencies or [0.0]
+    question = gen.question_latencies or [0.0]
+    answer = gen.answer_latencies or [0.0]
+    ack = gen.ack_latencies or [0.0]
+    result = {
+        "completed": gen.completed,
+        "failed": gen.failed,
+        "updates_per_s": gen.updates / elapsed,
+        "p50_ms": percentile(lat, 0.50) * 1000,
+        "p95_ms": percentile(lat, 0.95) * 1000,
+        "p99_ms": percentile(lat, 0.99) * 1000,
+        "question_p50_ms": percentile(question, 0.50) * 1000,
+        "question_p95_ms": percentile(question, 0.95) * 1000,
+        "answer_p50_ms": percentile(answer, 0.50) * 1000,
+        "answer_p95_ms": percentile(answer, 0.95) * 1000,
+        "ack_p50_ms": percentile(ack, 0.50) * 1000,
+        "ack_p99_ms": percentile(ack, 0.99) * 1000,
+        "ack_max_ms": max(ack) * 1000,
+        "calls_per_diagnostic": calls / completed,
+        "bytes_per_diagnostic": api.bytes_in / completed,
+    }
+    print(f"пройдено: {gen.completed}, прервано: {gen.failed}, за {elapsed:.1f} с")
+    print(f"апдейтов: {gen.updates} ({result['updates_per_s']:.1f}/с)")
+    print(f"задержка: p50={result['p50_ms']:.1f} мс  p95={result['p95_ms']:.1f} мс  "
+          f"p99={result['p99_ms']:.1f} мс  среднее={statistics.mean(lat) * 1000:.1f} мс")
+    print(f"нажатие → следующий вопрос: p50={result['question_p50_ms']:.1f} мс  p95={result['question_p95_ms']:.1f} мс; "
+          f"→ ответ на нажатие: p50={result['answer_p50_ms']:.1f} мс  p95={result['answer_p95_ms']:.1f} мс")
+    print(f"ответ на вебхук: p50={result['ack_p50_ms']:.1f} мс  p99={result['ack_p99_ms']:.1f} мс  "
+          f"max={result['ack_max_ms']:.1f} мс; повторных доставок: {gen.redeliveries}")
+    print(f"запросов к Bot API на диагностику: {result['calls_per_diagnostic']:.1f} "
+          f"({result['bytes_per_diagnostic'] / 1024:.1f} КБ)")
+    for method, count in api.calls.most_common():
+        print(f"  {method:<24} {count / completed:6.2f}")
+    for method, count in api.webhook_calls.most_common():
+        print(f"  {method:<24} {count / completed:6.2f}  (в ответе на вебхук)")
+    return result
+
+
+async def run_bot(args: argparse.Namespace, api: FakeBotAPI, api_url: str, extra_env: Dict[str, str]) -> Dict[str, float]:
+    env = {
+        **os.environ,
+        "BOT_TOKEN": "123456:LOADGEN",
+        "TELEGRAM_API_URL": api_url,
+        "WEBHOOK_URL": "http://127.0.0.1",
+        "WEBHOOK_SECRET": SECRET,
+        "PORT": str(args.port),
+        "WORKER_BASE_PORT": str(args.port + 1),
+        "WEB_WORKERS": str(args.workers),
+        # Меряем бота, а не общий лимит Telegram в 30 сообщений/с
+        "TELEGRAM_GLOBAL_RATE": str(args.global_rate),
+        **extra_env,
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        env.setdefault("FSM_DB_PATH", os.path.join(tmp, "fsm.sqlite3"))
+        env.setdefault("EVENT_LOG_DIR", os.path.join(tmp, "events"))
+        env.setdefault("RESULTS_DB_PATH", os.path.join(tmp, "results.sqlite3"))
+        env.setdefault("OUTBOX_DB_PATH", os.path.join(tmp, "outbox.sqlite3"))
+        log = open(args.bot_log, "ab") if args.bot_log else asyncio.subprocess.DEVNULL
+
+        def spawn():
+            return asyncio.create_subprocess_exec(
+                sys.executable, os.path.join(ROOT, "bot.py"), env=env, stdout=log, stderr=log,
+            )
+
+        process = await spawn()
+        restarts = 0
+
+        # Готов тот процесс, что обрабатывает апдейты: одиночный бот или все воркеры кластера
+        ready_ports = [args.port] if args.workers <= 1 else [args.port + 1 + i for i in range(args.workers)]
+
+        async def wait_ready() -> None:
+            async with ClientSession() as http:
+                for port in ready_ports:
+                    while True:
+                        try:
+                            async with http.get(f"http://127.0.0.1:{port}/metrics") as response:
+                                if response.status == 200:
+                                    break
+                        except ClientError:
+                            pass
+                        await asyncio.sleep(0.1)
+
+        async def restart_loop() -> None:
+            nonlocal process, restarts
+            while True:
+                # Интервал считается от готовности: импорт aiogram занимает секунды
+                await wait_ready()
+                await asyncio.sleep(args.restart_every)
+                # Как при деплое: SIGTERM, дождаться выхода, поднять новый процесс на тех же данных
+                process.terminate()
+                await process.wait()
+                process = await spawn()
+                restarts += 1
+
+        try:
+            # Ждём, пока бот поднимется и зарегистрирует вебхук
+            while not api.calls["setwebhook"]:
+                await asyncio.sleep(0.1)
+            api.reset()
+            gen = LoadGenerator(api, f"http://127.0.0.1:{args.port}/webhook", args.think)
+            restarter = asyncio.create_task(restart_loop()) if args.restart_every else None
+            elapsed = await gen.run(args.users, args.ramp)
+            if restarter is not None:
+                restarter.cancel()
+            result = report(gen, api, elapsed)
+            if args.restart_every:
+                print(f"перезапусков бота: {restarts}")
+            return result
+        finally:
+            if process.returncode is None:
+                process.terminate()
+            await process.wait()
+
+
+async def main(args: argparse.Namespace) -> None:
+    api = FakeBotAPI(latency=args.api_latency, transit=args.api_transit)
+    api_url = await api.start(port=args.api_port)
+    # Варианты окружения бота: название → переменные
+    variants: Dict[str, Dict[str, str]] = {}
+    if args.webhook_reply == "both":
+        variants = {f"WEBHOOK_REPLY={v}": {"WEBHOOK_REPLY": v} for v in ("0", "1")}
+        keys = ("question_p50_ms", "question_p95_ms", "answer_p50_ms", "answer_p95_ms", "p95_ms")
+    elif args.update_workers:
+        base = {"WEBHOOK_REPLY": args.webhook_reply} if args.webhook_reply else {}
+        variants = {
+            f"UPDATE_WORKERS={n}": {**base, "UPDATE_WORKERS": n, "UPDATE_QUEUE": str(args.update_queue)}
+            for n in args.update_workers.split(",")
+        }
+        keys = ("ack_p50_ms", "ack_p99_ms", "ack_max_ms", "question_p50_ms", "p95_ms")
+    else:
+        variants = {"": {"WEBHOOK_REPLY": args.webhook_reply} if args.webhook_reply else {}}
+    results = {}
+    for title, env in variants.items():
+        if title:
+            print(f"--- {title}")
+        results[title] = await run_bot(args, api, api_url, env)
+    if len(results) > 1:
+        (first, before), *_, (last, after) = results.items()
+        print(f"--- сравнение ({first} → {last})")
+        for key in keys:
+            print(f"  {key:<18} {before[key]:8.1f} → {after[key]:8.1f} мс")
+        print(f"  {'calls_per_diagnostic':<18} {before['calls_per_diagnostic']:8.1f} → {after['calls_per_diagnostic']:8.1f}")
+    await api.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сквозная нагрузка на bot.py через фейковый Bot API")
+    parser.add_argument("--users", type=int, default=1000, help="виртуальных пользователей")
+    parser.add_argument("--ramp", type=float, default=10.0, help="за сколько секунд подключить всех")
+    parser.add_argument("--think", type=float, default=2.0, help="средняя пауза перед ответом, с")
+    parser.add_argument("--workers", type=int, default=1, help="WEB_WORKERS бота")
+    parser.add_argument("--global-rate", type=float, default=1_000_000, help="TELEGRAM_GLOBAL_RATE бота")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа фейкового API, с")
+    parser.add_argument("--api-transit", type=float, default=0.0, help="путь запроса от бота до фейкового API, с")
+    parser.add_argument("--bot-log", help="файл для вывода бота (по умолчанию выбрасывается)")
+    parser.add_argument("--restart-every", type=float, default=0.0, help="перезапускать бота каждые N секунд")
+    parser.add_argument("--webhook-reply", choices=("0", "1", "both"), help="WEBHOOK_REPLY бота; both — сравнить")
+    parser.add_argument("--update-workers", help="UPDATE_WORKERS бота через запятую, например 0,16 — сравнить")
+    parser.add_argument("--update-queue", type=int, default=1000, help="UPDATE_QUEUE бота")
+    parser.add_argument("--port", type=int, default=18200)
+    parser.add_argument("--api-port", type=int, default=18281)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,363 @@
+import asyncio
+import calendar
+import logging
+import os
+import re
+import sqlite3
+import time
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from aiogram.types import InlineKeyboardMarkup
+
+from callbacks import pack
+from render import KeyboardRegistry
+
+logger = logging.getLogger(__name__)
+
+MONTHS = ("Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+          "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь")
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+# Кнопка без действия: пустые клетки календаря, заголовки
+NOOP = pack("bnone")
+EMPTY = "·"
+SLOTS_PER_ROW = 4
+
+
+def month_key(day: date) -> int:
+    """Номер месяца для callback_data и кэша: год * 12 + месяц - 1"""
+    return day.year * 12 + day.month - 1
+
+
+# ==================== РАБОЧИЕ ЧАСЫ ====================
+class Schedule:
+    """
+    Рабочие часы практика: дни недели (1 — понедельник), начало и конец
+    дня в минутах, длина слота, на сколько дней вперёд открыта запись
+    и часовой пояс, в котором всё это задано.
+    """
+
+    def __init__(
+        self,
+        weekdays: FrozenSet[int] = frozenset(range(1, 6)),
+        start: int = 10 * 60,
+        end: int = 19 * 60,
+        slot: int = 60,
+        days_ahead: int = 30,
+        tz: timezone = timezone(timedelta(hours=3)),
+    ) -> None:
+        if not 0 <= start < end <= 24 * 60 or slot <= 0:
+            raise ValueError(f"Неверные рабочие часы: {start}-{end}, слот {slot}")
+        self.weekdays = weekdays
+        self.start = start
+        self.slot = slot
+        self.slots_per_day = (end - start) // slot
+        self.days_ahead = days_ahead
+        self.tz = tz
+
+    def is_working(self, day: int) -> bool:
+        return date.fromordinal(day).isoweekday() in self.weekdays
+
+    def slot_time(self, slot: int) -> str:
+        minutes = self.start + slot * self.slot
+        return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+    def now(self) -> datetime:
+        return datetime.now(self.tz)
+
+    def first_open_slot(self, now: datetime) -> int:
+        """Первый слот сегодня, который ещё не начался"""
+        minutes = now.hour * 60 + now.minute
+        return max(0, -(-(minutes - self.start) // self.slot))
+
+
+def schedule_from_env() -> Schedule:
+    """
+    Рабочие часы из окружения: BOOKING_HOURS=10:00-19:00, BOOKING_WEEKDAYS=1-5
+    (или 1,3,5), BOOKING_SLOT_MINUTES=60, BOOKING_DAYS_AHEAD=30, BOOKING_UTC_OFFSET=3.
+    """
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})", os.getenv("BOOKING_HOURS", "10:00-19:00"))
+    if not match:
+        raise ValueError("BOOKING_HOURS: нужен формат ЧЧ:ММ-ЧЧ:ММ")
+    h1, m1, h2, m2 = map(int, match.groups())
+    weekdays = set()
+    for part in os.getenv("BOOKING_WEEKDAYS", "1-5").split(","):
+        first, _, last = part.partition("-")
+        weekdays.update(range(int(first), int(last or first) + 1))
+    return Schedule(
+        weekdays=frozenset(weekdays),
+        start=h1 * 60 + m1,
+        end=h2 * 60 + m2,
+        slot=int(os.getenv("BOOKING_SLOT_MINUTES", "60")),
+        days_ahead=int(os.getenv("BOOKING_DAYS_AHEAD", "30")),
+        tz=timezone(timedelta(hours=float(os.getenv("BOOKING_UTC_OFFSET", "3")))),
+    )
+
+
+# ==================== ИНДЕКС СЛОТОВ ====================
+class SlotCalendar:
+    """
+    Занятость слотов в памяти: на каждый рабочий день — битовая маска занятых
+    слотов (бит i — слот i), плюс отсортированный список дней, где есть
+    свободные слоты. Первый свободный слот дня — одна операция над маской,
+    ближайший день со свободными слотами и дни месяца — bisect по списку,
+    O(log n). ``take`` проверяет и занимает слот без await, поэтому в одном
+    процессе двое один слот не получат. ``versions`` меняется у месяца,
+    когда какой-то его день заполнился или освободился, — по нему
+    перестраивается клавиатура месяца.
+    """
+
+    def __init__(self, schedule: Schedule) -> None:
+        self.schedule = schedule
+        self.full = (1 << schedule.slots_per_day) - 1
+        self._busy: Dict[int, int] = {}
+        self._free_days: List[int] = []
+        self.versions: Dict[int, int] = {}
+        self.first_day = 0
+        self.last_day = -1
+
+    def roll(self, today: int) -> None:
+        """Открывает запись на дни по today + days_ahead и забывает прошедшие"""
+        if today > self.first_day:
+            for day in [d for d in self._busy if d < today]:
+                del self._busy[day]
+            del self._free_days[:bisect_left(self._free_days, today)]
+            self.first_day = today
+        for day in range(max(today, self.last_day + 1), today + self.schedule.days_ahead + 1):
+            if self.schedule.is_working(day):
+                self._busy[day] = 0
+                self._free_days.append(day)
+        self.last_day = max(self.last_day, today + self.schedule.days_ahead)
+
+    def __contains__(self, day: int) -> bool:
+        """Рабочий день из окна, открытого для записи"""
+        return day in self._busy
+
+    def mark(self, day: int, slot: int) -> None:
+        """Отмечает слот занятым (при загрузке из базы)"""
+        if day in self._busy:
+            self._set(day, self._busy[day] | 1 << slot)
+
+    def _set(self, day: int, mask: int) -> None:
+        was_full = self._busy[day] == self.full
+        self._busy[day] = mask
+        is_full = mask == self.full
+        if was_full == is_full:
+            return
+        if is_full:
+            del self._free_days[bisect_left(self._free_days, day)]
+        else:
+            insort(self._free_days, day)
+        key = month_key(date.fromordinal(day))
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def free_mask(self, day: int, after: int = 0) -> int:
+        """Маска свободных слотов дня начиная со слота after; 0 — свободных нет или день нерабочий"""
+        busy = self._busy.get(day)
+        if busy is None:
+            return 0
+        return ~busy & self.full & ~((1 << after) - 1)
+
+    def free_slots(self, day: int, after: int = 0) -> List[int]:
+        mask = self.free_mask(day, after)
+        slots = []
+        while mask:
+            low = mask & -mask
+            slots.append(low.bit_length() - 1)
+            mask ^= low
+        return slots
+
+    def first_free(self, day: int, after: int = 0) -> Optional[int]:
+        mask = self.free_mask(day, after)
+        return (mask & -mask).bit_length() - 1 if mask else None
+
+    def next_free_day(self, day: int) -> Optional[int]:
+        """Ближайший день не раньше day, где есть свободный слот"""
+        i = bisect_left(self._free_days, day)
+        return self._free_days[i] if i < len(self._free_days) else None
+
+    def free_days(self, first: int, last: int) -> List[int]:
+        """Дни со свободными слотами в [first, last]"""
+        return self._free_days[bisect_left(self._free_days, first):bisect_left(self._free_days, last + 1)]
+
+    def take(self, day: int, slot: int) -> bool:
+        """Занимает слот, если он свободен"""
+        busy = self._busy.get(day)
+        if busy is None or not 0 <= slot < self.schedule.slots_per_day or busy >> slot & 1:
+            return False
+        self._set(day, busy | 1 << slot)
+        return True
+
+    def release(self, day: int, slot: int) -> None:
+        busy = self._busy.get(day)
+        if busy is not None:
+            self._set(day, busy & ~(1 << slot))
+
+
+# ==================== ЗАПИСИ ====================
+class BookingStore:
+    """
+    Записи на консультации: SQLite и индекс свободных слотов в памяти.
+
+    ``reserve`` сначала занимает слот в индексе (атомарно в процессе), затем
+    вставляет строку; первичный ключ (day, slot) не даст занять слот второй
+    раз, даже если в ту же базу пишут несколько процессов. Проигравшему
+    процессу вставка ответит отказом, и слот останется занятым и в его индексе.
+    Клавиатуры месяцев и дней собираются заранее и пересобираются, только
+    когда меняется то, что на них видно.
+    """
+
+    def __init__(self, path: str, schedule: Schedule, registry: KeyboardRegistry) -> None:
+        self.schedule = schedule
+        self.registry = registry
+        self.calendar = SlotCalendar(schedule)
+        self.reserved = 0
+        self.conflicts = 0
+        self._months: Dict[int, Tuple[tuple, InlineKeyboardMarkup]] = {}
+        self._days: Dict[int, Tuple[tuple, InlineKeyboardMarkup]] = {}
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="booking")
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bookings (day INTEGER NOT NULL, slot INTEGER NOT NULL, "
+            "user_id INTEGER NOT NULL, service TEXT NOT NULL, name TEXT NOT NULL, phone TEXT NOT NULL, "
+            "created REAL NOT NULL, PRIMARY KEY (day, slot))"
+        )
+
+        today = self.schedule.now().date().toordinal()
+        self.calendar.roll(today)
+        for day, slot in self._conn.execute("SELECT day, slot FROM bookings WHERE day >= ?", (today,)):
+            self.calendar.mark(day, slot)
+        # Клавиатуры всех открытых месяцев — сразу
+        for key in range(month_key(date.fromordinal(today)), month_key(date.fromordinal(self.calendar.last_day)) + 1):
+            self.month_keyboard(key)
+
+    # ---------- доступ к базе (выполняется в потоке) ----------
+    def _insert(self, row: tuple) -> bool:
+        try:
+            self._conn.execute(
+                "INSERT INTO bookings (day, slot, user_id, service, name, phone, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # ---------- время ----------
+    def today(self) -> Tuple[int, int]:
+        """Сегодняшний день и первый ещё не начавшийся слот; заодно сдвигает окно записи"""
+        now = self.schedule.now()
+        today = now.date().toordinal()
+        if today != self.calendar.first_day:
+            self.calendar.roll(today)
+            for day in [d for d in self._days if d < today]:
+                self.registry.discard(self._days.pop(day)[1])
+            current = month_key(now.date())
+            for key in [k for k in self._months if k < current]:
+                self.registry.discard(self._months.pop(key)[1])
+        return today, self.schedule.first_open_slot(now)
+
+    def open_slots(self, day: int) -> List[int]:
+        """Свободные слоты дня, которые ещё не начались"""
+        today, first_slot = self.today()
+        if day < today:
+            return []
+        return self.calendar.free_slots(day, first_slot if day == today else 0)
+
+    def months(self) -> Tuple[int, int]:
+        """Первый и последний месяц, открытые для записи"""
+        today, _ = self.today()
+        return month_key(date.fromordinal(today)), month_key(date.fromordinal(self.calendar.last_day))
+
+    # ---------- запись ----------
+    async def reserve(self, day: int, slot: int, user_id: int, service: str, name: str, phone: str) -> bool:
+        """Занимает слот; False — его уже заняли"""
+        if slot not in self.open_slots(day) or not self.calendar.take(day, slot):
+            self.conflicts += 1
+            return False
+        try:
+            won = await self._run(self._insert, (day, slot, user_id, service, name, phone, time.time()))
+        except Exception:
+            self.calendar.release(day, slot)
+            raise
+        if won:
+            self.reserved += 1
+        else:
+            # Слот занят другим процессом — в индексе он уже отмечен
+            self.conflicts += 1
+        return won
+
+    # ---------- клавиатуры ----------
+    def _cached(self, cache: Dict[int, Tuple[tuple, InlineKeyboardMarkup]], key: int, signature: tuple, build):
+        entry = cache.get(key)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        markup = self.registry.markup(build())
+        if entry is not None:
+            self.registry.discard(entry[1])
+        cache[key] = (signature, markup)
+        return markup
+
+    def month_keyboard(self, key: int) -> InlineKeyboardMarkup:
+        """Календарь месяца: рабочие дни со свободными слотами — кнопки, остальное — точки"""
+        today, first_slot = self.today()
+        first, last = self.months()
+        key = min(max(key, first), last)
+        # Сегодняшний день закрывается, когда начался его последний свободный слот
+        today_open = self.calendar.first_free(today, first_slot) is not None
+        signature = (self.calendar.versions.get(key, 0), today, today_open)
+        return self._cached(self._months, key, signature, lambda: self._month_rows(key, today, today_open, first, last))
+
+    def _month_rows(self, key: int, today: int, today_open: bool, first: int, last: int) -> list:
+        year, month = divmod(key, 12)
+        month += 1
+        open_days = set(self.calendar.free_days(today if today_open else today + 1, self.calendar.last_day))
+        rows = [[
+            ("‹", pack("bmon", key - 1)) if key > first else (EMPTY, NOOP),
+            (f"{MONTHS[month - 1]} {year}", NOOP),
+            ("›", pack("bmon", key + 1)) if key < last else (EMPTY, NOOP),
+        ], [(name, NOOP) for name in WEEKDAYS]]
+        for week in calendar.Calendar().monthdatescalendar(year, month):
+            # Прошедшие недели и недели за горизонтом записи не показываем
+            if week[-1].toordinal() < today or week[0].toordinal() > self.calendar.last_day:
+                continue
+            row = []
+            for day in week:
+                ordinal = day.toordinal()
+                if day.month == month and ordinal in open_days:
+                    row.append((str(day.day), pack("bday", ordinal)))
+                else:
+                    row.append((EMPTY, NOOP))
+            rows.append(row)
+        rows.append([("Отмена", pack("bcancel"))])
+        return rows
+
+    def day_keyboard(self, day: int) -> InlineKeyboardMarkup:
+        """Свободное время дня, по SLOTS_PER_ROW в ряд"""
+        slots = self.open_slots(day)
+        key = month_key(date.fromordinal(day))
+
+        def build() -> list:
+            buttons = [(self.schedule.slot_time(s), pack("bslot", day, s)) for s in slots]
+            rows = [buttons[i:i + SLOTS_PER_ROW] for i in range(0, len(buttons), SLOTS_PER_ROW)]
+            rows.append([("‹ Другой день", pack("bmon", key)), ("Отмена", pack("bcancel"))])
+            return rows
+
+        return self._cached(self._days, day, tuple(slots), build)
+
+    def describe(self, day: int, slot: int) -> str:
+        """Дата и время слота для сообщений: «12.03 (чт), 15:00»"""
+        value = date.fromordinal(day)
+        return f"{value:%d.%m} ({WEEKDAYS[value.weekday()].lower()}), {self.schedule.slot_time(slot)}"
+
+    async def close(self) -> None:
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
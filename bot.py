@@ -1,26 +1,64 @@
 import asyncio
 import logging
 import re
-from datetime import datetime
-
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import CommandStart
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery
+import signal
+import time
+from contextlib import suppress
+from datetime import date
+from typing import List, Optional
+
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandStart
+from aiogram.methods import TelegramMethod
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
 import os
 
 from aiohttp import web
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
-# Импорт календаря
-from aiogram_calendar import SimpleCalendar, SimpleCalendarCallback
+from adaptive import AdaptivePlanner
+from booking import BookingStore, month_key, schedule_from_env
+from cluster import run_cluster
+from callbacks import STAGE_BRANCH, STAGE_FINAL, STAGE_FIRST, CallbackRouter, pack
+from content import DEFAULT_DIR, ContentBundle, ContentError, ContentLibrary
+from delivery import DelayedSender
+from drain import WebhookDrain
+import eventlog
+from eventlog import EventLog
+from logs import LogContextMiddleware, LogPipeline, level_value, parse_rules
+from metrics import (
+    ApiMetricsMiddleware, InstrumentedStorage, LoopLagMonitor, Registry, UpdateMetricsMiddleware, timed,
+)
+from ordering import ChatIsolation, ChatOrderMiddleware
+from outbox import LeadOutbox
+from pool import PooledRequestHandler, UpdatePool
+from results import Result, ResultsStore
+from ratelimit import OutboundLimiter
+from render import KeyboardRegistry, PreparedMarkupSession, question_text
+from session import Session, load_session, save_session, session_stage
+from storage import ExpiringStorage, build_storage, iter_session_data
+from tracing import (
+    JsonlExporter, OtlpExporter, TracedStorage, Tracer, TracingMiddleware, TracingRequestMiddleware,
+)
 
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
+# Логи: запись из цикла событий только кладётся в очередь, форматирует и пишет
+# в stderr отдельный поток. LOG_FORMAT=json|text, LOG_LEVELS=aiogram.event=WARNING,
+# LOG_SAMPLE=aiogram.event=0.01,process_answer=0.1 (доля записей ниже WARNING)
+log_pipeline = LogPipeline(
+    level=level_value(os.getenv("LOG_LEVEL", "INFO")),
+    fmt=os.getenv("LOG_FORMAT", "json"),
+    sample=parse_rules(os.getenv("LOG_SAMPLE", ""), float),
+    levels=parse_rules(os.getenv("LOG_LEVELS", ""), level_value),
+    capacity=int(os.getenv("LOG_QUEUE", "10000")),
+)
+log_pipeline.install()
 logger = logging.getLogger(__name__)
 
 ADMIN_ID = 217336060  # Твой ID
@@ -29,9 +67,164 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("❌ BOT_TOKEN не задан! Добавьте его в Railway.")
 
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+# Процесс-воркер кластера (см. cluster.py): слушает только локальный порт
+WORKER_PORT = os.getenv("WORKER_PORT")
+# edit — следующий вопрос заменяет отвеченный в том же сообщении; send — каждый вопрос новым сообщением
+QUESTION_MODE = os.getenv("QUESTION_MODE", "edit")
+# Сколько секунд при остановке ждать принятые апдейты и отложенные отправки
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "25"))
+# Больше нуля — вебхук отвечает сразу, апдейты обрабатывает пул из стольких воркеров
+# (только одиночный процесс: воркеры кластера отвечают после обработки)
+UPDATE_WORKERS = 0 if WORKER_PORT else int(os.getenv("UPDATE_WORKERS", "0"))
+# Сколько апдейтов ждут в очереди пула; сверх этого вебхук отвечает 503
+UPDATE_QUEUE = int(os.getenv("UPDATE_QUEUE", "1000"))
+# WEBHOOK_REPLY=1 — следующий вопрос после нажатия уходит в HTTP-ответе на вебхук, а не отдельным
+# запросом к Bot API. Цена — апдейты одиночного процесса обрабатываются до ответа Telegram, и
+# медленный хендлер задерживает доставку следующих; при ответе до обработки (UPDATE_WORKERS) невозможно
+WEBHOOK_REPLY = os.getenv("WEBHOOK_REPLY", "0") == "1" and not UPDATE_WORKERS
+# Адаптивный опрос (adaptive.py): вопросы, ответ на которые уже не изменит ветку и топ-3, не задаются.
+# ADAPTIVE_CONFIDENCE < 1 — этап заканчивается, как только итог совпадает с полным опросом с такой
+# вероятностью (ADAPTIVE_SAMPLES розыгрышей по ADAPTIVE_PRIOR — весам ответов 1–5, см. python adaptive.py --fit)
+ADAPTIVE_QUESTIONS = os.getenv("ADAPTIVE_QUESTIONS", "1") != "0"
+planner = AdaptivePlanner(
+    confidence=float(os.getenv("ADAPTIVE_CONFIDENCE", "1")),
+    samples=int(os.getenv("ADAPTIVE_SAMPLES", "200")),
+    prior=[float(w) for w in os.getenv("ADAPTIVE_PRIOR", "").split(",") if w.strip()],
+)
+
+# Метрики Prometheus (GET /metrics)
+metrics = Registry()
+handler_seconds = metrics.histogram("bot_handler_seconds", "Время работы хендлеров", ["handler"])
+update_seconds = metrics.histogram("bot_update_seconds", "Время обработки апдейта", ["type"])
+update_errors = metrics.counter("bot_update_errors_total", "Апдейты, завершившиеся исключением", ["type"])
+storage_seconds = metrics.histogram("bot_storage_seconds", "Операции FSM-хранилища", ["op"])
+api_seconds = metrics.histogram("bot_api_request_seconds", "Запросы к Bot API", ["method"])
+api_errors = metrics.counter("bot_api_errors_total", "Ошибки запросов к Bot API", ["method", "error"])
+webhook_replies = metrics.counter("bot_webhook_replies_total", "Запросы, отданные Telegram в ответе на вебхук", ["method"])
+sessions_evicted = metrics.counter("bot_sessions_evicted_total", "Брошенные сессии, удалённые из хранилища", ["reason"])
+questions_skipped = metrics.counter("bot_questions_skipped_total", "Вопросы, пропущенные адаптивным опросом", ["stage"])
+# update — повторная доставка апдейта, tap — повторное нажатие по уже отвеченному вопросу
+duplicates_dropped = metrics.counter("bot_duplicates_dropped_total", "Повторы, отброшенные без обработки", ["kind"])
+loop_lag = LoopLagMonitor(metrics.histogram(
+    "bot_event_loop_lag_seconds", "Опоздание цикла событий", buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+))
+
+# Трассировка апдейтов: TRACE_SAMPLE — доля трассируемых апдейтов (0 — выключена),
+# спаны пишутся в TRACE_FILE или, если задан TRACE_OTLP_URL, в коллектор OpenTelemetry
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", "0"))
+tracer = Tracer(
+    sample=TRACE_SAMPLE,
+    exporter=(
+        (OtlpExporter(os.environ["TRACE_OTLP_URL"]) if os.getenv("TRACE_OTLP_URL")
+         else JsonlExporter(os.getenv("TRACE_FILE", "traces.jsonl")))
+        if TRACE_SAMPLE > 0 else None
+    ),
+)
+
+keyboards = KeyboardRegistry()
+# TELEGRAM_API_URL — свой сервер Bot API (локальный или тестовый)
+api_url = os.getenv("TELEGRAM_API_URL")
+session = PreparedMarkupSession(keyboards, **({"api": TelegramAPIServer.from_base(api_url)} if api_url else {}))
+bot = Bot(token=BOT_TOKEN, session=session)
+if tracer.enabled:
+    # Снаружи лимитера: в спан запроса входит и ожидание токена
+    bot.session.middleware(TracingRequestMiddleware(tracer))
+# Все исходящие запросы идут через общий и початовый лимиты Telegram;
+# в кластере общий лимит бота делится поровну между воркерами
+outbound = OutboundLimiter(
+    global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", "30")) / int(os.getenv("WEB_WORKERS", "1"))
+)
+bot.session.middleware(outbound)
+# Внутри лимитера: замеряется сам запрос (и каждый повтор), без ожидания токена
+bot.session.middleware(ApiMetricsMiddleware(api_seconds, api_errors))
+fsm_storage = build_storage(on_evict=sessions_evicted.inc)
+storage = InstrumentedStorage(fsm_storage, storage_seconds)
+if tracer.enabled:
+    storage = TracedStorage(storage, tracer)
+# Апдейты одного чата — по очереди: блокировка берётся до чтения состояния FSM
+chat_isolation = ChatIsolation()
+dp = Dispatcher(storage=storage, events_isolation=chat_isolation)
+if tracer.enabled:
+    # Раньше FSMContextMiddleware: в корневой спан входят ожидание очереди чата и чтение состояния
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(TracingMiddleware(tracer))
+    dp.update.outer_middleware(dp.fsm)
+dp.update.outer_middleware(UpdateMetricsMiddleware(update_seconds, update_errors))
+# update_id и chat_id — в каждую запись лога, сделанную во время обработки апдейта
+dp.update.outer_middleware(LogContextMiddleware())
+# Повторные доставки — один раз
+chat_order = ChatOrderMiddleware(
+    capacity=int(os.getenv("RECENT_UPDATES", "10000")),
+    on_duplicate=lambda: duplicates_dropped.inc("update"),
+)
+dp.update.outer_middleware(chat_order)
+# Отложенные шаги трассируемого апдейта — свои корневые спаны со ссылкой на него
+sender = DelayedSender(bind=tracer.deferred if tracer.enabled else None)
+drain = WebhookDrain()
+update_pool = UpdatePool(workers=max(1, UPDATE_WORKERS), depth=UPDATE_QUEUE)
+# Журнал ответов: каждый процесс кластера пишет свои сегменты
+events = EventLog(
+    directory=os.getenv("EVENT_LOG_DIR", "events"),
+    writer=f"w{WORKER_PORT}" if WORKER_PORT else "main",
+    fsync=os.getenv("EVENT_LOG_FSYNC", "1") != "0",
+)
+# Заявки администратору: запись в SQLite, доставка с повторами и сводками
+outbox = LeadOutbox(
+    os.getenv("OUTBOX_DB_PATH", "outbox.sqlite3"),
+    send=lambda text: bot.send_message(ADMIN_ID, text),
+    digest_interval=float(os.getenv("LEAD_DIGEST_INTERVAL", "5")),
+)
+# Последний результат каждого пользователя (/result, «Мой результат», заявки)
+results = ResultsStore(
+    os.getenv("RESULTS_DB_PATH", "results.sqlite3"),
+    capacity=int(os.getenv("RESULTS_CACHE_SIZE", "10000")),
+)
+# Запись на мини-разбор и консультацию: слоты в SQLite, свободное время — индекс в памяти
+bookings = BookingStore(
+    os.getenv("BOOKING_DB_PATH", "bookings.sqlite3"), schedule_from_env(), keyboards
+)
+callback_router = CallbackRouter(observe=lambda name, seconds: handler_seconds.observe(seconds, name))
+
+
+def sessions_by_stage() -> dict:
+    counts = {}
+    for data in iter_session_data(fsm_storage):
+        stage = session_stage(data)
+        if stage:
+            counts[stage] = counts.get(stage, 0) + 1
+    return counts
+
+
+metrics.gauge("bot_sessions_active", "Незавершённые диагностики по этапам", ["stage"], collect=sessions_by_stage)
+metrics.gauge("bot_outbound_queued", "Запросы в очереди лимитера", ["priority"], collect=lambda: {
+    "interactive": outbound.stats()["queued_interactive"], "bulk": outbound.stats()["queued_bulk"],
+})
+metrics.counter("bot_outbound_sent_total", "Запросы, прошедшие лимитер", collect=lambda: outbound.sent)
+metrics.counter("bot_outbound_retry_after_total", "Ответы 429 от Telegram", collect=lambda: outbound.retries)
+metrics.counter("bot_outbound_failed_total", "Запросы, не отправленные после повторов", collect=lambda: outbound.failed)
+metrics.gauge("bot_chats_waiting", "Чаты, где апдейт ждёт окончания предыдущего", collect=lambda: chat_isolation.chats_waiting)
+metrics.gauge("bot_delayed_pending", "Отложенные отправки в очереди", collect=lambda: sender.pending)
+metrics.counter("bot_webhook_rejected_total", "Апдейты, отклонённые ответом 503", ["reason"], collect=lambda: {
+    "draining": drain.rejected, "queue_full": update_pool.rejected,
+})
+metrics.gauge("bot_update_queue", "Апдейты в очереди пула", collect=lambda: update_pool.queued)
+metrics.gauge("bot_update_workers_busy", "Воркеры пула, занятые апдейтом", collect=lambda: update_pool.busy)
+metrics.gauge("bot_log_queue", "Записи лога, ждущие вывода", collect=lambda: log_pipeline.pending)
+metrics.counter("bot_log_dropped_total", "Записи лога, отброшенные без вывода", ["reason"], collect=lambda: {
+    "queue_full": log_pipeline.dropped, "sampled": log_pipeline.sampler.sampled_out,
+})
+metrics.counter("bot_trace_spans_total", "Спаны трассировки", ["outcome"], collect=lambda: {
+    "exported": tracer.exporter.exported, "dropped": tracer.exporter.dropped, "failed": tracer.exporter.failed,
+} if tracer.exporter is not None else {})
+metrics.gauge("bot_eventlog_pending", "События, не записанные на диск", collect=lambda: events.pending)
+metrics.counter("bot_leads_delivered_total", "Заявки, доставленные администратору", collect=lambda: outbox.delivered)
+metrics.counter("bot_leads_failed_total", "Неудачные попытки доставить заявку", collect=lambda: outbox.failed)
+metrics.counter("bot_bookings_total", "Попытки занять слот записи", ["outcome"], collect=lambda: {
+    "reserved": bookings.reserved, "conflict": bookings.conflicts,
+})
+metrics.counter("bot_results_cache_total", "Обращения к кэшу результатов", ["outcome"], collect=lambda: {
+    "hit": results.hits, "miss": results.misses,
+})
 
 # ==================== СОСТОЯНИЯ ====================
 class Form(StatesGroup):
@@ -49,368 +242,67 @@ class Form(StatesGroup):
     # Выбор количества описаний
     waiting_for_desc_count = State()
 
-# ==================== ДАННЫЕ ====================
-PROGRAMS = [
-    "Вечная пустота",
-    "Меня оставят",
-    "Хрупкость",
-    "Жертва ради других",
-    "Внутренний критик",
-    "Никому не верю",
-    "Не дотягиваю",
-    "Зависимость",
-    "Жажда похвалы",
-    "Я для всех",
-    "Замороженные чувства",
-    "Саботаж успеха",
-    "Не могу себя заставить",
-    "Никто не нужен",
-    "Всё плохо",
-    "Я - это ты",
-    "Внутренний судья",
-    "Я лучше/хуже всех",
-]
-
-# Индексы программ по веткам
-BRANCH_A = [1, 5, 13, 7]  # Меня оставят, Никому не верю, Никто не нужен, Зависимость
-BRANCH_B = [0, 6, 2, 8, 9]  # Вечная пустота, Не дотягиваю, Хрупкость, Жажда похвалы, Я для всех
-BRANCH_C = [4, 16, 10, 17, 12]  # Внутренний критик, Внутренний судья, Замороженные чувства, Я лучше/хуже всех, Не могу себя заставить
-BRANCH_D = [3, 11, 14, 15]  # Жертва ради других, Саботаж успеха, Всё плохо, Я - это ты
-
-# ==================== ВОПРОСЫ ====================
-
-# Первые 10 общих вопросов
-FIRST_STAGE_QUESTIONS = [
-    "Когда близкий человек долго не отвечает на сообщение — я сразу начинаю переживать, что он ко мне охладел или нашёл кого-то лучше.",
-    "Бывает, что внешне всё нормально, а внутри — пусто и грустно, как будто чего-то очень важного не хватает.",
-    "Если меня долго не хвалят, не замечают или не благодарят — настроение резко падает, хотя вроде ничего страшного не произошло.",
-    "Даже после хорошего результата я ловлю себя на мысли: «можно было сделать лучше» и ругаю себя.",
-    "Когда я сажусь отдохнуть или посмотреть фильм — через 5 минут начинаю думать: «может, лучше сделать что-то полезное».",
-    "В большинстве ситуаций я первым делом замечаю, что может пойти не так.",
-    "Когда меня просят о помощи — я соглашаюсь, даже если у меня были свои планы, а потом сижу и думаю: «зачем я опять согласился(ась)?»",
-    "Когда хочется рассказать о чём-то личном или наболевшем — я вдруг начинаю говорить: «да всё нормально», хотя внутри не нормально.",
-    "Даже когда всё идёт хорошо — я часто думаю: «это ненадолго, скоро опять всё испортится».",
-    "Я часто говорю «да» или соглашаюсь с другими, хотя внутри хочется сказать «нет» или поспорить."
-]
-
-# Вопросы для ветки A (Страх потери и недоверие)
-BRANCH_A_QUESTIONS = [
-    "Когда партнёр или друг становится чуть холоднее или занят — я начинаю пересматривать нашу переписку, искать, где мог(ла) ошибиться, и боюсь написать первым.",
-    "Когда мне говорят что-то приятное или делают комплимент — в голове автоматически включается мысль: «интересно, а что ему/ей на самом деле от меня нужно?»",
-    "Если я замечаю, что человек, который мне дорог, хорошо проводит время без меня — внутри появляется острая боль и страх, что меня заменят.",
-    "Я остаюсь в отношениях, которые давно приносят больше боли, чем радости, потому что мысль об одиночестве страшнее любых ссор.",
-    "Когда я остаюсь один(на) надолго — внутри появляется не просто грусть, а ощущение, что я никому не нужен(на) и меня забыли.",
-    "Перед тем как попросить о чём-то или отказать — я сначала прокручиваю в голове все возможные реакции человека и часто отказываюсь от своих желаний, чтобы не испортить отношения."
-]
-
-# Вопросы для ветки B (Стыд и неполноценность)
-BRANCH_B_QUESTIONS = [
-    "В компании или в соцсетях часто ловлю себя на мысли: «они все круче/красивее/успешнее меня».",
-    "Когда меня хвалят — внутри появляется лёгкий стыд и мысль: «они просто не знают, какой я на самом деле».",
-    "Любое замечание или критика — даже мелкая — ранит очень сильно и сидит в голове долго.",
-    "Я часто ловлю себя на том, что подстраиваюсь под людей, даже когда хочется быть собой — лишь бы никто не обиделся.",
-    "Бывает, что внутри всё болит и хочется выговориться, но когда кто-то спрашивает «как дела?» — я автоматически улыбаюсь и говорю: «всё отлично».",
-    "В глубине души я часто чувствую, что у всех людей есть какой-то важный код доступа к жизни, а мне его не выдали."
-]
-
-# Вопросы для ветки C (Внутренний контроль и самокритика)
-BRANCH_C_QUESTIONS = [
-    "Вечером, лёжа в кровати, я часто прокручиваю прошедший день и нахожу, где я мог(ла) бы сделать лучше.",
-    "Когда внутри подступают слёзы, гнев или сильная радость — я чувствую, как внутри включается блокировка: «нельзя, это слабость, возьми себя в руки».",
-    "Если я вижу, что кто-то делает что-то хуже меня — внутри появляется гордость и чувство превосходства; если лучше — сразу ощущение, что я ничтожество.",
-    "Я часто ловлю себя на том, что ставлю себе задачи, которые невозможно выполнить идеально, а потом ругаю себя за то, что «не дотянул».",
-    "Когда случается ошибка или неприятность — я мысленно прокручиваю ситуацию десятки раз и думаю: «как надо было поступить правильно».",
-    "Мне очень трудно лечь спать, если я не сделал(а) всё, что запланировал(а), даже если это уже неважно и можно перенести."
-]
-
-# Вопросы для ветки D (Жертвенность, саботаж и избегание)
-BRANCH_D_QUESTIONS = [
-    "Когда меня просят о помощи, а я устал(а) или занят(а) — я всё равно говорю «да», а потом долго себя ругаю, что опять не подумал(а) о себе.",
-    "Как только дело подходит к финалу и вот-вот должен быть успех — у меня вдруг пропадает интерес, появляются срочные дела, и я бросаю всё на полпути.",
-    "Когда происходит что-то хорошее или меня ждёт приятное событие — я сразу начинаю думать: «а вдруг что-то пойдёт не так» и готовлюсь к худшему.",
-    "В отношениях я часто ловлю себя на том, что смотрю те же фильмы, что и партнёр, ем ту же еду, имею те же интересы — а где я сам(а)? — уже непонятно.",
-    "Если я всё-таки говорю «нет» или выбираю себя — внутри сразу появляется тяжелое чувство вины, как будто я предал(а) человека.",
-    "Я часто откладываю свои мечты и важные для себя дела на потом, потому что «сначала надо решить проблемы других людей»."
-]
-
-# Вопросы-разрешители между ветками
-BRANCH_TIE_QUESTIONS = {
-    "A_B": "Что чаще приходит в голову в трудные моменты: страх, что близкий человек уйдёт/охладеет, или мысль «я снова сделал(а) что-то не так, я недостаточно хорош(а)»?",
-    "A_C": "Когда ты остаёшься один(на) вечером — что сильнее гложет: тревога, что тебя бросят/обманут, или внутренний голос, который ругает за всё подряд?",
-    "A_D": "Когда тебе нужно выбрать между собой и другим — что побеждает: страх, что откажутся от тебя, или вина, если выберешь себя?",
-    "B_C": "Когда происходит что-то неприятное — ты чаще думаешь: «это потому что я плохой(ая)» или «я должен(на) был(а) сделать лучше»?",
-    "B_D": "Что бывает чаще: чувство, что тебя никто не понимает и ты пустой(ая) внутри, или привычка помогать всем подряд, а потом лежать и злиться на себя?",
-    "C_D": "Что тебя больше изматывает: постоянное чувство «надо быть лучше» и самокритика, или привычка ставить чужие нужды выше своих, а потом обижаться на весь мир?"
-}
-
-# Финальные вопросы
-FINAL_QUESTIONS = [
-    "Насколько сильно эти чувства и мысли сейчас мешают тебе жить? (1–10)",
-    "Как часто они приходят в голову в обычной жизни?",
-    "В какой сфере они сейчас проявляются сильнее всего?"
-]
-
-FINAL_FREQUENCY_OPTIONS = [
-    "Постоянно, каждый день",
-    "Несколько раз в неделю",
-    "Время от времени",
-    "Редко"
-]
-
-FINAL_SPHERE_OPTIONS = [
-    "Отношения",
-    "Деньги и карьера",
-    "Самооценка",
-    "Здоровье",
-    "Другое"
-]
-
-# ==================== ОПИСАНИЯ ПРОГРАММ ====================
-
-PROGRAM_DESCRIPTIONS = [
-    # 0. Вечная пустота
-    """<b>Это ощущение, что внутри — как будто пустота, даже когда внешне всё хорошо.</b>
-
-Ты словно стоишь за стеклом и смотришь на мир: все вокруг живут, чувствуют, радуются, а ты просто наблюдаешь. Вроде есть люди, работа, события, а внутри — тишина и холод. Иногда кажется, что у других есть какой-то секретный код доступа к жизни, а тебе его не выдали.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях тебе трудно чувствовать близость. Ты можешь быть с человеком, но внутри оставаться одиноким.
-🔹 Достижения не приносят радости — даже большие успехи проходят мимо, не задевая внутри ничего.
-🔹 Энергия уходит на попытки «заполнить пустоту» — через людей, покупки, еду, развлечения, но ничего не помогает надолго.
-🔹 Проявляться сложно, потому что кажется: «зачем что-то показывать, если всё равно никто не увидит и не поймёт».
-🔹 Детям это может передаваться через холодность в отношениях, через неспособность дать им ту теплоту, которой не хватило тебе.""",
-
-    # 1. Меня оставят
-    """<b>Это постоянный страх, что близкий человек уйдёт, охладеет или перестанет тебя выбирать.</b>
-
-Даже в тёплых отношениях внутри живёт тревога. Стоит партнёру чуть замешкаться с ответом или стать чуть холоднее — и в голове уже картина: «он(а) меня разлюбил(а), нашёл(ла) кого-то лучше». Ты можешь перечитывать переписку, искать скрытые смыслы, проверять, когда человек был онлайн.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях ты часто тревожишься, проверяешь, ищешь подтверждения, что тебя любят. Это создаёт напряжение и может отталкивать партнёра.
-🔹 На выбор партнёра влияет страх одиночества — ты можешь оставаться в плохих отношениях, лишь бы не быть одному.
-🔹 Энергия уходит на контроль, тревогу, попытки «заслужить» любовь и удержать человека.
-🔹 Проявляться сложно, потому что ты боишься сказать что-то не то, сделать не так, чтобы не спугнуть.
-🔹 Детям это передаётся через тревожную привязанность — они будут чувствовать, что любовь нужно постоянно заслуживать.""",
-
-    # 2. Хрупкость
-    """<b>Это постоянное чувство, что мир опасен и в любой момент может случиться катастрофа.</b>
-
-Ты живёшь с фоновой тревогой: вдруг заболею, вдруг что-то случится с близкими, вдруг будет авария, вдруг уволят. Твой мозг постоянно сканирует реальность на предмет угроз. Ты стараешься всё контролировать, перестраховываться, потому что кажется: если я расслаблюсь — случится непоправимое.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях ты можешь либо гиперопекать близких (постоянно проверять, где они, как они), либо избегать привязанности, потому что боишься будущей потери.
-🔹 В деньгах и карьере — копишь «на чёрный день», не рискуешь, не вкладываешься, потому что страшно потерять.
-🔹 Энергия уходит на контроль, проверки, планирование «на случай катастрофы» и борьбу с тревогой.
-🔹 Проявляться сложно, потому что любой риск или выход из зоны комфорта воспринимается как угроза выживанию.
-🔹 Детям это передаётся через тревожность: «не бегай — упадёшь», «не ешь это — отравишься», мир подаётся как опасное место.""",
-
-    # 3. Жертва ради других
-    """<b>Это привычка ставить чужие нужды выше своих, а потом обижаться, что о тебе не заботятся.</b>
-
-Ты часто говоришь «да», когда внутри уже всё кричит «нет». Соглашаешься помочь, даже если устал(а) или у тебя свои планы. А потом сидишь и думаешь: «почему я опять согласился(лась)?», злишься на себя и на тех, кто попросил. Внутри копится усталость и глухая обида: «когда же кто-то позаботится обо мне?»
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях ты часто отдаёшь больше, чем получаешь, а потом чувствуешь себя использованным.
-🔹 На выбор партнёра влияет бессознательное влечение к тем, кто готов брать, не отдавая — к «нуждающимся» людям.
-🔹 Энергия уходит на заботу о других, игнорирование своих потребностей и подавление обиды, которая всё равно прорывается.
-🔹 Проявляться сложно, потому что с детства ты усвоил(а): твоя ценность — в твоей полезности для других.
-🔹 Детям это передаётся через сценарий: «ты должен быть удобным, чтобы тебя любили».""",
-
-    # 4. Внутренний критик
-    """<b>Это голос внутри, который никогда не доволен и всегда находит, к чему придраться.</b>
-
-Что бы ты ни сделал(а) — ему всегда мало. «Можно было лучше», «ты опять ошибся(лась)», «посмотри на других — они лучше». Даже когда всё хорошо, этот голос находит, к чему прицепиться. Вечером, лёжа в кровати, ты прокручиваешь прошедший день и находишь минимум три вещи, которые сделал(а) «недостаточно хорошо».
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях ты можешь предъявлять нереалистичные требования к себе как к партнёру, а часто — и к другим.
-🔹 В работе и деньгах — перфекционизм, страх ошибки, бесконечное «улучшение» вместо завершения дел.
-🔹 Энергия уходит на самокритику, переживания об ошибках и попытки достичь недостижимого идеала.
-🔹 Проявляться сложно, потому что тебе кажется: «я ещё не достаточно хорош, чтобы показывать себя».
-🔹 Детям это передаётся через постоянные оценки и требования быть лучшим.""",
-
-    # 5. Никому не верю
-    """<b>Это постоянное ожидание подвоха и недоверие к людям, даже когда они искренни.</b>
-
-Тебе трудно доверять. Даже когда человек добр и открыт, внутри сидит мысль: «он просто что-то хочет от меня» или «всё равно предаст». Ты редко открываешься до конца, потому что боишься, что твою слабость используют против тебя. Когда кто-то говорит приятные слова — ты ищешь скрытый смысл.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях ты держишь дистанцию, не подпускаешь близко, всегда ждёшь удара.
-🔹 В дружбе и работе — трудно просить о помощи, трудно полагаться на других, всё приходится делать самому.
-🔹 Энергия уходит на анализ чужих намерений, поиск подвоха и поддержание эмоциональной брони.
-🔹 Проявляться сложно, потому что любая искренность кажется риском.
-🔹 Детям это передаётся через недоверие к миру и людям: «никому нельзя верить».""",
-
-    # 6. Не дотягиваю
-    """<b>Это глубокое чувство, что с тобой что-то не так, что ты хуже или недостойнее других.</b>
-
-В глубине души ты часто чувствуешь, что ты «какой-то не такой». Другие люди кажутся нормальными, правильными, достойными, а ты — нет. Когда тебя хвалят, ты не веришь: «они просто не знают меня настоящего». Ты живёшь с ощущением, что в любой момент могут «раскусить» и отвернуться.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях ты боишься, что партнёр увидит твои «недостатки» и уйдёт. Ты часто извиняешься, даже когда не виноват(а).
-🔹 В работе тебе трудно просить повышения, заявлять о себе, потому что «я недостаточно хорош».
-🔹 Энергия уходит на создание «фасада» — ты показываешь миру удобную версию себя, а настоящего прячешь.
-🔹 Проявляться сложно, потому что кажется: «если я покажу себя — меня отвергнут».
-🔹 Детям это передаётся через низкую самооценку и чувство, что они «не такие».""",
-
-    # 7. Зависимость
-    """<b>Это ощущение, что одной/одному не справиться, что нужен кто-то, кто будет рядом и поможет.</b>
-
-Тебе трудно принимать решения без совета и поддержки. Без близкого человека рядом ты чувствуешь себя потерянно и тревожно, как будто не можешь опереться на себя. Важно, чтобы кто-то был рядом и говорил: «всё будет хорошо». Ты можешь перекладывать ответственность на других, потому что внутри живёт страх: «а вдруг я ошибусь?»
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях ты ищешь «сильное плечо», того, кто возьмёт на себя ответственность и будет вести.
-🔹 В деньгах и карьере — трудно начинать своё дело, трудно брать на себя риски, легче быть в подчинении.
-🔹 Энергия уходит на поиск поддержки, сомнения и ожидание, что кто-то придёт и спасёт.
-🔹 Проявляться сложно, потому что ты не веришь в свои силы и свою способность справиться.
-🔹 Детям это передаётся через беспомощность и неспособность принимать самостоятельные решения.""",
-
-    # 8. Жажда похвалы
-    """<b>Это зависимость от того, что о тебе думают другие, и потребность в постоянном одобрении.</b>
-
-Тебе очень важно, как к тебе относятся. Если тебя не хвалят, не замечают, не одобряют — настроение падает, и ты чувствуешь себя почти невидимым(ой). Твоё настроение может меняться в зависимости от того, что сказали другие. Одна похвала — и ты на вершине. Одно замечание — и ты в пропасти.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях ты часто подстраиваешься под партнёра, чтобы получить его одобрение, даже если это идёт вразрез с твоими желаниями.
-🔹 В работе ты можешь делать не то, что хочешь, а то, за что похвалят и заметят.
-🔹 Энергия уходит на «сканирование» окружающих — кто что подумал, кто как посмотрел.
-🔹 Проявляться сложно, потому что ты постоянно оглядываешься на других: «а что они скажут?»
-🔹 Детям это передаётся через зависимость от оценок и чужого мнения.""",
-
-    # 9. Я для всех
-    """<b>Это привычка быть удобным для всех, соглашаться и подстраиваться, чтобы не портить отношения.</b>
-
-Ты часто соглашаешься с другими, даже если внутри не согласен(на). Тебе трудно сказать «нет», трудно отстоять свои интересы, потому что ты боишься конфликта. Ты можешь смеяться над шутками, которые не смешны, делать то, что не хочешь — лишь бы не испортить отношения. А потом чувствовать усталость и пустоту.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях ты часто оказываешься в роли «ведомого», теряешь свои границы и свои желания.
-🔹 В работе — берёшь на себя лишнее, не умеешь отказывать начальству и коллегам.
-🔹 Энергия уходит на подавление своих желаний, прогнозирование чужих ожиданий и «проглатывание» обид.
-🔹 Проявляться сложно, потому что с детства ты усвоил(а): любовь даётся в обмен на покорность.
-🔹 Детям это передаётся через сценарий: «будь удобным — и тебя будут любить».""",
-
-    # 10. Замороженные чувства
-    """<b>Это привычка подавлять свои эмоции, прятать их глубоко внутри, чтобы не казаться слабым.</b>
-
-Тебе трудно проявлять чувства. Когда хочется плакать — ты сдерживаешься. Когда хочется радоваться — тоже сдерживаешься, потому что внутри есть установка: «сильные люди не показывают эмоции». Ты можешь даже не понимать, что сейчас чувствуешь — как будто внутри глухая стена. Другие могут говорить, что ты холодный(ая), но ты знаешь, что чувства есть — просто они глубоко под замком.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях тебе трудно говорить о своих чувствах, трудно быть открытым. Партнёру может казаться, что ты равнодушен(на).
-🔹 В жизни ты часто чувствуешь опустошённость, как будто живёшь «на автомате».
-🔹 Энергия уходит на контроль над эмоциями, сдерживание и подавление того, что рвётся наружу.
-🔹 Проявляться сложно, потому что когда-то ты решил(а): чувствовать — опасно.
-🔹 Детям это передаётся через эмоциональную холодность, через неумение говорить о чувствах.""",
-
-    # 11. Саботаж успеха
-    """<b>Это привычка бросать дела на полпути, не доводить до конца, отказываться от целей в последний момент.</b>
-
-Ты замечал(а), что как только дело подходит к концу и вот-вот должен быть успех — у тебя вдруг пропадает интерес, появляются срочные дела, и ты бросаешь? Или начинаешь сомневаться: «а нужно ли это вообще?» Ты можешь мечтать о чём-то большом, но когда приходит время действовать — находишь тысячу причин не начинать.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В карьере — ты не доходишь до повышения, не заканчиваешь проекты, не получаешь заслуженных результатов.
-🔹 В отношениях — ты можешь отдаляться, когда всё становится слишком хорошо и серьёзно.
-🔹 Энергия уходит на борьбу с внутренним сопротивлением и на самобичевание за то, что опять бросил(а).
-🔹 Проявляться сложно, потому что внутри живёт страх: «а вдруг не получится? лучше не пробовать».
-🔹 Детям это передаётся через страх неудачи и неверие в свои силы.""",
-
-    # 12. Не могу себя заставить
-    """<b>Это трудность с самодисциплиной, когда не получается делать то, что нужно, даже если это важно.</b>
-
-Тебе трудно заставить себя делать скучные или сложные дела, даже когда ты понимаешь, что они важны. Ты откладываешь, ищешь отговорки, прокрастинируешь, а потом ругаешь себя за это. Но в следующий раз всё повторяется снова. Ты можешь сидеть и смотреть в стену, понимая, что нужно работать, но тело не двигается.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В работе и учёбе — хронические дедлайны, невыполненные обещания, чувство вины.
-🔹 В отношениях — трудно выполнять обещания, трудно быть надёжным партнёром.
-🔹 В деньгах — трудно заставить себя вести бюджет, копить, планировать.
-🔹 Энергия уходит на борьбу с собой, на чувство вины и на попытки «взять себя в руки».
-🔹 Детям это передаётся через неорганизованность и трудности с самодисциплиной.""",
-
-    # 13. Никто не нужен
-    """<b>Это ощущение, что ты чужой среди людей, что тебя никто по-настоящему не понимает и не принимает.</b>
-
-Даже среди людей, в компании друзей, ты иногда чувствуешь себя чужим(ой). Как будто ты стоишь в стороне и смотришь на них через стекло. Тебе трудно найти общие темы, трудно быть «своим». Ты можешь отдаляться от людей, даже когда хочешь близости, потому что близость — это риск. Лучше быть одному, чем снова пережить боль отвержения.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях — ты избегаешь глубоких связей, быстро уходишь, когда кто-то становится слишком близко.
-🔹 В дружбе — у тебя мало близких друзей, ты часто чувствуешь себя одиноким даже в компании.
-🔹 Энергия уходит на поддержание «стен» и оправдание своего одиночества.
-🔹 Проявляться сложно, потому что когда-то ты решил(а): «открываться — опасно».
-🔹 Детям это передаётся через социальную изоляцию и неумение строить связи.""",
-
-    # 14. Всё плохо
-    """<b>Это привычка видеть в любой ситуации сначала негатив, риски и опасности, а не возможности.</b>
-
-Ты часто ждёшь худшего. Даже когда всё хорошо, внутри сидит мысль: «это ненадолго, скоро случится что-то плохое». Ты замечаешь риски раньше, чем возможности. Как будто у тебя внутри стоит фильтр, который пропускает только плохое. Ты готовишься к провалу, перестраховываешься, не радуешься успехам.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях — ты ждёшь, что партнёр разочарует, предаст, уйдёт. И часто сама провоцируешь это своим ожиданием.
-🔹 В деньгах — боишься вкладывать, боишься рисковать, боишься, что всё потеряешь.
-🔹 Энергия уходит на прокручивание негативных сценариев и подготовку к худшему.
-🔹 Проявляться сложно, потому что с детства ты усвоил(а): «радоваться рано — вдруг потом будет хуже».
-🔹 Детям это передаётся через пессимизм и недоверие к жизни.""",
-
-    # 15. Я - это ты
-    """<b>Это привычка растворяться в партнёре, терять свои желания и жить чужой жизнью.</b>
-
-В отношениях ты часто теряешь себя. Ты начинаешь жить интересами партнёра, смотреть те фильмы, что нравятся ему/ей, есть ту еду, что любит он/она, думать так, как думает он/она. Твои собственные желания становятся размытыми. Когда ты остаёшься один(на), ты не понимаешь: «а чего хочу я на самом деле?»
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях — ты полностью подстраиваешься, теряешь свои границы, а потом чувствуешь опустошение.
-🔹 В жизни — ты не знаешь, чего хочешь, потому что всегда ориентировался на других.
-🔹 Энергия уходит на «сканирование» партнёра и подстройку под его желания.
-🔹 Проявляться сложно, потому что с детства твои желания не считались важными.
-🔹 Детям это передаётся через размытые границы и неспособность понимать свои истинные желания.""",
-
-    # 16. Внутренний судья
-    """<b>Это строгий внутренний голос, который не прощает ошибок — ни тебе, ни другим.</b>
-
-Ты очень строго относишься к ошибкам. Если ты ошибся(лась) — ты долго себя ругаешь и не можешь простить. Если ошибся кто-то другой — ты тоже злишься и считаешь, что он должен понести наказание. Ты требуешь от себя и других идеальности, безупречности. Когда реальность не совпадает с идеалом — внутри поднимается гнев и разочарование.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях — ты часто осуждаешь партнёра, требуешь от него совершенства, не прощаешь слабостей.
-🔹 В работе — ты безжалостен к себе за любую ошибку, это выматывает и лишает сил.
-🔹 Энергия уходит на самобичевание, контроль и подавление «неправильных» чувств.
-🔹 Проявляться сложно, потому что в детстве ошибки жестоко наказывались.
-🔹 Детям это передаётся через жёсткость и неспособность прощать.""",
-
-    # 17. Я лучше/хуже всех
-    """<b>Это качели в самооценке: то ты чувствуешь себя лучше всех, то хуже всех — и это может меняться несколько раз за день.</b>
-
-Твоё отношение к себе постоянно качается как маятник. В какие-то моменты ты чувствуешь себя особенным(ой), умнее, успешнее, красивее других. А в какие-то — падаешь в пропасть и думаешь, что ты хуже всех, ничтожество, неудачник. Эти перепады могут случаться несколько раз за день. То ты требуешь особого отношения, то чувствуешь, что недостоин(йна) ничего.
-
-<b>Как это проявляется в жизни:</b>
-🔹 В отношениях — то ты идеализируешь партнёра, то обесцениваешь. То же самое с друзьями и коллегами.
-🔹 В работе — то берёшься за непосильные задачи (чувствуя себя супергероем), то бросаешь всё (чувствуя себя ничтожеством).
-🔹 Энергия уходит на поддержание «образа» и на борьбу с чувством ничтожности.
-🔹 Проявляться сложно, потому что в детстве ты не получил(а) ровной, устойчивой любви.
-🔹 Детям это передаётся через нестабильную самооценку и перепады настроения."""
-]
-
-# ==================== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ====================
-def get_branch_scores(scores):
-    return {
-        'A': sum(scores[i] for i in BRANCH_A),
-        'B': sum(scores[i] for i in BRANCH_B),
-        'C': sum(scores[i] for i in BRANCH_C),
-        'D': sum(scores[i] for i in BRANCH_D)
-    }
-
-def get_top_branches(branch_scores, threshold=5):
-    sorted_branches = sorted(branch_scores.items(), key=lambda x: x[1], reverse=True)
-    if len(sorted_branches) > 1 and sorted_branches[0][1] - sorted_branches[1][1] <= threshold:
-        return [sorted_branches[0][0], sorted_branches[1][0]]
-    return [sorted_branches[0][0]]
-
-def get_global_question_number(data, stage, index, branch_q_asked):
-    if stage == "first":
-        return index + 1
-    elif stage == "branch":
-        return 10 + branch_q_asked + 1
-    else:
-        return 16 + index + 1
+# ==================== КОНТЕНТ ====================
+# Вопросы, программы и описания — в версионированных бандлах content/vN.json;
+# тексты и клавиатуры опроса собираются один раз при загрузке версии (см. content.py).
+# Новая версия подхватывается без рестарта: SIGHUP или /reload от администратора
+content = ContentLibrary(os.getenv("CONTENT_DIR", DEFAULT_DIR), keyboards)
+
+# ==================== КЛАВИАТУРЫ ====================
+MAIN_MENU_KEYBOARD = keyboards.markup([
+    [("▶️ Начать диагностику", pack("start"))],
+    [("📚 О методе СОВ", pack("about"))],
+    [("📄 Условия и документы", pack("legal"))],
+])
+
+# Для тех, кто уже проходил диагностику
+RETURNING_MENU_KEYBOARD = keyboards.markup([
+    [("📊 Мой результат", pack("result"))],
+    [("▶️ Пройти заново", pack("start"))],
+    [("📚 О методе СОВ", pack("about"))],
+    [("📄 Условия и документы", pack("legal"))],
+])
+
+ABOUT_KEYBOARD = keyboards.markup([
+    [("▶️ Начать диагностику", pack("start"))],
+    [("📄 Условия и документы", pack("legal"))],
+    [("◀️ В главное меню", pack("menu"))],
+])
+
+LEGAL_KEYBOARD = keyboards.markup([
+    [("▶️ Начать диагностику", pack("start"))],
+    [("◀️ В главное меню", pack("menu"))],
+])
+
+CONSENT_KEYBOARD = keyboards.markup([
+    [("✅ Я согласен(на) и хочу начать", pack("consent"))],
+    [("📄 Ещё раз прочитать документы", pack("legal"))],
+    [("◀️ В главное меню", pack("menu"))],
+])
+
+RESULT_KEYBOARD = keyboards.markup([
+    [("Получить полные описания (1–3)", pack("descs"))],
+    [("Мини-разбор — 1000 ₽", pack("book_mini"))],
+    [("Консультация — 6000 ₽", pack("book_consult"))],
+    [("Пройти заново", pack("restart"))],
+])
+
+EXPIRED_KEYBOARD = keyboards.markup([
+    [("🔄 Начать заново", pack("start"))],
+    [("◀️ В главное меню", pack("menu"))],
+])
+
+DESC_OPTIONS_KEYBOARD = keyboards.markup([
+    [("1 описание — 399 ₽", pack("desc", 1))],
+    [("2 описания — 599 ₽", pack("desc", 2))],
+    [("3 описания — 799 ₽", pack("desc", 3))],
+    [("Отмена", pack("desc_cancel"))],
+])
 
 # ==================== ОСНОВНЫЕ ХЕНДЛЕРЫ ====================
 
 @dp.message(CommandStart())
+@timed(handler_seconds)
 async def start_handler(message: Message, state: FSMContext):
     username = message.from_user.first_name or "друг"
     text = f"""Привет, {username}! ❤️
@@ -427,17 +319,12 @@ async def start_handler(message: Message, state: FSMContext):
 
 Хочешь посмотреть правду о себе и понять, где можно всё изменить? 👀"""
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="▶️ Начать диагностику", callback_data="start_diagnostics")],
-        [InlineKeyboardButton(text="📚 О методе СОВ", callback_data="about_method")],
-        [InlineKeyboardButton(text="📄 Условия и документы", callback_data="show_legal")]
-    ])
-
+    keyboard = RETURNING_MENU_KEYBOARD if await results.get(message.chat.id) else MAIN_MENU_KEYBOARD
     await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
     await state.clear()
     
-@dp.callback_query(lambda c: c.data == "about_method")
-async def about_method_callback(callback: CallbackQuery):
+@callback_router.route("about")
+async def about_method_callback(callback: CallbackQuery, state: FSMContext):
     """Информация о методе СОВ"""
     text = """<b>📚 О методе СОВ — Системы Осознанного Выбора</b>
 
@@ -457,17 +344,11 @@ async def about_method_callback(callback: CallbackQuery):
 
 Готов(а) начать? ❤️"""
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="▶️ Начать диагностику", callback_data="start_diagnostics")],
-        [InlineKeyboardButton(text="📄 Условия и документы", callback_data="show_legal")],
-        [InlineKeyboardButton(text="◀️ В главное меню", callback_data="back_to_main")]
-    ])
-
-    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.message.edit_text(text, reply_markup=ABOUT_KEYBOARD, parse_mode="HTML")
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "show_legal")
-async def show_legal(callback: CallbackQuery):
+@callback_router.route("legal")
+async def show_legal(callback: CallbackQuery, state: FSMContext):
     """Показывает документы"""
     text = """📄 <b>Правовая информация</b>
 
@@ -479,22 +360,17 @@ async def show_legal(callback: CallbackQuery):
 
 После ознакомления вернись и нажми «Начать диагностику» ❤️"""
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="▶️ Начать диагностику", callback_data="start_diagnostics")],
-        [InlineKeyboardButton(text="◀️ В главное меню", callback_data="back_to_main")]
-    ])
-
-    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML", disable_web_page_preview=True)
+    await callback.message.edit_text(text, reply_markup=LEGAL_KEYBOARD, parse_mode="HTML", disable_web_page_preview=True)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "back_to_main")
+@callback_router.route("menu")
 async def back_to_main(callback: CallbackQuery, state: FSMContext):
     """Возврат в главное меню"""
     await state.clear()
     await start_handler(callback.message, state)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "start_diagnostics")
+@callback_router.route("start")
 async def start_diagnostics_callback(callback: CallbackQuery, state: FSMContext):
     """Экран с условиями перед началом диагностики"""
     text = """📋 <b>Подтверждение согласия</b>
@@ -507,30 +383,25 @@ async def start_diagnostics_callback(callback: CallbackQuery, state: FSMContext)
 
 <b>Подтверди своё согласие, чтобы продолжить.</b>"""
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Я согласен(на) и хочу начать", callback_data="confirm_consent")],
-        [InlineKeyboardButton(text="📄 Ещё раз прочитать документы", callback_data="show_legal")],
-        [InlineKeyboardButton(text="◀️ В главное меню", callback_data="back_to_main")]
-    ])
-
-    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML", disable_web_page_preview=True)
+    await callback.message.edit_text(text, reply_markup=CONSENT_KEYBOARD, parse_mode="HTML", disable_web_page_preview=True)
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "confirm_consent")
+@callback_router.route("consent")
 async def confirm_consent(callback: CallbackQuery, state: FSMContext):
     """Подтверждение согласия - начало диагностики"""
+    started = await load_session(state)
+    if started is not None and started.stage == "first" and started.question_index == 0:
+        # Второе нажатие «Согласен»: диагностика уже начата, первый вопрос уже запланирован
+        return await answer_duplicate(callback)
     # Сохраняем данные для диагностики
-    await state.update_data(
-        consent_given=True,
-        scores=[0] * len(PROGRAMS),
-        first_stage_answers=[0] * len(FIRST_STAGE_QUESTIONS),
-        question_index=0,
-        stage="first",
-        branch_questions_asked=0,
-        final_answers={},
-        start_time=datetime.now().isoformat()
+    # Диагностика до конца идёт на текущей версии контента, даже если её обновят по ходу
+    bundle = content.current
+    session = Session.new(
+        len(bundle.programs), len(bundle.first_questions), eventlog.new_session_id(), content_version=bundle.version
     )
-    
+    await save_session(state, session)
+    events.emit(eventlog.START, callback.message.chat.id, session.session_id, v=bundle.version)
+
     await callback.message.edit_text(
         "✅ Спасибо! Согласие подтверждено.\n\n"
         "Теперь начинаем диагностику ❤️\n\n"
@@ -538,294 +409,440 @@ async def confirm_consent(callback: CallbackQuery, state: FSMContext):
         "просто первое, что приходит в голову.\n\n"
         "Всего будет около 20-25 вопросов."
     )
-    
-    await asyncio.sleep(2)
-    
-    # Задаем первый вопрос
-    await ask_question(callback.message, state)
     await callback.answer()
 
-# ==================== ОСНОВНАЯ ЛОГИКА ОПРОСА ====================
+    # Первый вопрос уходит в фоне после паузы, хендлер не ждёт
+    sender.schedule(callback.message.chat.id, [(2, lambda: ask_question(callback.message, state))])
+
+async def load_active_session(state: FSMContext) -> Optional[Session]:
+    """
+    Сессия, которую можно продолжать. Если её версии контента больше нет,
+    а у текущей другое число вопросов или программ, сессия сбрасывается:
+    пользователь увидит, что диагностика больше не активна.
+    """
+    session = await load_session(state)
+    if session is None:
+        return None
+    try:
+        content.get(session.content_version, fits=lambda bundle: (
+            len(bundle.first_questions) == len(session.first_stage_answers)
+            and len(bundle.programs) == len(session.scores)
+        ))
+    except ContentError as e:
+        logger.warning("Сессия %s сброшена: %s", session.session_id, e)
+        await state.clear()
+        return None
+    return session
+
+
+async def session_expired(callback: CallbackQuery):
+    """Кнопка вопроса без сессии: диагностика завершена или вытеснена по сроку"""
+    result = await results.get(callback.from_user.id)
+    if result is not None and callback.message.date.timestamp() <= result.finished:
+        # Запоздалое нажатие по уже завершённой диагностике — сообщение с результатом не трогаем
+        await callback.answer("Диагностика уже завершена. Результат: /result")
+        return
+    await callback.message.edit_text(
+        "⏳ Эта диагностика больше не активна — сессия истекла.\n\n"
+        "Ответы не сохранились, но пройти заново можно в любой момент.",
+        reply_markup=EXPIRED_KEYBOARD,
+    )
+    await callback.answer()
 
-async def ask_question(message: Message, state: FSMContext):
-    data = await state.get_data()
-    index = data.get("question_index", 0)
-    stage = data.get("stage", "first")
-    branch = data.get("current_branch")
-    branch_q_asked = data.get("branch_questions_asked", 0)
+# ==================== ОСНОВНАЯ ЛОГИКА ОПРОСА ====================
 
-    logger.info(f"ask_question: stage={stage}, index={index}, branch={branch}")
+@timed(handler_seconds)
+@tracer.traced()
+async def ask_question(message: Message, state: FSMContext, edit: bool = False, respond: bool = False):
+    """Задаёт текущий вопрос; с respond=True может вернуть запрос для ответа на вебхук"""
+    session = await load_session(state)
+    if session is None:
+        return None
+    index = session.question_index
+    stage = session.stage
+    branch = session.current_branch
+    branch_q_asked = session.branch_questions_asked
+    bundle = content.get(session.content_version)
+    if ADAPTIVE_QUESTIONS and stage in ("first", "branch"):
+        await skip_settled_questions(message.chat.id, state, session, bundle)
+        index = session.question_index
+        branch_q_asked = session.branch_questions_asked
+
+    logger.info(
+        "ask_question: stage=%s, index=%s, branch=%s", stage, index, branch,
+        extra={"stage": stage, "index": index, "branch": branch},
+    )
 
-    if stage == "first" and index >= len(FIRST_STAGE_QUESTIONS):
-        await determine_branch(message, state)
-        return
+    if stage == "first" and index >= len(bundle.first_questions):
+        return await determine_branch(message, state, edit, respond)
 
     if stage == "branch_tie":
-        tie_branches = data.get("tie_branches", ["A", "B"])
-        key = f"{tie_branches[0]}_{tie_branches[1]}"
-        q_text = BRANCH_TIE_QUESTIONS.get(key) or BRANCH_TIE_QUESTIONS.get(f"{tie_branches[1]}_{tie_branches[0]}")
-        if q_text:
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="Вариант 1", callback_data="tie_branch_1"),
-                 InlineKeyboardButton(text="Вариант 2", callback_data="tie_branch_2")]
-            ])
-            await message.answer(f"Чтобы точнее понять:\n\n{q_text}", reply_markup=keyboard)
-            return
-        else:
-            await state.update_data(current_branch=tie_branches[0], stage="branch", branch_questions_asked=0)
-            await ask_question(message, state)
-            return
-
-    if stage == "branch" and branch:
-        questions = {
-            "A": BRANCH_A_QUESTIONS,
-            "B": BRANCH_B_QUESTIONS,
-            "C": BRANCH_C_QUESTIONS,
-            "D": BRANCH_D_QUESTIONS
-        }.get(branch, [])
-
-        if branch_q_asked < len(questions):
-            q_text = questions[branch_q_asked]
-            callback_prefix = "branch"
-        else:
-            await ask_final_questions(message, state, 0)
-            return
-
-    if stage == "final":
-        if index < len(FINAL_QUESTIONS):
-            q_text = FINAL_QUESTIONS[index]
-            if index == 0:
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [[InlineKeyboardButton(text=str(i), callback_data=f"final_{i}_0")] for i in range(1, 11)]
-                ])
-            elif index == 1:
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text=opt, callback_data=f"final_freq_{i}")] for i, opt in enumerate(FINAL_FREQUENCY_OPTIONS)
-                ])
-            else:
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text=opt, callback_data=f"final_sphere_{i}")] for i, opt in enumerate(FINAL_SPHERE_OPTIONS)
-                ])
+        tie_branches = session.tie_branches or ("A", "B")
+        rendered = bundle.renders.get(("branch_tie", f"{tie_branches[0]}_{tie_branches[1]}", 0))
+        if rendered is None:
+            session.current_branch = tie_branches[0]
+            session.stage = "branch"
+            session.branch_questions_asked = 0
+            await save_session(state, session)
+            return await ask_question(message, state, edit, respond)
+    elif stage == "branch" and branch:
+        if branch_q_asked >= len(bundle.branch_questions.get(branch, [])):
+            return await ask_final_questions(message, state, 0, edit, respond)
+        rendered = bundle.renders[("branch", branch, branch_q_asked)]
+    elif stage == "final":
+        if index >= len(bundle.final_questions):
+            await finish_diagnostics(message, state, edit)
+            return None
+        rendered = bundle.renders[("final", None, index)]
+    else:
+        rendered = bundle.renders[("first", None, index)]
+
+    # Текст и клавиатура вопроса собраны заранее — здесь только поиск по ключу
+    text, keyboard = rendered
+    if session.skipped and stage != "branch_tie":
+        # После пропусков номер — по числу заданных вопросов, а не по месту в полном списке
+        if stage == "branch" and branch:
+            text = question_text("branch", branch_q_asked, bundle.branch_questions[branch][branch_q_asked], session.skipped)
+        elif stage == "final":
+            text = question_text("final", index, bundle.final_questions[index], session.skipped)
         else:
-            await finish_diagnostics(message, state)
-            return
-
-    text = f"Вопрос {get_global_question_number(data, stage, index, branch_q_asked)}:\n\n{q_text}"
-
-    keyboard = keyboard or InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=str(i), callback_data=f"{callback_prefix}_{i}_{index}")] for i in range(1, 6)
-    ])
-
-    await message.answer(text, reply_markup=keyboard)
-    
-async def _get_global_question_number(state_data, stage, index, branch_questions_asked):
-    """Вспомогательная функция для отображения номера вопроса"""
-    if stage == "first":
-        return index + 1
-    elif stage == "branch":
-        return 10 + branch_questions_asked + 1
-    else:  # final
-        return 10 + 6 + index + 1
-
-
-@dp.callback_query(lambda c: c.data.startswith(("first_", "branch_", "final_", "final_option1_", "final_option2_")))
-async def process_answer(callback: CallbackQuery, state: FSMContext):
-    """Обрабатывает ответ пользователя"""
-    data = callback.data
-    
-    # Обработка разных типов ответов
-    if data.startswith("final_option1_"):
-        option_index = int(data.split("_")[2])
-        await process_final_option(callback, state, 1, option_index)
+            text = question_text("first", index, bundle.first_questions[index], session.skipped)
+    return await replace_or_send(message, text, keyboard, edit, respond)
+
+
+async def skip_settled_questions(chat_id: int, state: FSMContext, session: Session, bundle) -> None:
+    """Сдвигает сессию к следующему вопросу этапа, который ещё может изменить итог"""
+    branch = session.current_branch
+    if session.stage == "first":
+        stage_code, start = STAGE_FIRST, session.question_index
+        with tracer.span("adaptive.next_first") as span:
+            nxt, confidence = planner.next_first(bundle.scoring, session.first_stage_answers, start)
+            span.set("skipped", nxt - start)
+    elif branch:
+        stage_code, start = STAGE_BRANCH, session.branch_questions_asked
+        with tracer.span("adaptive.next_branch") as span:
+            nxt, confidence = planner.next_branch(bundle.scoring, session.scores, branch, start)
+            span.set("skipped", nxt - start)
+    else:
         return
-    elif data.startswith("final_option2_"):
-        option_index = int(data.split("_")[2])
-        await process_final_option(callback, state, 2, option_index)
+    if nxt == start:
         return
+    for i in range(start, nxt):
+        if stage_code == STAGE_FIRST:
+            events.emit(eventlog.SKIP, chat_id, session.session_id, g=stage_code, i=i)
+        else:
+            events.emit(eventlog.SKIP, chat_id, session.session_id, g=stage_code, i=i, b=branch)
+    questions_skipped.inc(session.stage, amount=nxt - start)
+    logger.info(
+        "Адаптивный опрос: пропущены вопросы %s–%s этапа %s, уверенность %s", start, nxt - 1, session.stage, confidence,
+        extra={"stage": session.stage, "index": start},
+    )
+    if stage_code == STAGE_FIRST:
+        session.question_index = nxt
     else:
-        # Стандартная обработка для вопросов с числовой оценкой
-        parts = data.split("_")
-        prefix = parts[0]
-        score = int(parts[1])
-        index = int(parts[2])
-
-        state_data = await state.get_data()
-        scores = state_data.get("scores", [0] * len(PROGRAMS))
-        current_stage = state_data.get("stage", "first")
-        branch = state_data.get("current_branch", None)
-        branch_questions_asked = state_data.get("branch_questions_asked", 0)
-        question_index = state_data.get("question_index", 0)
-
-        logger.info(f"process_answer: prefix={prefix}, score={score}, index={index}, stage={current_stage}, question_index={question_index}")
-
-        # Обработка первого этапа - сохраняем ответы
-        if prefix == "first" and current_stage == "first":
-            if index < len(FIRST_STAGE_QUESTIONS):
-                first_stage_answers = state_data.get("first_stage_answers", [0] * len(FIRST_STAGE_QUESTIONS))
-                first_stage_answers[index] = score
-                # Увеличиваем индекс для первого этапа
-                new_index = index + 1
-                await state.update_data(
-                    first_stage_answers=first_stage_answers,
-                    question_index=new_index
-                )
-                logger.info(f"Первый этап: сохранен ответ {score} на вопрос {index}, новый индекс {new_index}")
-
-        # Обработка второго этапа - добавляем баллы к программам
-        elif prefix == "branch" and current_stage == "branch" and branch:
-            # Определяем, к какой программе относится вопрос
-            branch_programs = {
-                'A': BRANCH_A,
-                'B': BRANCH_B,
-                'C': BRANCH_C,
-                'D': BRANCH_D
-            }.get(branch, [])
-            
-            if branch_questions_asked < len(branch_programs):
-                prog_index = branch_programs[branch_questions_asked]
-                scores[prog_index] += score
-                logger.info(f"Ветка {branch}: добавлено {score} баллов к программе {PROGRAMS[prog_index]}")
-                
-                # Увеличиваем ТОЛЬКО счетчик вопросов ветки, НЕ увеличиваем question_index
-                await state.update_data(
-                    scores=scores,
-                    branch_questions_asked=branch_questions_asked + 1
-                )
-                
-                # Для второго этапа question_index не меняем, он остается равным 10
-                # Это важно, чтобы ask_question понимал, что мы на втором этапе
-            else:
-                logger.warning(f"Вопросов ветки больше чем программ: {branch_questions_asked} >= {len(branch_programs)}")
-
-        # Обработка финальных вопросов (с числовой оценкой)
-        elif prefix == "final" and current_stage == "final":
-            if index < len(FINAL_QUESTIONS):
-                final_answers = state_data.get("final_answers", {})
-                final_answers[f"q{index}"] = score
-                new_index = index + 1
-                await state.update_data(
-                    final_answers=final_answers,
-                    question_index=new_index
-                )
-                logger.info(f"Финальный вопрос {index}: сохранен ответ {score}, новый индекс {new_index}")
-
-        # Переходим к следующему вопросу
-        await ask_question(callback.message, state)
-        await callback.answer()
-
+        session.branch_questions_asked = nxt
+    session.skipped += nxt - start
+    await save_session(state, session)
+
+
+async def replace_or_send(
+    message: Message, text: str, keyboard=None, edit: bool = False, respond: bool = False, **kwargs
+) -> Optional[TelegramMethod]:
+    """
+    Показывает следующий шаг опроса. С edit=True (message — отвеченный вопрос)
+    в режиме QUESTION_MODE=edit сообщение редактируется на месте, и старая
+    клавиатура исчезает сама; если правка не удалась — уходит новое сообщение.
+    В режиме send у отвеченного вопроса просто снимается клавиатура.
+
+    С respond=True новое сообщение не отправляется, а возвращается — хендлер
+    отдаёт его в ответе на вебхук (см. reply_in_webhook); иначе возвращается None.
+    Правку так не отдаём: её ошибку (сообщение удалено или слишком старое)
+    бот бы не увидел, и запасная отправка не сработала бы — пользователь
+    остался бы на старом вопросе.
+    """
+    if edit and QUESTION_MODE == "edit":
+        method = message.edit_text(text, reply_markup=keyboard, **kwargs)
+        try:
+            await method
+            return None
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return None
+            logger.info("Не удалось отредактировать сообщение %s, отправляю новое: %s", message.message_id, e)
+    elif edit:
+        with suppress(TelegramBadRequest):
+            await message.edit_reply_markup(reply_markup=None)
+    method = message.answer(text, reply_markup=keyboard, **kwargs)
+    if edit and respond and reply_in_webhook(method, message.chat.id):
+        return method
+    await method
+    return None
+
+
+def reply_in_webhook(method: TelegramMethod, chat_id: int) -> bool:
+    """
+    Можно ли отдать запрос Telegram в HTTP-ответе на вебхук: без отдельного
+    обращения к Bot API он дойдёт на один сетевой круг раньше. Такой запрос
+    идёт мимо сессии бота, поэтому початовый лимит проверяется здесь и без
+    ожидания, а ошибку выполнения бот не увидит — так отвечаем только на
+    нажатие кнопки под существующим сообщением.
+    """
+    if not WEBHOOK_REPLY or not outbound.try_acquire(chat_id):
+        return False
+    webhook_replies.inc(method.__api_method__)
+    return True
+
+
+def is_current_question(session: Session, stage_code: int, index: int) -> bool:
+    """Кнопка относится к вопросу, который сейчас задан, а не к уже отвеченному"""
+    if stage_code == STAGE_FIRST:
+        return session.stage == "first" and index == session.question_index
+    if stage_code == STAGE_BRANCH:
+        return session.stage == "branch" and index == session.branch_questions_asked
+    return session.stage == "final" and index == session.question_index
+
+
+async def answer_duplicate(callback: CallbackQuery, text: Optional[str] = None) -> Optional[TelegramMethod]:
+    """Повторное нажатие: снимаем «часики» с кнопки, по возможности в ответе на вебхук"""
+    duplicates_dropped.inc("tap")
+    method = callback.answer(text)
+    if reply_in_webhook(method, callback.message.chat.id):
+        return method
+    await method
+
+
+@callback_router.route("q", arity=3)
+@tracer.traced()
+async def process_answer(callback: CallbackQuery, state: FSMContext, stage_code: int, score: int, index: int):
+    """Обрабатывает ответ пользователя на вопрос с числовой оценкой"""
+    session = await load_active_session(state)
+    if session is None:
+        await session_expired(callback)
+        return
+    if not is_current_question(session, stage_code, index):
+        # Повторное нажатие или кнопка старого вопроса — ответ уже учтён
+        return await answer_duplicate(callback, "Этот вопрос уже пройден")
+    current_stage = session.stage
+    branch = session.current_branch
+    branch_questions_asked = session.branch_questions_asked
+    question_index = session.question_index
+    session_id = session.session_id
+    chat_id = callback.message.chat.id
+    bundle = content.get(session.content_version)
+
+    logger.info(
+        "process_answer: stage_code=%s, score=%s, index=%s, stage=%s, question_index=%s",
+        stage_code, score, index, current_stage, question_index,
+        extra={"stage": current_stage, "index": index, "score": score},
+    )
 
+    # Обработка первого этапа - сохраняем ответы
+    if stage_code == STAGE_FIRST and current_stage == "first":
+        if index < len(bundle.first_questions):
+            session.first_stage_answers[index] = score
+            # Увеличиваем индекс для первого этапа
+            new_index = index + 1
+            session.question_index = new_index
+            await save_session(state, session)
+            events.emit(eventlog.ANSWER, chat_id, session_id, g=stage_code, i=index, v=score)
+            logger.info("Первый этап: сохранен ответ %s на вопрос %s, новый индекс %s", score, index, new_index)
+
+    # Обработка второго этапа - добавляем баллы к программам
+    elif stage_code == STAGE_BRANCH and current_stage == "branch" and branch:
+        if branch_questions_asked < len(bundle.branch_questions[branch]):
+            # Баллы добавляются по строке матрицы вопроса; вопросы сверх числа программ ветки баллов не дают
+            with tracer.span("scoring.add_branch_answer"):
+                bundle.scoring.add_branch_answer(session.scores, branch, branch_questions_asked, score)
+            logger.info("Ветка %s: ответ %s на вопрос %s", branch, score, branch_questions_asked)
+
+            # Увеличиваем ТОЛЬКО счетчик вопросов ветки, НЕ увеличиваем question_index
+            session.branch_questions_asked = branch_questions_asked + 1
+            await save_session(state, session)
+            events.emit(eventlog.ANSWER, chat_id, session_id, g=stage_code, i=branch_questions_asked, v=score, b=branch)
+
+            # Для второго этапа question_index не меняем, он остается равным 10
+            # Это важно, чтобы ask_question понимал, что мы на втором этапе
+        else:
+            logger.warning("Лишний ответ ветки %s: %s >= %s", branch, branch_questions_asked, len(bundle.branch_questions[branch]))
+
+    # Обработка финальных вопросов (с числовой оценкой)
+    elif stage_code == STAGE_FINAL and current_stage == "final":
+        if index < len(bundle.final_questions):
+            # Числовой финальный вопрос один — интенсивность
+            session.intensity = score
+            new_index = index + 1
+            session.question_index = new_index
+            await save_session(state, session)
+            events.emit(eventlog.ANSWER, chat_id, session_id, g=stage_code, i=index, v=score)
+            logger.info("Финальный вопрос %s: сохранен ответ %s, новый индекс %s", index, score, new_index)
+
+    # Ответ на нажатие уходит параллельно, следующий вопрос (в том же сообщении) — в ответе на вебхук
+    sender.run_now(callback.answer)
+    return await ask_question(callback.message, state, edit=True, respond=True)
+
+
+@callback_router.route("opt", arity=2)
+@tracer.traced()
 async def process_final_option(callback: CallbackQuery, state: FSMContext, question_num: int, option_index: int):
     """Обрабатывает ответ на финальные вопросы с вариантами"""
-    state_data = await state.get_data()
-    current_stage = state_data.get("stage", "final")
-    index = state_data.get("question_index", 0)
-    
-    logger.info(f"process_final_option: question={question_num}, option={option_index}, index={index}")
-    
-    final_answers = state_data.get("final_answers", {})
-    
+    session = await load_active_session(state)
+    if session is None:
+        await session_expired(callback)
+        return
+    index = session.question_index
+    if session.stage != "final" or question_num != index:
+        return await answer_duplicate(callback, "Этот вопрос уже пройден")
+
+    logger.info(
+        "process_final_option: question=%s, option=%s, index=%s", question_num, option_index, index,
+        extra={"stage": "final", "index": index},
+    )
+
     if question_num == 1:
-        final_answers["frequency"] = option_index
+        session.frequency = option_index
     else:
-        final_answers["sphere"] = option_index
-    
-    new_index = index + 1
-    await state.update_data(
-        final_answers=final_answers,
-        question_index=new_index
-    )
-    
-    await ask_question(callback.message, state)
-    await callback.answer()
+        session.sphere = option_index
 
+    session.question_index = index + 1
+    await save_session(state, session)
+    events.emit(eventlog.OPTION, callback.message.chat.id, session.session_id, q=question_num, v=option_index)
 
-async def determine_branch(message: Message, state: FSMContext):
-    data = await state.get_data()
-    first_answers = data.get("first_stage_answers", [0] * len(FIRST_STAGE_QUESTIONS))
-    scores = [0] * len(PROGRAMS)
+    sender.run_now(callback.answer)
+    return await ask_question(callback.message, state, edit=True, respond=True)
 
-    # Распределяем баллы по веткам (примерное распределение — подстрой под свои вопросы)
-    for i, score in enumerate(first_answers):
-        if i < 3:  # вопросы 0–2 → A
-            for idx in BRANCH_A: scores[idx] += score
-        elif i < 6:  # 3–5 → B
-            for idx in BRANCH_B: scores[idx] += score
-        elif i < 8:  # 6–7 → C
-            for idx in BRANCH_C: scores[idx] += score
-        else:  # 8–9 → D
-            for idx in BRANCH_D: scores[idx] += score
 
-    await state.update_data(scores=scores)
+@timed(handler_seconds)
+@tracer.traced()
+async def determine_branch(message: Message, state: FSMContext, edit: bool = False, respond: bool = False):
+    session = await load_session(state)
+    scoring = content.get(session.content_version).scoring
 
-    branch_scores = get_branch_scores(scores)
-    top_branches = get_top_branches(branch_scores)
+    # Распределяем баллы по веткам через матрицу общих вопросов (first_stage.branch в бандле)
+    with tracer.span("scoring.branches"):
+        session.scores = scoring.first_stage_scores(session.first_stage_answers)
+        branch_scores = scoring.branch_scores(session.scores)
+        top_branches = scoring.top_branches(branch_scores)
 
     if len(top_branches) == 1:
-        await state.update_data(
-            current_branch=top_branches[0],
-            stage="branch",
-            branch_questions_asked=0
-        )
-        await ask_question(message, state)
+        session.current_branch = top_branches[0]
+        session.stage = "branch"
+        session.branch_questions_asked = 0
+        await save_session(state, session)
+        events.emit(eventlog.BRANCH, message.chat.id, session.session_id, b=top_branches[0])
+        return await ask_question(message, state, edit, respond)
     else:
-        await state.update_data(
-            tie_branches=top_branches,
-            stage="branch_tie"
-        )
-        await ask_question(message, state)
-
-@dp.callback_query(lambda c: c.data.startswith("tie_branch_"))
-async def process_branch_tie(callback: CallbackQuery, state: FSMContext):
+        # Пара веток в алфавитном порядке, как ключи tie_questions бандла: «Вариант 1» — первая ветка
+        session.tie_branches = sorted(top_branches)
+        session.stage = "branch_tie"
+        await save_session(state, session)
+        events.emit(eventlog.TIE, message.chat.id, session.session_id, p="".join(sorted(top_branches)))
+        return await ask_question(message, state, edit, respond)
+
+@callback_router.route("tie", arity=1)
+@tracer.traced()
+async def process_branch_tie(callback: CallbackQuery, state: FSMContext, choice: int):
     """Обрабатывает ответ на вопрос-разрешитель между ветками"""
-    choice = callback.data.split("_")[2]  # "1" или "2"
-    
-    data = await state.get_data()
-    tie_branches = data.get("tie_branches", ['A', 'B'])
-    
-    # Выбираем ветку в зависимости от ответа
-    selected_branch = tie_branches[0] if choice == "1" else tie_branches[1]
-    
-    await state.update_data(
-        current_branch=selected_branch,
-        stage="branch",
-        branch_questions_asked=0,
-        question_index=10,  # Фиксируем индекс на 10 для второго этапа
-        tie_branches=None
+    session = await load_active_session(state)
+    if session is None:
+        await session_expired(callback)
+        return
+    if session.stage != "branch_tie":
+        return await answer_duplicate(callback)
+    tie_branches = session.tie_branches or ("A", "B")
+
+    # Выбираем ветку в зависимости от ответа (1 или 2)
+    selected_branch = tie_branches[0] if choice == 1 else tie_branches[1]
+
+    session.current_branch = selected_branch
+    session.stage = "branch"
+    session.branch_questions_asked = 0
+    session.question_index = 10  # Фиксируем индекс на 10 для второго этапа
+    session.tie_branches = None
+    await save_session(state, session)
+    events.emit(
+        eventlog.TIE_CHOICE, callback.message.chat.id, session.session_id,
+        p="".join(tie_branches), v=choice, b=selected_branch,
     )
-    
-    logger.info(f"Tie-breaker: выбрана ветка {selected_branch}")
-    await callback.message.edit_text("Спасибо! Теперь я лучше понимаю твою ситуацию. Продолжим с уточняющими вопросами.")
-    await asyncio.sleep(1)
-    await ask_question(callback.message, state)
-    await callback.answer()
+
+    logger.info("Tie-breaker: выбрана ветка %s", selected_branch, extra={"stage": "branch_tie"})
+    sender.run_now(callback.answer)
+    sender.schedule(callback.message.chat.id, [(1, lambda: ask_question(callback.message, state))])
+    thanks = callback.message.edit_text("Спасибо! Теперь я лучше понимаю твою ситуацию. Продолжим с уточняющими вопросами.")
+    if reply_in_webhook(thanks, callback.message.chat.id):
+        return thanks
+    await thanks
 
 
-async def ask_final_questions(message: Message, state: FSMContext, question_index: int):
+async def ask_final_questions(
+    message: Message, state: FSMContext, question_index: int, edit: bool = False, respond: bool = False
+):
     """Переходит к финальным вопросам"""
-    logger.info(f"Переход к финальным вопросам, индекс={question_index}")
-    await state.update_data(
-        stage="final",
-        question_index=question_index
-    )
-    await ask_question(message, state)
+    logger.info("Переход к финальным вопросам, индекс=%s", question_index, extra={"stage": "final"})
+    session = await load_session(state)
+    session.stage = "final"
+    session.question_index = question_index
+    await save_session(state, session)
+    return await ask_question(message, state, edit, respond)
 
 
 # ==================== ЗАВЕРШЕНИЕ ДИАГНОСТИКИ ====================
-async def finish_diagnostics(message: Message, state: FSMContext):
-    data = await state.get_data()
-    scores = data.get("scores", [0] * len(PROGRAMS))
-    
-    # Сортируем топ-3
-    program_scores = list(zip(PROGRAMS, scores))
-    program_scores.sort(key=lambda x: x[1], reverse=True)
-    top3 = program_scores[:3]
+@timed(handler_seconds)
+@tracer.traced()
+async def finish_diagnostics(message: Message, state: FSMContext, edit: bool = False):
+    session = await load_session(state)
+    scores = list(session.scores)
+    bundle = content.get(session.content_version)
+
+    # Топ-3
+    with tracer.span("scoring.top_programs"):
+        top = [p for p, _ in bundle.scoring.top_programs(scores, 3)]
+    events.emit(eventlog.FINISH, message.chat.id, session.session_id, p=top, sc=scores)
+    result = Result(
+        user_id=message.chat.id,
+        version=str(bundle.version),
+        started=session.started,
+        finished=time.time(),
+        scores=scores,
+        top=top,
+        final={"intensity": session.intensity, "frequency": session.frequency, "sphere": session.sphere},
+    )
+    results.put(result)
+    send_result(message, result, pause=2, edit=edit)
+    await state.clear()
+
+
+def send_result(message: Message, result: Result, pause: float, edit: bool = False) -> None:
+    """
+    Отправляет результат в фоне, сообщения идут с паузой для чтения.
+    С edit=True первое сообщение заменяет последний вопрос.
+    """
+    if result.rendered is None:
+        result.rendered = render_result(result)
+    first, *texts, last = result.rendered
+    steps = [(0, lambda: replace_or_send(message, first, edit=edit, parse_mode="HTML"))]
+    steps.extend((pause, lambda text=text: message.answer(text, parse_mode="HTML")) for text in texts)
+    steps.append((pause, lambda: message.answer(last, reply_markup=RESULT_KEYBOARD, parse_mode="HTML")))
+    sender.schedule(message.chat.id, steps)
+
+
+def result_bundle(result: Result) -> Optional[ContentBundle]:
+    """Версия контента, на которой пройдена диагностика; None — её нет, а программы текущей другие"""
+    try:
+        return content.get(int(result.version), fits=lambda bundle: len(bundle.programs) == len(result.scores))
+    except ContentError as e:
+        logger.warning("Результат %s не показать: %s", result.user_id, e)
+        return None
+
+
+def render_result(result: Result) -> List[str]:
+    """Пять сообщений результата: топ-3, описание каждой программы, предложение"""
+    # Названия и описания — из той версии контента, на которой пройдена диагностика
+    bundle = result_bundle(result)
+    ranked = [(p, result.scores[p]) for p in result.top]
+    top3 = [(bundle.programs[p], score) for p, score in ranked]
 
     # Краткие описания (первое предложение из полного текста)
-    short_desc = []
-    for prog, score in top3:
-        full = PROGRAM_DESCRIPTIONS[PROGRAMS.index(prog)]
-        short = full.split('\n')[0].strip()  # первое предложение
-        short_desc.append((prog, score, short))
+    short_desc = [(bundle.programs[p], score, bundle.short_descriptions[p]) for p, score in ranked]
 
     # Сообщение 1: Диагностика завершена + топ-3 названия
     msg1 = f"""✨ Диагностика завершена! ✨
@@ -839,9 +856,6 @@ async def finish_diagnostics(message: Message, state: FSMContext):
 
 📌 Сейчас я пришлю, как программы проигрываются в твое жизни и влияют на твои решения и выборы."""
 
-    await message.answer(msg1, parse_mode="HTML")
-    await asyncio.sleep(2)  # пауза для чтения
-
     # Сообщение 2: Описание первой программы
     msg2 = f"""<b>{short_desc[0][0]}</b> — {short_desc[0][1]} баллов
 
@@ -849,9 +863,6 @@ async def finish_diagnostics(message: Message, state: FSMContext):
 
 Эта программа **сейчас сильнее всего оказывает влияние** на твою жизнь."""
 
-    await message.answer(msg2, parse_mode="HTML")
-    await asyncio.sleep(2)
-
     # Сообщение 3: Описание второй программы
     msg3 = f"""<b>{short_desc[1][0]}</b> — {short_desc[1][1]} баллов
 
@@ -859,9 +870,6 @@ async def finish_diagnostics(message: Message, state: FSMContext):
 
 Эта программа **дополняет первую и усиливает её** влияние."""
 
-    await message.answer(msg3, parse_mode="HTML")
-    await asyncio.sleep(2)
-
     # Сообщение 4: Описание третьей программы
     msg4 = f"""<b>{short_desc[2][0]}</b> — {short_desc[2][1]} баллов
 
@@ -869,11 +877,8 @@ async def finish_diagnostics(message: Message, state: FSMContext):
 
 Эта программа **активируется во время стресса или при сильном триггере** и может резко усиливать всё остальное."""
 
-    await message.answer(msg4, parse_mode="HTML")
-    await asyncio.sleep(2)
-
     # Сообщение 5: 20% + предложение помощи + кнопки
-  msg5 = """То, что ты увидел(а) выше — это примерно **20%** от того, что на самом деле внутри сидит и управляет твоей жизнью.
+    msg5 = """То, что ты увидел(а) выше — это примерно **20%** от того, что на самом деле внутри сидит и управляет твоей жизнью.
 
 Если хочешь увидеть полную картину и понять, как ослабить эти программы, вот что ты можешь получить:
 
@@ -905,19 +910,45 @@ async def finish_diagnostics(message: Message, state: FSMContext):
 
 Что выбираешь?"""
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Получить полные описания (1–3)", callback_data="get_descriptions")],
-        [InlineKeyboardButton(text="Мини-разбор — 1000 ₽", callback_data="book_mini")],
-        [InlineKeyboardButton(text="Консультация — 6000 ₽", callback_data="book_consult")],
-        [InlineKeyboardButton(text="Пройти заново", callback_data="restart")]
-    ])
+    return [msg1, msg2, msg3, msg4, msg5]
+
+
+async def show_result(message: Message, user_id: int) -> None:
+    """Последний результат пользователя — одним поиском, без повторного прохождения"""
+    result = await results.get(user_id)
+    if result is None:
+        await message.answer("Результата пока нет — пройди диагностику ❤️", reply_markup=MAIN_MENU_KEYBOARD)
+        return
+    if result.rendered is None and result_bundle(result) is None:
+        await message.answer(
+            "Результат прошлой версии диагностики больше не показать — пройди её заново ❤️",
+            reply_markup=MAIN_MENU_KEYBOARD,
+        )
+        return
+    send_result(message, result, pause=1)
+
 
-    await message.answer(msg5, reply_markup=keyboard, parse_mode="HTML")
+@dp.message(Command("result"))
+@timed(handler_seconds)
+async def result_command(message: Message, state: FSMContext):
+    await show_result(message, message.from_user.id)
+
+
+@callback_router.route("result")
+async def result_callback(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    await show_result(callback.message, callback.from_user.id)
+
+
+@callback_router.route("restart")
+async def restart_callback(callback: CallbackQuery, state: FSMContext):
+    """«Пройти заново»: прежний результат остаётся доступным, пока не появится новый"""
     await state.clear()
+    await start_diagnostics_callback(callback, state)
 
 # ==================== ВЫБОР КОЛИЧЕСТВА ОПИСАНИЙ ====================
-@dp.callback_query(lambda c: c.data == "get_descriptions")
-async def show_desc_options(callback: CallbackQuery):
+@callback_router.route("descs")
+async def show_desc_options(callback: CallbackQuery, state: FSMContext):
     text = """Сколько подробных описаний программ хочешь получить?
 
 • 1 описание — 399 ₽  
@@ -926,27 +957,22 @@ async def show_desc_options(callback: CallbackQuery):
 
 (полное объяснение + как ослабить влияние)"""
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="1 описание — 399 ₽", callback_data="desc_1")],
-        [InlineKeyboardButton(text="2 описания — 599 ₽", callback_data="desc_2")],
-        [InlineKeyboardButton(text="3 описания — 799 ₽", callback_data="desc_3")],
-        [InlineKeyboardButton(text="Отмена", callback_data="cancel_desc")]
-    ])
-
-    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.message.edit_text(text, reply_markup=DESC_OPTIONS_KEYBOARD, parse_mode="HTML")
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("desc_"))
-async def process_desc_count(callback: CallbackQuery):
-    count = int(callback.data.split("_")[1])
+@callback_router.route("desc", arity=1)
+async def process_desc_count(callback: CallbackQuery, state: FSMContext, count: int):
     prices = {1: 399, 2: 599, 3: 799}
     price = prices[count]
 
-    # Топ-программы
-    # (можно взять из состояния, если сохранил, или из последнего сообщения — здесь упрощённо)
-    # Предполагаем, что scores есть в глобальном контексте или сохрани их в state
-    # Для примера — заглушка
-    top_programs = "Меня оставят, Внутренний критик, Вечная пустота"  # ← замени на реальный расчёт
+    # Топ-программы из последней завершённой диагностики
+    result = await results.get(callback.from_user.id)
+    bundle = result_bundle(result) if result else None
+    top_programs = (
+        ", ".join(bundle.programs[p] for p in result.top) if bundle
+        else "неизвестны (диагностика не пройдена)" if result is None
+        else "неизвестны (версия контента недоступна)"
+    )
 
     admin_text = f"""ЗАПРОС НА ОПИСАНИЯ!
 Пользователь: {callback.from_user.first_name} (@{callback.from_user.username or 'нет ника'})
@@ -956,46 +982,336 @@ ID: {callback.from_user.id}
 Программы: {top_programs}"""
 
     try:
-        await bot.send_message(ADMIN_ID, admin_text)
+        # Заявка сохраняется в outbox, администратору её доставит фоновая задача
+        await outbox.add(admin_text)
         await callback.message.edit_text(
             f"Заявка на {count} описание(й) за {price} ₽ отправлена!\n"
             "Я свяжусь с тобой и пришлю именно то, что нужно ❤️"
         )
     except Exception as e:
-        logger.error(f"Ошибка: {e}")
+        logger.error("Ошибка: %s", e)
         await callback.message.edit_text("Произошла ошибка. Напиши мне напрямую.")
 
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "cancel_desc")
-async def cancel_desc(callback: CallbackQuery):
+@callback_router.route("desc_cancel")
+async def cancel_desc(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text("Выбор отменён. Если передумаешь — пиши /start")
     await callback.answer()
 
+# ==================== ЗАПИСЬ ====================
+# Тег кнопки под результатом → название услуги и цена
+SERVICES = {"book_mini": ("Мини-разбор", 1000), "book_consult": ("Консультация", 6000)}
+PHONE_PATTERN = re.compile(r"\+?[\d\s()-]{10,20}")
+
+
+async def start_booking(callback: CallbackQuery, state: FSMContext, service: str):
+    title, price = SERVICES[service]
+    await state.set_state(Form.waiting_for_name)
+    await state.set_data({"booking_service": service})
+    await callback.message.answer(f"Запись: {title} — {price} ₽\n\nКак тебя зовут?")
+    await callback.answer()
+
+
+@callback_router.route("book_mini")
+async def book_mini(callback: CallbackQuery, state: FSMContext):
+    await start_booking(callback, state, "book_mini")
+
+
+@callback_router.route("book_consult")
+async def book_consult(callback: CallbackQuery, state: FSMContext):
+    await start_booking(callback, state, "book_consult")
+
+
+@dp.message(Form.waiting_for_name, F.text, ~F.text.startswith("/"))
+@timed(handler_seconds)
+async def process_booking_name(message: Message, state: FSMContext):
+    name = message.text.strip()[:100]
+    await state.update_data(booking_name=name)
+    await state.set_state(Form.waiting_for_phone)
+    await message.answer(f"{name}, оставь номер телефона для связи (например, +7 900 123-45-67)")
+
+
+@dp.message(Form.waiting_for_phone, F.text, ~F.text.startswith("/"))
+@timed(handler_seconds)
+async def process_booking_phone(message: Message, state: FSMContext):
+    phone = message.text.strip()
+    digits = sum(c.isdigit() for c in phone)
+    if not PHONE_PATTERN.fullmatch(phone) or not 10 <= digits <= 15:
+        await message.answer("Не похоже на номер телефона. Напиши его цифрами, например +7 900 123-45-67")
+        return
+    today, _ = bookings.today()
+    first_day = bookings.calendar.next_free_day(today)
+    if first_day is None:
+        await state.clear()
+        await message.answer("Свободного времени для записи сейчас нет. Напиши мне напрямую — что-нибудь придумаем ❤️")
+        return
+    await state.update_data(booking_phone=phone)
+    await state.set_state(Form.waiting_for_date)
+    keyboard = bookings.month_keyboard(month_key(date.fromordinal(first_day)))
+    await message.answer("Выбери удобный день:", reply_markup=keyboard)
+
+
+async def booking_data(callback: CallbackQuery, state: FSMContext) -> Optional[dict]:
+    """Данные записи, если пользователь сейчас выбирает день или время; иначе кнопка от старого календаря"""
+    if await state.get_state() in (Form.waiting_for_date.state, Form.waiting_for_time.state):
+        return await state.get_data()
+    await callback.answer("Эта запись уже завершена. Чтобы записаться, нажми кнопку под результатом")
+    return None
+
+
+async def edit_booking(message: Message, text: str, keyboard) -> None:
+    # Повторное нажатие даёт «message is not modified»
+    with suppress(TelegramBadRequest):
+        await message.edit_text(text, reply_markup=keyboard)
+
+
+async def stale_day(callback: CallbackQuery, state: FSMContext, day: int) -> bool:
+    """
+    День из кнопки вне открытого окна записи: календарь устарел (день прошёл)
+    или callback_data подделан. Показываем актуальный календарь.
+    """
+    if day in bookings.calendar:
+        return False
+    await callback.answer("Этот календарь устарел — выбери день заново")
+    today, _ = bookings.today()
+    first_day = bookings.calendar.next_free_day(today)
+    if first_day is not None:
+        await state.set_state(Form.waiting_for_date)
+        keyboard = bookings.month_keyboard(month_key(date.fromordinal(first_day)))
+        await edit_booking(callback.message, "Выбери удобный день:", keyboard)
+    return True
+
+
+@callback_router.route("bmon", arity=1)
+async def booking_month(callback: CallbackQuery, state: FSMContext, key: int):
+    if await booking_data(callback, state) is None:
+        return
+    await state.set_state(Form.waiting_for_date)
+    await edit_booking(callback.message, "Выбери удобный день:", bookings.month_keyboard(key))
+    await callback.answer()
+
+
+@callback_router.route("bday", arity=1)
+async def booking_day(callback: CallbackQuery, state: FSMContext, day: int):
+    if await booking_data(callback, state) is None or await stale_day(callback, state, day):
+        return
+    if not bookings.open_slots(day):
+        await callback.answer("На этот день свободного времени уже нет")
+        await edit_booking(
+            callback.message, "Выбери удобный день:", bookings.month_keyboard(month_key(date.fromordinal(day)))
+        )
+        return
+    await state.set_state(Form.waiting_for_time)
+    await edit_booking(
+        callback.message, f"{date.fromordinal(day):%d.%m}: выбери время", bookings.day_keyboard(day)
+    )
+    await callback.answer()
+
+
+@callback_router.route("bslot", arity=2)
+async def booking_slot(callback: CallbackQuery, state: FSMContext, day: int, slot: int):
+    data = await booking_data(callback, state)
+    if data is None or await stale_day(callback, state, day):
+        return
+    service = data["booking_service"]
+    if not await bookings.reserve(day, slot, callback.from_user.id, service, data["booking_name"], data["booking_phone"]):
+        # Слот успел занять кто-то другой — показываем, что осталось
+        await callback.answer("Это время только что заняли — выбери другое", show_alert=True)
+        if bookings.open_slots(day):
+            await edit_booking(
+                callback.message, f"{date.fromordinal(day):%d.%m}: выбери время", bookings.day_keyboard(day)
+            )
+        else:
+            await state.set_state(Form.waiting_for_date)
+            await edit_booking(
+                callback.message, "Выбери удобный день:", bookings.month_keyboard(month_key(date.fromordinal(day)))
+            )
+        return
+    await state.clear()
+
+    title, price = SERVICES[service]
+    when = bookings.describe(day, slot)
+    result = await results.get(callback.from_user.id)
+    bundle = result_bundle(result) if result else None
+    top_programs = (
+        ", ".join(bundle.programs[p] for p in result.top) if bundle
+        else "неизвестны (диагностика не пройдена)" if result is None
+        else "неизвестны (версия контента недоступна)"
+    )
+
+    admin_text = f"""ЗАПИСЬ!
+Услуга: {title} ({price} ₽)
+Когда: {when}
+Имя: {data['booking_name']}
+Телефон: {data['booking_phone']}
+Пользователь: {callback.from_user.first_name} (@{callback.from_user.username or 'нет ника'})
+ID: {callback.from_user.id}
+Программы: {top_programs}"""
+
+    try:
+        await outbox.add(admin_text)
+    except Exception as e:
+        # Слот уже за пользователем, запись есть в базе — заявку можно восстановить оттуда
+        logger.error("Заявка на запись %s/%s не сохранена в outbox: %s", day, slot, e)
+    await edit_booking(
+        callback.message,
+        f"Готово! {title}: {when}.\nЯ свяжусь с тобой по номеру {data['booking_phone']} ❤️",
+        None,
+    )
+    await callback.answer()
+
+
+@callback_router.route("bnone")
+async def booking_noop(callback: CallbackQuery, state: FSMContext):
+    """Пустая клетка календаря: только снимаем «часики»"""
+    method = callback.answer()
+    if reply_in_webhook(method, callback.message.chat.id):
+        return method
+    await method
+
+
+@callback_router.route("bcancel")
+async def booking_cancel(callback: CallbackQuery, state: FSMContext):
+    # Кнопка старого календаря не должна сбросить начатую диагностику
+    if await booking_data(callback, state) is None:
+        return
+    await state.clear()
+    await edit_booking(callback.message, "Запись отменена. Если передумаешь — пиши /start", None)
+    await callback.answer()
+
+# ==================== МАРШРУТИЗАЦИЯ CALLBACK ====================
+@dp.callback_query()
+async def route_callback(callback: CallbackQuery, state: FSMContext):
+    """Единая точка входа для всех inline-кнопок: разбор callback_data и поиск по таблице"""
+    return await callback_router.dispatch(callback, state)
+
+# ==================== ОБНОВЛЕНИЕ КОНТЕНТА ====================
+def reload_content() -> str:
+    """Подхватывает новую версию контента; если она не прошла проверку, остаётся прежняя"""
+    previous = content.current.version
+    try:
+        bundle = content.reload()
+    except (ContentError, OSError) as e:
+        logger.error("Контент не обновлён, остаётся v%s: %s", previous, e)
+        return f"❌ Контент не обновлён, остаётся v{previous}:\n{e}"
+    if bundle.version == previous:
+        return f"Контент уже актуален: v{previous}"
+    return f"✅ Контент обновлён: v{previous} → v{bundle.version}"
+
+
+@dp.message(Command("reload"))
+@timed(handler_seconds)
+async def reload_command(message: Message, state: FSMContext):
+    if message.from_user.id != ADMIN_ID:
+        return
+    report = reload_content()
+    if WORKER_PORT:
+        # Остальные воркеры кластера обновятся по SIGHUP от входного процесса
+        os.kill(os.getppid(), signal.SIGHUP)
+    await message.answer(report)
+
 # ==================== WEBHOOK ====================
 async def on_startup(bot: Bot):
     webhook_url = f"{os.getenv('WEBHOOK_URL')}/webhook"
     secret = os.getenv("WEBHOOK_SECRET", "secret")
     await bot.set_webhook(url=webhook_url, secret_token=secret)
-    logger.info(f"Webhook установлен: {webhook_url}")
+    logger.info("Webhook установлен: %s", webhook_url)
+    # Заявки доставляет только входной процесс: воркеры кластера их лишь записывают
+    outbox.start()
 
 async def on_shutdown(bot: Bot):
-    await bot.delete_webhook(drop_pending_updates=True)
-    logger.info("Webhook удалён")
+    # Вебхук не удаляется: апдейты, пришедшие во время остановки, ждут
+    # в очереди Telegram следующего запуска (он же, возможно, уже поставил свой вебхук)
+    await loop_lag.stop()
+    await sender.stop(SHUTDOWN_TIMEOUT)
+    await events.close()
+    await outbox.close()
+    await results.close()
+    await bookings.close()
+    if tracer.exporter is not None:
+        tracer.exporter.close()
 
 async def main():
-    dp.startup.register(on_startup)
+    port = int(os.getenv("PORT", 8080))
+    workers = int(os.getenv("WEB_WORKERS", "1"))
+
+    # Несколько процессов за одним портом: апдейты шардируются по chat_id
+    if workers > 1 and not WORKER_PORT:
+        await run_cluster(
+            workers=workers,
+            host="0.0.0.0",
+            port=port,
+            base_port=int(os.getenv("WORKER_BASE_PORT", port + 1)),
+            on_startup=lambda: on_startup(bot),
+            on_shutdown=lambda: on_shutdown(bot),
+            shutdown_timeout=SHUTDOWN_TIMEOUT,
+            # Входной процесс отдаёт на /metrics и метрики воркеров (их /metrics слушает только 127.0.0.1)
+            render_metrics=metrics.render,
+        )
+        return
+
+    if isinstance(fsm_storage, ExpiringStorage):
+        # Сессии, сохранённые до перезапуска, — под срок и предел; воркер кластера берёт только свой шард
+        accept = None
+        if WORKER_PORT:
+            shard = int(WORKER_PORT) - int(os.getenv("WORKER_BASE_PORT", port + 1))
+            accept = lambda key: key.chat_id % workers == shard
+        restored = await fsm_storage.restore(accept)
+        logger.info("Сессий с диска поставлено на учёт: %s", restored)
+
+    if not WORKER_PORT:
+        dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
-    app = web.Application()
-    webhook_handler = SimpleRequestHandler(dp, bot, secret_token=os.getenv("WEBHOOK_SECRET", "secret"))
+    app = web.Application(middlewares=[drain.middleware])
+    if UPDATE_WORKERS:
+        # Ответ сразу, обработка в пуле: медленный хендлер не задерживает доставку
+        webhook_handler = PooledRequestHandler(dp, bot, update_pool, secret_token=os.getenv("WEBHOOK_SECRET", "secret"))
+        update_pool.start(webhook_handler.feed)
+        drain.background = update_pool
+    else:
+        # Воркер отвечает входному процессу только после обработки апдейта,
+        # иначе порядок апдейтов одного чата не гарантирован. Одиночный процесс
+        # по умолчанию отвечает сразу и обрабатывает в фоне; так же, как воркер,
+        # он отвечает, только если включён WEBHOOK_REPLY: запрос, который вернул
+        # хендлер, уходит Telegram в теле ответа (дольше 55 с — всё же в фоне)
+        webhook_handler = SimpleRequestHandler(
+            dp, bot,
+            secret_token=os.getenv("WEBHOOK_SECRET", "secret"),
+            handle_in_background=not WORKER_PORT and not WEBHOOK_REPLY,
+        )
+        # Апдейты, отданные в фон, остановка тоже дожидается
+        drain.background = webhook_handler._background_feed_update_tasks
     webhook_handler.register(app, path="/webhook")
+    app.router.add_get("/metrics", metrics.handle)
     setup_application(app, dp, bot=bot)
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, "0.0.0.0", int(os.getenv("PORT", 8080)))
+    if WORKER_PORT:
+        site = web.TCPSite(runner, "127.0.0.1", int(WORKER_PORT))
+    else:
+        site = web.TCPSite(runner, "0.0.0.0", port)
     await site.start()
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    loop.add_signal_handler(signal.SIGHUP, reload_content)
+    loop_lag.start()
     logger.info("Сервер запущен")
-    await asyncio.Event().wait()
+    await stopping.wait()
+
+    # Плавная остановка: новые апдейты — 503 (Telegram повторит их следующему запуску),
+    # принятые дорабатываются, отложенные отправки уходят. Только потом закрываются
+    # сессия бота и хранилище — dp.shutdown закрывает FSM раньше on_shutdown
+    logger.info("Остановка: апдейты больше не принимаются")
+    deadline = loop.time() + SHUTDOWN_TIMEOUT
+    drain.start()
+    await drain.wait(SHUTDOWN_TIMEOUT)
+    await update_pool.stop()
+    await sender.stop(max(0.0, deadline - loop.time()))
+    await runner.cleanup()
+    logger.info("Остановлен")
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,82 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = ":"
+
+# Коды этапов в callback_data ответов
+STAGE_FIRST = 0
+STAGE_BRANCH = 1
+STAGE_FINAL = 2
+
+
+# ==================== КОДЕК CALLBACK_DATA ====================
+def pack(tag: str, *args: int) -> str:
+    """Собирает callback_data вида tag:1:2 (аргументы — только целые числа)"""
+    if not args:
+        return tag
+    return SEPARATOR.join((tag, *map(str, args)))
+
+
+def unpack(data: str) -> Tuple[str, Tuple[int, ...]]:
+    """Разбирает callback_data; ValueError, если аргументы не числа"""
+    tag, *args = data.split(SEPARATOR)
+    return tag, tuple(map(int, args))
+
+
+# ==================== МАРШРУТИЗАТОР ====================
+Handler = Callable[..., Awaitable[Any]]
+
+
+class CallbackRouter:
+    """
+    Маршрутизация callback-запросов по таблице тегов.
+
+    callback_data разбирается один раз, хендлер находится поиском в словаре
+    и вызывается как handler(callback, state, *args). У каждого тега задано
+    число аргументов, так что чужие или устаревшие кнопки отсекаются до хендлера.
+    Если задан ``observe``, он получает имя хендлера и время его работы в секундах.
+    """
+
+    def __init__(self, observe: Optional[Callable[[str, float], None]] = None) -> None:
+        self._routes: Dict[str, Tuple[Handler, int]] = {}
+        self._observe = observe
+
+    def route(self, tag: str, arity: int = 0) -> Callable[[Handler], Handler]:
+        def decorator(handler: Handler) -> Handler:
+            if tag in self._routes:
+                raise ValueError(f"Тег {tag!r} уже занят хендлером {self._routes[tag][0].__name__}")
+            self._routes[tag] = (handler, arity)
+            return handler
+        return decorator
+
+    def resolve(self, data: str) -> Tuple[Handler, Tuple[int, ...]]:
+        """Находит хендлер и аргументы для callback_data; KeyError, если маршрута нет"""
+        try:
+            tag, args = unpack(data)
+        except ValueError:
+            raise KeyError(data) from None
+        handler, arity = self._routes[tag]
+        if len(args) != arity:
+            raise KeyError(data)
+        return handler, args
+
+    async def dispatch(self, callback: CallbackQuery, state: FSMContext) -> Any:
+        try:
+            handler, args = self.resolve(callback.data or "")
+        except KeyError:
+            logger.warning("Неизвестный callback_data: %r", callback.data)
+            await callback.answer()
+            return None
+        if self._observe is None:
+            return await handler(callback, state, *args)
+        started = time.perf_counter()
+        try:
+            return await handler(callback, state, *args)
+        finally:
+            self._observe(handler.__name__, time.perf_counter() - started)
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+
+from drain import WebhookDrain
+from metrics import CONTENT_TYPE, merge_expositions
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+
+def update_chat_id(update: Dict[str, Any]) -> Optional[int]:
+    """Чат, к которому относится апдейт (для callback без сообщения — пользователь)"""
+    for key, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = value.get("from")
+        if user:
+            return user["id"]
+    return None
+
+
+# ==================== ВХОДНОЙ ПРОЦЕСС ====================
+class ShardedFront:
+    """
+    Принимает вебхук Telegram на общем порту и пересылает апдейт воркеру
+    с номером chat_id % N. Апдейты одного чата пересылаются строго по очереди:
+    следующий уходит только после ответа воркера на предыдущий, поэтому
+    у одного чата нет ни перестановок, ни параллельной обработки.
+
+    На GET /metrics входной процесс собирает /metrics всех воркеров и свои
+    (``render_metrics``) в один ответ с меткой worker — порт воркера или front.
+    """
+
+    def __init__(
+        self,
+        worker_urls: List[str],
+        timeout: float = 60.0,
+        metrics_urls: Optional[Dict[str, str]] = None,
+        render_metrics: Optional[Callable[[], str]] = None,
+    ) -> None:
+        self.worker_urls = worker_urls
+        self.timeout = timeout
+        self.metrics_urls = metrics_urls or {}
+        self.render_metrics = render_metrics
+        self._session: Optional[ClientSession] = None
+        self._locks: Dict[int, list] = {}  # chat_id -> [lock, сколько запросов ждёт]
+
+    async def start(self) -> None:
+        self._session = ClientSession(timeout=ClientTimeout(total=self.timeout))
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        chat_id = update_chat_id(update)
+        shard_key = chat_id if chat_id is not None else update.get("update_id", 0)
+        url = self.worker_urls[shard_key % len(self.worker_urls)]
+
+        entry = self._locks.setdefault(shard_key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await self._forward(url, body, request.headers.get(SECRET_HEADER, ""))
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[shard_key]
+
+    async def _forward(self, url: str, body: bytes, secret: str) -> web.Response:
+        headers = {SECRET_HEADER: secret, "Content-Type": "application/json"}
+        try:
+            async with self._session.post(url, data=body, headers=headers) as response:
+                payload = await response.read()
+                content_type = response.headers.get("Content-Type", "application/json")
+                return web.Response(body=payload, status=response.status, headers={"Content-Type": content_type})
+        except (ClientError, asyncio.TimeoutError) as e:
+            # Telegram повторит доставку, когда воркер снова будет доступен
+            logger.warning("Воркер %s недоступен: %s", url, e)
+            return web.Response(status=503)
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        names = list(self.metrics_urls)
+        texts = await asyncio.gather(*(self._fetch_metrics(self.metrics_urls[name]) for name in names))
+        parts = {}
+        if self.render_metrics is not None:
+            parts["front"] = self.render_metrics()
+        for name, text in zip(names, texts):
+            up = (
+                "# HELP bot_cluster_worker_up Воркер ответил на сбор метрик\n"
+                f"# TYPE bot_cluster_worker_up gauge\nbot_cluster_worker_up {int(text is not None)}\n"
+            )
+            parts[name] = (text or "") + up
+        return web.Response(body=merge_expositions(parts).encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    async def _fetch_metrics(self, url: str) -> Optional[str]:
+        try:
+            async with self._session.get(url, timeout=ClientTimeout(total=5)) as response:
+                response.raise_for_status()
+                return await response.text()
+        except (ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Метрики воркера %s недоступны: %s", url, e)
+            return None
+
+
+# ==================== ВОРКЕРЫ ====================
+async def supervise_worker(
+    port: int, stopping: asyncio.Event, running: Optional[Dict[int, asyncio.subprocess.Process]] = None
+) -> None:
+    """Запускает воркер bot.py на 127.0.0.1:port и перезапускает его, если он упал"""
+    env = {**os.environ, "WORKER_PORT": str(port)}
+    while not stopping.is_set():
+        process = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env=env)
+        if running is not None:
+            running[port] = process
+        logger.info("Воркер запущен: порт %s, pid %s", port, process.pid)
+        wait = asyncio.create_task(process.wait())
+        stop = asyncio.create_task(stopping.wait())
+        await asyncio.wait({wait, stop}, return_when=asyncio.FIRST_COMPLETED)
+        if stopping.is_set():
+            if process.returncode is None:
+                process.terminate()
+                await wait
+            break
+        stop.cancel()
+        logger.error("Воркер на порту %s завершился с кодом %s, перезапуск", port, process.returncode)
+        await asyncio.sleep(1)
+
+
+def forward_signal(running: Dict[int, asyncio.subprocess.Process], sig: int) -> None:
+    for process in running.values():
+        if process.returncode is None:
+            try:
+                process.send_signal(sig)
+            except ProcessLookupError:
+                pass
+
+
+async def run_cluster(
+    workers: int,
+    host: str,
+    port: int,
+    base_port: int,
+    on_startup: Callable[[], Awaitable[Any]],
+    on_shutdown: Callable[[], Awaitable[Any]],
+    shutdown_timeout: float = 25.0,
+    render_metrics: Optional[Callable[[], str]] = None,
+) -> None:
+    """Запускает N воркеров и входной процесс с шардированием по chat_id"""
+    stopping = asyncio.Event()
+    # Без обработчика SIGTERM входной процесс умер бы, оставив воркеров сиротами
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    ports = [base_port + i for i in range(workers)]
+    running: Dict[int, asyncio.subprocess.Process] = {}
+    supervisors = [asyncio.create_task(supervise_worker(p, stopping, running)) for p in ports]
+    # SIGHUP (обновление контента) получает каждый воркер
+    loop.add_signal_handler(signal.SIGHUP, forward_signal, running, signal.SIGHUP)
+
+    front = ShardedFront(
+        [f"http://127.0.0.1:{p}/webhook" for p in ports],
+        metrics_urls={str(p): f"http://127.0.0.1:{p}/metrics" for p in ports},
+        render_metrics=render_metrics,
+    )
+    await front.start()
+    drain = WebhookDrain()
+    app = web.Application(middlewares=[drain.middleware])
+    app.router.add_post("/webhook", front.handle)
+    app.router.add_get("/metrics", front.metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    await on_startup()
+    logger.info("Кластер запущен: %s воркеров за портом %s", workers, port)
+
+    try:
+        await stopping.wait()
+    finally:
+        # Новые апдейты — 503, Telegram повторит их следующему запуску; воркеры
+        # получают SIGTERM и дорабатывают то, что уже приняли
+        drain.start()
+        stopping.set()
+        await drain.wait(shutdown_timeout)
+        await on_shutdown()
+        await asyncio.gather(*supervisors, return_exceptions=True)
+        await runner.cleanup()
+        await front.close()
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from render import KeyboardRegistry, RenderKey, Rendered, build_question_renders
+from scoring import BRANCHES, ScoringEngine
+
+logger = logging.getLogger(__name__)
+
+# Каталог контента по умолчанию — рядом с кодом
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "content")
+# Файл версии N в каталоге контента: vN.json
+BUNDLE_FILE = re.compile(r"^v(\d+)\.json$")
+# Предел длины сообщения Telegram
+MESSAGE_LIMIT = 4096
+# Финальные вопросы разбираются кодом по номеру: интенсивность, частота, сфера
+FINAL_QUESTIONS = 3
+# Счётчики и индексы сессии — байты, 0xFF занят под «нет значения»
+MAX_ITEMS = 254
+# Баллы программ в сессии — тоже по байту; ответ с оценкой даёт программе не больше MAX_ANSWER
+MAX_SCORE = 0xFF
+MAX_ANSWER = 5
+MAX_VERSION = 0xFFFF
+
+
+class ContentError(ValueError):
+    """Бандл контента не прошёл проверку"""
+
+
+def _check(condition: bool, message: str) -> None:
+    if not condition:
+        raise ContentError(message)
+
+
+def _texts(value: Any, name: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    _check(isinstance(value, list) and value, f"{name}: нужен непустой список строк")
+    for i, text in enumerate(value):
+        _check(isinstance(text, str) and text.strip(), f"{name}[{i}]: пустая строка")
+        _check(len(text) <= limit, f"{name}[{i}]: длиннее {limit} символов")
+    _check(len(value) <= MAX_ITEMS, f"{name}: больше {MAX_ITEMS} элементов")
+    return value
+
+
+# ==================== БАНДЛ КОНТЕНТА ====================
+class ContentBundle:
+    """
+    Одна версия опроса и описаний программ, проверенная и собранная при загрузке.
+
+    Кроме исходных списков держит всё, что нужно на горячем пути: готовые
+    тексты и клавиатуры вопросов (``renders``), движок подсчёта по матрицам
+    этой версии (``scoring``) и краткие описания программ. После сборки
+    бандл не меняется, поэтому его можно отдавать хендлерам без копий.
+    """
+
+    __slots__ = (
+        "version", "digest", "programs", "descriptions", "short_descriptions",
+        "branch_programs", "first_questions", "first_stage_branches", "branch_questions",
+        "tie_questions", "final_questions", "frequency_options", "sphere_options",
+        "scoring", "renders",
+    )
+
+    def __init__(self, data: Dict[str, Any], registry: KeyboardRegistry, digest: str = "") -> None:
+        _check(isinstance(data, dict), "бандл должен быть JSON-объектом")
+        version = data.get("version")
+        _check(isinstance(version, int) and 0 < version <= MAX_VERSION, f"version: целое от 1 до {MAX_VERSION}")
+        self.version: int = version
+        self.digest = digest
+
+        programs = data.get("programs")
+        _check(isinstance(programs, list) and programs, "programs: нужен непустой список")
+        _check(all(isinstance(p, dict) for p in programs), "programs: элементы — объекты {name, description}")
+        self.programs = _texts([p.get("name") for p in programs], "programs.name", 64)
+        self.descriptions = _texts([p.get("description") for p in programs], "programs.description")
+        # Краткое описание — первая строка полного текста
+        self.short_descriptions = [d.split("\n")[0].strip() for d in self.descriptions]
+
+        branches = data.get("branches")
+        _check(isinstance(branches, dict) and sorted(branches) == list(BRANCHES), f"branches: ровно ветки {BRANCHES}")
+        self.branch_programs: Dict[str, List[int]] = {}
+        self.branch_questions: Dict[str, List[str]] = {}
+        seen: Dict[int, str] = {}
+        for b in BRANCHES:
+            indexes = branches[b].get("programs") if isinstance(branches[b], dict) else None
+            _check(isinstance(indexes, list) and indexes, f"branches.{b}.programs: нужен непустой список")
+            for p in indexes:
+                _check(isinstance(p, int) and 0 <= p < len(self.programs), f"branches.{b}.programs: нет программы {p!r}")
+                _check(p not in seen, f"программа {p} в ветках {seen.get(p)} и {b}")
+                seen[p] = b
+            self.branch_programs[b] = indexes
+            self.branch_questions[b] = _texts(branches[b].get("questions"), f"branches.{b}.questions")
+        _check(len(seen) == len(self.programs), f"программы вне веток: {sorted(set(range(len(self.programs))) - set(seen))}")
+
+        first_stage = data.get("first_stage")
+        _check(isinstance(first_stage, list) and first_stage, "first_stage: нужен непустой список")
+        _check(all(isinstance(q, dict) for q in first_stage), "first_stage: элементы — объекты {text, branch}")
+        self.first_questions = _texts([q.get("text") for q in first_stage], "first_stage.text")
+        self.first_stage_branches = [q.get("branch") for q in first_stage]
+        for i, b in enumerate(self.first_stage_branches):
+            _check(b in BRANCHES, f"first_stage[{i}].branch: неизвестная ветка {b!r}")
+
+        tie = data.get("tie_questions", {})
+        _check(isinstance(tie, dict), "tie_questions: нужен объект «A_B» → текст")
+        for pair in tie:
+            first, _, second = pair.partition("_")
+            _check(first in BRANCHES and second in BRANCHES and first < second, f"tie_questions: неверная пара {pair!r}")
+        if tie:
+            _texts(list(tie.values()), "tie_questions")
+        self.tie_questions: Dict[str, str] = tie
+
+        final = data.get("final")
+        _check(isinstance(final, dict), "final: нужен объект")
+        self.final_questions = _texts(final.get("questions"), "final.questions")
+        _check(len(self.final_questions) == FINAL_QUESTIONS, f"final.questions: ровно {FINAL_QUESTIONS} вопроса")
+        self.frequency_options = _texts(final.get("frequency_options"), "final.frequency_options", 64)
+        self.sphere_options = _texts(final.get("sphere_options"), "final.sphere_options", 64)
+
+        self.scoring = ScoringEngine(
+            num_programs=len(self.programs),
+            branch_programs=self.branch_programs,
+            first_stage_branches=self.first_stage_branches,
+            branch_question_counts={b: len(q) for b, q in self.branch_questions.items()},
+        )
+        # Наибольший возможный балл программы: все вопросы, которые её считают, отвечены на максимум
+        for p in range(len(self.programs)):
+            rows = [row[p] for row in self.scoring.first_stage_weights]
+            rows += [row[p] for weights in self.scoring.branch_weights.values() for row in weights]
+            highest = MAX_ANSWER * sum(rows)
+            _check(highest <= MAX_SCORE, f"программа {p}: до {highest} баллов, в сессии помещается {MAX_SCORE}")
+        self.renders: Dict[RenderKey, Rendered] = build_question_renders(
+            registry,
+            first_questions=self.first_questions,
+            branch_questions=self.branch_questions,
+            final_questions=self.final_questions,
+            frequency_options=self.frequency_options,
+            sphere_options=self.sphere_options,
+            tie_questions=self.tie_questions,
+        )
+        for key, (text, _) in self.renders.items():
+            _check(len(text) <= MESSAGE_LIMIT, f"вопрос {key}: длиннее {MESSAGE_LIMIT} символов")
+
+
+def load_bundle(path: str, registry: KeyboardRegistry) -> ContentBundle:
+    """Читает, проверяет и собирает бандл из JSON-файла"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        raise ContentError(f"{path}: не JSON: {e}") from e
+    bundle = ContentBundle(data, registry, hashlib.sha256(raw).hexdigest())
+    match = BUNDLE_FILE.match(os.path.basename(path))
+    if match:
+        _check(int(match.group(1)) == bundle.version, f"{path}: в файле version {bundle.version}")
+    return bundle
+
+
+# ==================== ВЕРСИИ КОНТЕНТА ====================
+class ContentLibrary:
+    """
+    Версии контента из каталога (файлы vN.json).
+
+    ``current`` — последняя версия, на ней начинаются новые диагностики;
+    начатые остаются на своей (``get``), старые версии читаются с диска
+    по требованию. ``reload`` собирает новую версию полностью и лишь затем
+    подменяет ``current`` одним присваиванием: хендлер, взявший бандл,
+    до конца работает с ним. Содержимое опубликованной версии менять нельзя —
+    правка текста означает новый файл со следующим номером.
+    """
+
+    def __init__(self, directory: str, registry: KeyboardRegistry) -> None:
+        self.directory = directory
+        self.registry = registry
+        self._bundles: Dict[int, ContentBundle] = {}
+        latest = self._latest()
+        _check(latest is not None, f"{directory}: нет файлов контента vN.json")
+        self.current = self._load(latest)
+
+    def _path(self, version: int) -> str:
+        return os.path.join(self.directory, f"v{version}.json")
+
+    def _latest(self) -> Optional[int]:
+        versions = [int(m.group(1)) for m in map(BUNDLE_FILE.match, os.listdir(self.directory)) if m]
+        return max(versions, default=None)
+
+    def _load(self, version: int) -> ContentBundle:
+        # Клавиатуры прежних версий в общий реестр не попадают: их сериализует сессия бота
+        registry = self.registry if not self._bundles else KeyboardRegistry()
+        bundle = load_bundle(self._path(version), registry)
+        self._bundles[version] = bundle
+        return bundle
+
+    def _retire(self, bundle: ContentBundle) -> None:
+        """Убирает клавиатуры бандла из общего реестра; сам бандл остаётся для начатых на нём сессий"""
+        for _, markup in bundle.renders.values():
+            self.registry.discard(markup)
+
+    def get(self, version: Optional[int], fits: Optional[Callable[[ContentBundle], bool]] = None) -> ContentBundle:
+        """
+        Бандл версии, на которой начата сессия. Если его больше нет, вместо
+        него берётся текущий (и дальше отдаётся вместо этой версии), но только
+        когда ``fits`` подтверждает, что разметка та же (число вопросов и
+        программ); иначе — ContentError: ответы и баллы легли бы не на те
+        вопросы и программы.
+        """
+        bundle = self._bundles.get(version) if version is not None else self.current
+        if bundle is not None:
+            return bundle
+        try:
+            return self._load(version)
+        except (OSError, ContentError) as e:
+            if fits is None or not fits(self.current):
+                raise ContentError(f"v{version} недоступен, а разметка v{self.current.version} другая: {e}") from e
+            logger.warning("Контент v%s недоступен (%s), используется v%s", version, e, self.current.version)
+            self._bundles[version] = self.current
+            return self.current
+
+    def reload(self) -> ContentBundle:
+        """Подхватывает последнюю версию из каталога; при ошибке current не меняется"""
+        latest = self._latest()
+        _check(latest is not None, f"{self.directory}: нет файлов контента vN.json")
+        _check(latest >= self.current.version, f"последняя версия v{latest} старше текущей v{self.current.version}")
+        # Клавиатуры попадают в общий реестр, только если версия действительно подменяет current
+        staged = KeyboardRegistry()
+        bundle = load_bundle(self._path(latest), staged)
+        known = self._bundles.get(latest)
+        if known is not None:
+            _check(known.digest == bundle.digest, f"v{latest} изменён после публикации — нужна новая версия")
+            if known is self.current:
+                return self.current
+        self.registry.adopt(staged)
+        self._bundles[latest] = bundle
+        previous, self.current = self.current, bundle
+        self._retire(previous)
+        logger.info("Контент обновлён до v%s", latest)
+        return bundle
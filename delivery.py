@@ -0,0 +1,133 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from ratelimit import BULK, send_priority
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[Any]]
+
+
+# ==================== ОТЛОЖЕННАЯ ОТПРАВКА ====================
+class DelayedSender:
+    """
+    Планировщик отложенных отправок, принадлежащий приложению, а не хендлеру.
+
+    Хендлер ставит в очередь цепочку шагов (пауза, отправка) и сразу возвращается.
+    Шаги одного чата выполняются строго по порядку: пауза следующего шага
+    отсчитывается от завершения предыдущего. Все ожидания хранятся в одной куче
+    таймеров, поэтому тысячи ожидающих чатов не создают тысячи спящих корутин.
+
+    ``bind(name, job)`` вызывается при постановке каждого шага в контексте
+    хендлера и может обернуть шаг (трассировка: см. Tracer.deferred).
+    """
+
+    def __init__(self, max_concurrency: int = 100, bind: Optional[Callable[[str, Job], Job]] = None) -> None:
+        self.bind = bind
+        self._chats: Dict[int, Deque[Tuple[float, Job]]] = {}
+        self._heap: List[Tuple[float, int, int]] = []
+        self._seq = itertools.count()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._active: set = set()
+
+    @property
+    def pending(self) -> int:
+        """Количество шагов, ожидающих отправки"""
+        return sum(len(steps) for steps in self._chats.values())
+
+    def schedule(self, chat_id: int, steps: Iterable[Tuple[float, Job]]) -> None:
+        """Ставит цепочку шагов (пауза в секундах, функция отправки) в очередь чата"""
+        steps = list(steps)
+        if self.bind is not None:
+            steps = [(delay, self.bind("sender.step", job)) for delay, job in steps]
+        if not steps:
+            return
+        self.start()
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            self._chats[chat_id] = deque(steps)
+            self._push(chat_id, steps[0][0])
+        else:
+            # Чат уже обслуживается — новые шаги пойдут после текущих
+            queue.extend(steps)
+
+    def run_now(self, job: Job) -> None:
+        """Выполняет отправку сразу и не ждёт её; очередь чата и паузы не затрагиваются"""
+        if self.bind is not None:
+            job = self.bind("sender.run_now", job)
+        task = asyncio.create_task(self._run_now(job))
+        self._active.add(task)
+        task.add_done_callback(self._active.discard)
+
+    async def _run_now(self, job: Job) -> None:
+        try:
+            await job()
+        except Exception as e:
+            logger.error("DelayedSender: ошибка отправки: %s", e)
+
+    def start(self) -> None:
+        if self._runner is None or self._runner.done():
+            self._wakeup = asyncio.Event()
+            # Планировщик не наследует контекст хендлера, который его запустил:
+            # иначе его спан и поля лога достались бы всем следующим шагам
+            self._runner = contextvars.Context().run(asyncio.create_task, self._run())
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Дожидается отправки всего, что уже запланировано, и останавливает планировщик"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (self._chats or self._active) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        if self._chats:
+            logger.warning("DelayedSender: не отправлено шагов при остановке: %s", self.pending)
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+
+    def _push(self, chat_id: int, delay: float) -> None:
+        due = asyncio.get_running_loop().time() + delay
+        heapq.heappush(self._heap, (due, next(self._seq), chat_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            timeout = self._heap[0][0] - loop.time()
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, chat_id = heapq.heappop(self._heap)
+            task = asyncio.create_task(self._execute(chat_id))
+            self._active.add(task)
+            task.add_done_callback(self._active.discard)
+
+    async def _execute(self, chat_id: int) -> None:
+        # Отложенные отправки уступают очередь ответам на нажатия (задача — своя копия контекста)
+        send_priority.set(BULK)
+        queue = self._chats[chat_id]
+        _, job = queue[0]
+        try:
+            async with self._semaphore:
+                await job()
+        except Exception as e:
+            logger.error("DelayedSender: ошибка отправки в чат %s: %s", chat_id, e)
+        queue.popleft()
+        if queue:
+            self._push(chat_id, queue[0][0])
+        else:
+            del self._chats[chat_id]
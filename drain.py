@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Optional, Sized
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== ПЛАВНАЯ ОСТАНОВКА ====================
+class WebhookDrain:
+    """
+    Остановка приёма вебхуков без потери апдейтов.
+
+    После ``start`` новые запросы получают 503: Telegram оставляет апдейт
+    в своей очереди и повторяет доставку — её примет следующий экземпляр бота.
+    ``wait`` дожидается запросов, которые уже обрабатываются, и апдейтов,
+    отданных в фон (``background`` — задачи обработчика вебхука или пул,
+    ``len`` которого — число необработанных апдейтов).
+    GET (например, /metrics) обслуживается и во время остановки.
+    """
+
+    def __init__(self, background: Optional[Sized] = None) -> None:
+        self.draining = False
+        self.in_flight = 0
+        self.rejected = 0
+        self.background: Sized = background if background is not None else set()
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        if request.method != "POST":
+            return await handler(request)
+        if self.draining:
+            self.rejected += 1
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        self.in_flight += 1
+        try:
+            return await handler(request)
+        finally:
+            self.in_flight -= 1
+
+    def start(self) -> None:
+        """Перестаёт принимать новые апдейты"""
+        self.draining = True
+
+    async def wait(self, timeout: float = 25.0) -> bool:
+        """Ждёт конца обработки принятых апдейтов; False — не дождались за timeout"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.in_flight or self.background:
+            if loop.time() >= deadline:
+                logger.warning(
+                    "Остановка: не дождались %s запросов и %s фоновых апдейтов", self.in_flight, len(self.background)
+                )
+                return False
+            await asyncio.sleep(0.05)
+        return True
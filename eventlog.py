@@ -0,0 +1,282 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+from callbacks import STAGE_BRANCH, STAGE_FINAL, STAGE_FIRST
+from content import DEFAULT_DIR, ContentError, ContentLibrary
+from render import KeyboardRegistry
+
+logger = logging.getLogger(__name__)
+
+# Виды событий (ключ "k"); остальные ключи тоже однобуквенные, чтобы строка была короткой:
+# t — время в мс, c — чат, s — сессия, g — этап (callbacks.STAGE_*), i — номер вопроса,
+# v — ответ, b — ветка, p — программы/пара веток, q — номер вопроса с вариантами
+START = "S"        # согласие дано, диагностика началась
+ANSWER = "A"       # ответ на вопрос с оценкой 1–5 / 1–10
+BRANCH = "B"       # ветка выбрана по баллам
+TIE = "T"          # две ветки близки — задан вопрос-разрешитель
+TIE_CHOICE = "C"   # ответ на вопрос-разрешитель
+OPTION = "O"       # ответ на финальный вопрос с вариантами
+FINISH = "F"       # диагностика завершена: топ программ и итоговые баллы
+SKIP = "K"         # адаптивный режим пропустил вопрос: ответ на него не изменил бы итог
+
+SEGMENT_RE = re.compile(r"^(?P<writer>[\w.-]+)-(?P<seq>\d{6})\.jsonl$")
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+# ==================== ЖУРНАЛ СОБЫТИЙ ====================
+class EventLog:
+    """
+    Журнал событий диагностики: только дозапись, сегменты по ``segment_size`` байт.
+
+    ``emit`` лишь кладёт готовую строку JSON в буфер и сразу возвращается.
+    Буфер сбрасывается одной записью и одним fsync раз в ``flush_interval``
+    секунд (групповой коммит) в отдельном потоке, поэтому хендлеры не ждут диск.
+    Каждый процесс пишет свои сегменты (``writer``), а после перезапуска
+    начинает новый сегмент и никогда не дописывает в возможно оборванный старый.
+    """
+
+    def __init__(
+        self,
+        directory: str = "events",
+        writer: str = "main",
+        segment_size: int = 16 * 1024 * 1024,
+        flush_interval: float = 0.05,
+        fsync: bool = True,
+    ) -> None:
+        self.directory = directory
+        self.writer = writer
+        self.segment_size = segment_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+
+        self._buffer: List[bytes] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="eventlog")
+        # Состояние сегмента трогает только поток записи
+        self._fd: Optional[int] = None
+        self._seq = 0
+        self._written = 0
+
+    @property
+    def pending(self) -> int:
+        """Событий в буфере, ещё не записанных на диск"""
+        return len(self._buffer)
+
+    def emit(self, kind: str, chat_id: int, session: Optional[str], **fields: Any) -> None:
+        """Добавляет событие в журнал (без ожидания записи)"""
+        event = {"k": kind, "t": int(time.time() * 1000), "c": chat_id, "s": session, **fields}
+        self._buffer.append(json.dumps(event, ensure_ascii=False, separators=(",", ":")).encode() + b"\n")
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Записывает накопленные события одной пачкой"""
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write, b"".join(batch))
+        except OSError as e:
+            logger.error("Ошибка записи журнала событий: %s", e)
+            self._buffer[:0] = batch
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_segment)
+        self._executor.shutdown(wait=True)
+
+    # ---------- сегменты (выполняется в потоке) ----------
+    def _write(self, data: bytes) -> None:
+        if self._fd is None:
+            self._open_segment()
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+        if self.fsync:
+            os.fsync(self._fd)
+        self._written += len(data)
+        if self._written >= self.segment_size:
+            self._close_segment()
+
+    def _open_segment(self) -> None:
+        if not self._seq:
+            os.makedirs(self.directory, exist_ok=True)
+            existing = [
+                int(m["seq"]) for m in map(SEGMENT_RE.match, os.listdir(self.directory))
+                if m and m["writer"] == self.writer
+            ]
+            self._seq = max(existing, default=0)
+        self._seq += 1
+        path = os.path.join(self.directory, f"{self.writer}-{self._seq:06d}.jsonl")
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._written = 0
+
+    def _close_segment(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+# ==================== ЧТЕНИЕ ====================
+def segment_paths(directory: str) -> List[str]:
+    """Сегменты журнала: по писателям, внутри писателя — по порядку"""
+    if not os.path.isdir(directory):
+        return []
+    matches = [m for m in map(SEGMENT_RE.match, os.listdir(directory)) if m]
+    matches.sort(key=lambda m: (m["writer"], int(m["seq"])))
+    return [os.path.join(directory, m.string) for m in matches]
+
+
+def read_segment(path: str, offset: int = 0) -> Iterator[tuple]:
+    """
+    События сегмента как (смещение после строки, событие), начиная с offset.
+    Оборванная последняя строка (падение во время записи) пропускается.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            try:
+                yield offset, json.loads(line)
+            except ValueError:
+                logger.warning("Повреждённая строка журнала: %s @ %s", path, offset - len(line))
+
+
+def read_events(directory: str) -> Iterator[Dict[str, Any]]:
+    for path in segment_paths(directory):
+        for _, event in read_segment(path):
+            yield event
+
+
+# ==================== ВОССТАНОВЛЕНИЕ СЕССИИ ====================
+def replay(events: List[Dict[str, Any]], engine) -> Dict[str, Any]:
+    """
+    Восстанавливает данные FSM одной сессии по её событиям, пересчитывая баллы
+    через ScoringEngine. Для завершённой сессии сверяет итог с записанным в FINISH.
+    """
+    events = sorted(events, key=lambda e: e["t"])
+    num_first = len(engine.first_stage_weights)
+    session: Dict[str, Any] = {
+        "session_id": events[0]["s"] if events else None,
+        "chat_id": events[0]["c"] if events else None,
+        "stage": "first",
+        "question_index": 0,
+        "first_stage_answers": [0] * num_first,
+        "scores": [0] * engine.num_programs,
+        "current_branch": None,
+        "tie_branches": None,
+        "branch_questions_asked": 0,
+        "final_answers": {},
+        "started": None,
+        "finished": None,
+        "top_programs": None,
+        "consistent": None,
+    }
+
+    for e in events:
+        kind = e["k"]
+        if kind == START:
+            session["started"] = e["t"]
+        elif kind == ANSWER and e["g"] == STAGE_FIRST:
+            session["first_stage_answers"][e["i"]] = e["v"]
+            session["question_index"] = e["i"] + 1
+        elif kind in (BRANCH, TIE):
+            session["scores"] = engine.first_stage_scores(session["first_stage_answers"])
+            if kind == BRANCH:
+                session.update(stage="branch", current_branch=e["b"], branch_questions_asked=0)
+            else:
+                session.update(stage="branch_tie", tie_branches=list(e["p"]))
+        elif kind == TIE_CHOICE:
+            session.update(stage="branch", current_branch=e["b"], branch_questions_asked=0,
+                           tie_branches=None, question_index=num_first)
+        elif kind == ANSWER and e["g"] == STAGE_BRANCH:
+            engine.add_branch_answer(session["scores"], e["b"], e["i"], e["v"])
+            session["branch_questions_asked"] = e["i"] + 1
+            if e["i"] + 1 >= len(engine.branch_weights[e["b"]]):
+                session.update(stage="final", question_index=0)
+        elif kind == SKIP and e["g"] == STAGE_FIRST:
+            session["question_index"] = e["i"] + 1
+        elif kind == SKIP and e["g"] == STAGE_BRANCH:
+            session["branch_questions_asked"] = e["i"] + 1
+            if e["i"] + 1 >= len(engine.branch_weights[e["b"]]):
+                session.update(stage="final", question_index=0)
+        elif kind == ANSWER and e["g"] == STAGE_FINAL:
+            session["stage"] = "final"
+            session["final_answers"][f"q{e['i']}"] = e["v"]
+            session["question_index"] = e["i"] + 1
+        elif kind == OPTION:
+            session["final_answers"]["frequency" if e["q"] == 1 else "sphere"] = e["v"]
+            session["question_index"] += 1
+        elif kind == FINISH:
+            session["stage"] = "done"
+            session["finished"] = e["t"]
+            session["top_programs"] = e["p"]
+            top = [p for p, _ in engine.top_programs(session["scores"], len(e["p"]))]
+            session["consistent"] = session["scores"] == e["sc"] and top == e["p"]
+    return session
+
+
+def group_sessions(events) -> Dict[str, List[Dict[str, Any]]]:
+    """События по сессиям; нажатия вне сессии (после сброса состояния) отбрасываются"""
+    sessions: Dict[str, List[Dict[str, Any]]] = {}
+    for event in events:
+        if event["s"] is not None:
+            sessions.setdefault(event["s"], []).append(event)
+    return sessions
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Восстановление сессий диагностики из журнала событий")
+    parser.add_argument("target", help="id сессии или chat_id (берётся последняя сессия чата)")
+    parser.add_argument("--dir", default=os.getenv("EVENT_LOG_DIR", "events"), help="каталог журнала")
+    parser.add_argument("--all", action="store_true", help="все сессии чата, а не только последняя")
+    parser.add_argument("--content", default=os.getenv("CONTENT_DIR", DEFAULT_DIR), help="каталог контента бота")
+    args = parser.parse_args(argv)
+
+    # Движок подсчёта — из версии контента, на которой начата сессия; сам бот для этого не нужен
+    library = ContentLibrary(args.content, KeyboardRegistry())
+
+    sessions = group_sessions(read_events(args.dir))
+    if args.target in sessions:
+        selected = [sessions[args.target]]
+    else:
+        chat_id = int(args.target)
+        selected = sorted(
+            (evs for evs in sessions.values() if evs[0]["c"] == chat_id),
+            key=lambda evs: evs[0]["t"],
+        )
+        if not args.all:
+            selected = selected[-1:]
+    if not selected:
+        raise SystemExit(f"Сессия {args.target} не найдена в {args.dir}")
+    for evs in selected:
+        start = next((e for e in evs if e["k"] == START), None)
+        try:
+            bundle = library.get(start.get("v") if start else None)
+        except ContentError as e:
+            raise SystemExit(f"Сессию {evs[0]['s']} не воспроизвести: {e}")
+        print(json.dumps(replay(evs, bundle.scoring), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
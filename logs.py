@@ -0,0 +1,201 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+# Апдейт, который сейчас обрабатывается: поля попадают в каждую запись лога
+update_context: ContextVar[Optional[Dict[str, Any]]] = ContextVar("update_context", default=None)
+
+# Поля LogRecord, которые есть всегда: всё остальное пришло через extra
+_STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+
+# ==================== ФОРМАТ ====================
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, логгер, функция, сообщение и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "func": record.funcName,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# ==================== ОТБОР ====================
+class Sampler(logging.Filter):
+    """
+    Пропускает долю записей ниже WARNING. Правила — по логгеру, по функции
+    или по их паре: ``{"aiogram.event": 0.01, "process_answer": 0.1,
+    "__main__:ask_question": 0.5}``; пара важнее функции, функция — логгера,
+    без правила пишется всё. Предупреждения и ошибки не отбрасываются никогда.
+    """
+
+    def __init__(self, rates: Dict[str, float]) -> None:
+        super().__init__()
+        self.rates = rates
+        self.sampled_out = 0
+        self._random = random.random
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(f"{record.name}:{record.funcName}")
+        if rate is None:
+            rate = self.rates.get(record.funcName)
+        if rate is None:
+            rate = self.rates.get(record.name)
+        if rate is None or self._random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+# ==================== ОЧЕРЕДЬ ====================
+class LoopQueueHandler(QueueHandler):
+    """
+    Обработчик, который из цикла событий только кладёт запись в очередь.
+
+    Стандартный QueueHandler форматирует сообщение ещё в вызывающем потоке;
+    здесь запись уходит как есть, а сообщение из шаблона и аргументов
+    собирает поток-слушатель. Поэтому аргументы лога должны быть
+    неизменяемыми (числа, строки) — так и пишутся логи в хендлерах.
+    Поля текущего апдейта (update_context) дописываются здесь же: в потоке
+    слушателя контекста нет. Очередь — SimpleQueue без блокировок Python;
+    если в ней уже ``capacity`` записей, запись отбрасывается и считается
+    в ``dropped`` — цикл событий логом не блокируется.
+    """
+
+    def __init__(self, capacity: int = 10000) -> None:
+        super().__init__(queue.SimpleQueue())
+        self.capacity = capacity
+        self.dropped = 0
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # Без блокировки обработчика: SimpleQueue.put и так потокобезопасен
+        if not self.filter(record):
+            return False
+        self.enqueue(self.prepare(record))
+        return True
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        context = update_context.get()
+        if context:
+            for key, value in context.items():
+                record.__dict__.setdefault(key, value)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.queue.qsize() >= self.capacity:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+class LogPipeline:
+    """
+    Логи через очередь: ``LoopQueueHandler`` на корневом логгере, вывод
+    (stderr или переданный обработчик) — в потоке QueueListener.
+    """
+
+    def __init__(
+        self,
+        level: int = logging.INFO,
+        fmt: str = "json",
+        sample: Optional[Dict[str, float]] = None,
+        levels: Optional[Dict[str, int]] = None,
+        capacity: int = 10000,
+        output: Optional[logging.Handler] = None,
+    ) -> None:
+        self.output = output or logging.StreamHandler(sys.stderr)
+        self.output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+        self.handler = LoopQueueHandler(capacity)
+        self.sampler = Sampler(sample or {})
+        if self.sampler.rates:
+            self.handler.addFilter(self.sampler)
+        self.listener = QueueListener(self.handler.queue, self.output, respect_handler_level=True)
+        self.level = level
+        self.levels = levels or {}
+
+    def install(self) -> None:
+        """Заменяет обработчики корневого логгера очередью и запускает слушатель (до выхода из процесса)"""
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        for name, level in self.levels.items():
+            logging.getLogger(name).setLevel(level)
+        self.listener.start()
+        # Записи, оставшиеся в очереди, дописываются до выхода
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """Дописывает очередь и останавливает слушатель"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    @property
+    def dropped(self) -> int:
+        return self.handler.dropped
+
+    @property
+    def pending(self) -> int:
+        return self.handler.queue.qsize()
+
+
+def parse_rules(value: str, convert: Callable[[str], Any]) -> Dict[str, Any]:
+    """Разбирает «имя=значение,имя=значение» (LOG_LEVELS, LOG_SAMPLE)"""
+    rules = {}
+    for part in value.split(","):
+        name, sep, raw = part.strip().rpartition("=")
+        if sep:
+            rules[name] = convert(raw)
+    return rules
+
+
+def level_value(name: str) -> int:
+    level = logging.getLevelName(name.upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Неизвестный уровень логов: {name}")
+    return level
+
+
+# ==================== КОНТЕКСТ АПДЕЙТА ====================
+class LogContextMiddleware(BaseMiddleware):
+    """Внешний middleware диспетчера: update_id и chat_id апдейта — в каждую запись лога"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        context: Dict[str, Any] = {}
+        if isinstance(event, Update):
+            context["update_id"] = event.update_id
+        chat = data.get("event_chat")
+        if chat is not None:
+            context["chat_id"] = chat.id
+        token = update_context.set(context)
+        try:
+            return await handler(event, data)
+        finally:
+            update_context.reset(token)
@@ -0,0 +1,298 @@
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+# ==================== МЕТРИКИ ====================
+class Metric:
+    """
+    Метрика в текстовом формате Prometheus. Значения хранятся по кортежу меток;
+    вместо ручного обновления можно передать ``collect`` — функцию, которая
+    вызывается при каждом сборе и возвращает значение или словарь {метки: значение}.
+    """
+
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        collect: Optional[Callable[[], Any]] = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.collect = collect
+        self._values: Dict[Labels, float] = {}
+
+    def _label_str(self, values: Labels, extra: str = "") -> str:
+        pairs = [f'{k}="{v}"' for k, v in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def lines(self) -> Iterable[str]:
+        values = self._values
+        if self.collect is not None:
+            collected = self.collect()
+            values = collected if isinstance(collected, dict) else {(): collected}
+        for labels, value in values.items():
+            if not isinstance(labels, tuple):
+                labels = (labels,)
+            yield f"{self.name}{self._label_str(labels)} {value}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам (+Inf последней), сумма]
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def lines(self) -> Iterable[str]:
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{self._label_str(labels, le)} {cumulative}"
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{self._label_str(labels, le)} {cumulative}"
+            yield f"{self.name}_sum{self._label_str(labels)} {total}"
+            yield f"{self.name}_count{self._label_str(labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = (), collect=None) -> Counter:
+        return self.register(Counter(name, documentation, labels, collect))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = (), collect=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labels, collect))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        out = []
+        for metric in self._metrics:
+            try:
+                lines = list(metric.lines())
+            except Exception as e:
+                # Сломанный сборщик не должен ронять весь /metrics
+                logger.error("Ошибка сбора метрики %s: %s", metric.name, e)
+                continue
+            out.append(f"# HELP {metric.name} {metric.documentation}")
+            out.append(f"# TYPE {metric.name} {metric.kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+def merge_expositions(parts: Dict[str, str], label: str = "worker") -> str:
+    """
+    Склеивает тексты /metrics нескольких процессов в один: к каждому образцу
+    добавляется метка ``label`` с именем процесса, а образцы одной метрики
+    собираются под общими HELP/TYPE, как того требует формат Prometheus.
+    """
+    headers: Dict[str, Dict[str, str]] = {}  # метрика → {"HELP": строка, "TYPE": строка}
+    samples: Dict[str, List[str]] = {}
+    for source, text in parts.items():
+        family = None
+        for line in text.splitlines():
+            if line.startswith(("# HELP ", "# TYPE ")):
+                family = line.split(" ", 3)[2]
+                headers.setdefault(family, {}).setdefault(line[2:6], line)
+                samples.setdefault(family, [])
+            elif line and not line.startswith("#") and family is not None:
+                name, brace, rest = line.partition("{")
+                if brace:
+                    separator = "" if rest.startswith("}") else ","
+                    samples[family].append(f'{name}{{{label}="{source}"{separator}{rest}')
+                else:
+                    name, _, value = line.partition(" ")
+                    samples[family].append(f'{name}{{{label}="{source}"}} {value}')
+    out = []
+    for family, lines in samples.items():
+        out.extend(headers[family].get(kind) for kind in ("HELP", "TYPE") if kind in headers[family])
+        out.extend(lines)
+    return "\n".join(out) + "\n"
+
+
+# ==================== ИСТОЧНИКИ ====================
+def timed(histogram: Histogram, name: Optional[str] = None):
+    """Декоратор корутины: время выполнения пишется в histogram с меткой name"""
+    def decorator(func: Callable[..., Awaitable[Any]]):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, label)
+        return wrapper
+    return decorator
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware диспетчера: время обработки и ошибки по типу апдейта"""
+
+    def __init__(self, seconds: Histogram, errors: Counter) -> None:
+        self.seconds = seconds
+        self.errors = errors
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        kind = getattr(event, "event_type", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors.inc(kind)
+            raise
+        finally:
+            self.seconds.observe(time.perf_counter() - started, kind)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: задержка запросов к Bot API и ошибки по методам"""
+
+    def __init__(self, seconds: Histogram, errors: Counter) -> None:
+        self.seconds = seconds
+        self.errors = errors
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Any,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            self.errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            self.seconds.observe(time.perf_counter() - started, name)
+
+
+class InstrumentedStorage(BaseStorage):
+    """Обёртка FSM-хранилища, которая замеряет get/set состояния и данных"""
+
+    def __init__(self, inner: BaseStorage, seconds: Histogram) -> None:
+        self.inner = inner
+        self.seconds = seconds
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        started = time.perf_counter()
+        await self.inner.set_state(key, state)
+        self.seconds.observe(time.perf_counter() - started, "set_state")
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        started = time.perf_counter()
+        result = await self.inner.get_state(key)
+        self.seconds.observe(time.perf_counter() - started, "get_state")
+        return result
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        await self.inner.set_data(key, data)
+        self.seconds.observe(time.perf_counter() - started, "set_data")
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result = await self.inner.get_data(key)
+        self.seconds.observe(time.perf_counter() - started, "get_data")
+        return result
+
+    async def close(self) -> None:
+        await self.inner.close()
+
+
+class LoopLagMonitor:
+    """Задержка цикла событий: насколько позже заказанного просыпается sleep(interval)"""
+
+    def __init__(self, lag: Histogram, interval: float = 0.5) -> None:
+        self.lag = lag
+        self.interval = interval
+        self.last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - started - self.interval)
+            self.lag.observe(self.last)
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НЕДАВНИЕ АПДЕЙТЫ ====================
+class RecentUpdates:
+    """Последние ``capacity`` обработанных update_id: множество для поиска и очередь для вытеснения"""
+
+    def __init__(self, capacity: int = 10000) -> None:
+        self.capacity = capacity
+        self._ids: Set[int] = set()
+        self._order: Deque[int] = deque()
+
+    def __contains__(self, update_id: int) -> bool:
+        return update_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, update_id: int) -> None:
+        if update_id in self._ids:
+            return
+        self._ids.add(update_id)
+        self._order.append(update_id)
+        if len(self._order) > self.capacity:
+            self._ids.discard(self._order.popleft())
+
+
+# ==================== ПОРЯДОК В ЧАТЕ ====================
+class ChatIsolation(BaseEventIsolation):
+    """
+    Изоляция событий для FSMContextMiddleware: апдейты одного чата
+    обрабатываются строго по очереди.
+
+    Вебхук принимает апдейты параллельно, и без очереди двойное нажатие
+    успевало дважды прочитать и сохранить одну и ту же сессию. Блокировка
+    берётся в FSMContextMiddleware до чтения состояния, поэтому второй
+    апдейт чата видит и сессию, и состояние (фильтры вроде
+    Form.waiting_for_name), уже сохранённые первым; asyncio.Lock отдаёт её
+    в порядке прихода. В отличие от SimpleEventIsolation блокировка
+    удаляется, когда её никто не держит и не ждёт, — память не растёт
+    с числом чатов.
+    """
+
+    def __init__(self) -> None:
+        # chat_id → [блокировка, число апдейтов, которые её держат или ждут]
+        self._locks: Dict[int, List[Any]] = {}
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        entry = self._locks.setdefault(key.chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key.chat_id]
+
+    async def close(self) -> None:
+        self._locks.clear()
+
+    @property
+    def chats_waiting(self) -> int:
+        """Чаты, в которых апдейт ждёт окончания предыдущего"""
+        return sum(1 for _, waiting in self._locks.values() if waiting > 1)
+
+
+# ==================== ПОВТОРНЫЕ ДОСТАВКИ ====================
+class ChatOrderMiddleware(BaseMiddleware):
+    """
+    Внешний middleware диспетчера: повторные доставки одного апдейта
+    обрабатываются один раз.
+
+    Он работает уже внутри очереди чата (ChatIsolation), поэтому update_id
+    запоминается после успешной обработки: апдейт, повторённый Telegram,
+    пока первый ещё обрабатывался, дождётся его и будет отброшен, а апдейт,
+    на котором хендлер упал, при повторе обработается заново. После
+    перезапуска память пуста — от повторов тогда защищает проверка номера
+    вопроса в сессии.
+    """
+
+    def __init__(self, capacity: int = 10000, on_duplicate: Optional[Callable[[], None]] = None) -> None:
+        self.recent = RecentUpdates(capacity)
+        self.on_duplicate = on_duplicate
+        self.duplicates = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        update_id = event.update_id if isinstance(event, Update) else None
+        if update_id is not None and update_id in self.recent:
+            self.duplicates += 1
+            if self.on_duplicate is not None:
+                self.on_duplicate()
+            logger.info("Повторная доставка апдейта %s отброшена", update_id)
+            return None
+        result = await handler(event, data)
+        if update_id is not None:
+            self.recent.add(update_id)
+        return result
@@ -0,0 +1,187 @@
+import asyncio
+import contextlib
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Предел длины сообщения Telegram
+MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = "\n\n———\n\n"
+
+
+# ==================== ОЧЕРЕДЬ ЗАЯВОК ====================
+class LeadOutbox:
+    """
+    Надёжная очередь заявок для администратора в SQLite.
+
+    Хендлер только записывает заявку (``add`` — одна короткая транзакция в потоке)
+    и не ждёт отправки. Доставляет фоновая задача (``start``): первая заявка уходит
+    сразу, а всё, что накопилось за ``digest_interval`` секунд после предыдущей
+    отправки, уходит одной сводкой. Неудачная отправка повторяется с экспоненциальной
+    паузой до ``max_backoff``, заявка из базы не пропадает. Писать в одну базу
+    могут несколько процессов, доставлять должен один — он же подхватывает
+    чужие записи, опрашивая базу раз в ``poll_interval`` секунд.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        send: Callable[[str], Awaitable[Any]],
+        digest_interval: float = 5.0,
+        poll_interval: float = 1.0,
+        base_backoff: float = 2.0,
+        max_backoff: float = 300.0,
+    ) -> None:
+        self.path = path
+        self.send = send
+        self.digest_interval = digest_interval
+        self.poll_interval = poll_interval
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.delivered = 0
+        self.failed = 0
+        self._last_send = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Заявок мало, а потеря каждой — потерянный клиент: коммит ждёт диска
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leads ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, text TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, delivered REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS leads_pending ON leads (next_attempt) WHERE delivered IS NULL"
+        )
+
+    # ---------- доступ к базе (выполняется в потоке) ----------
+    def _insert(self, text: str) -> int:
+        now = time.time()
+        cursor = self._conn.execute(
+            "INSERT INTO leads (created, text, next_attempt) VALUES (?, ?, ?)", (now, text, now)
+        )
+        return cursor.lastrowid
+
+    def _due(self, now: float) -> List[Tuple[int, str, int]]:
+        return self._conn.execute(
+            "SELECT id, text, attempts FROM leads WHERE delivered IS NULL AND next_attempt <= ? ORDER BY id",
+            (now,),
+        ).fetchall()
+
+    def _mark_delivered(self, ids: List[int]) -> None:
+        now = time.time()
+        self._conn.executemany("UPDATE leads SET delivered = ? WHERE id = ?", [(now, i) for i in ids])
+
+    def _mark_failed(self, rows: List[Tuple[int, str, int]]) -> None:
+        now = time.time()
+        self._conn.executemany(
+            "UPDATE leads SET attempts = ?, next_attempt = ? WHERE id = ?",
+            [(attempts + 1, now + self._backoff(attempts + 1), i) for i, _, attempts in rows],
+        )
+
+    def _count_pending(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM leads WHERE delivered IS NULL").fetchone()[0]
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _backoff(self, attempts: int) -> float:
+        return min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+
+    # ---------- интерфейс ----------
+    async def add(self, text: str) -> int:
+        """Сохраняет заявку; после возврата она переживёт падение процесса"""
+        lead_id = await self._run(self._insert, text)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return lead_id
+
+    async def pending(self) -> int:
+        return await self._run(self._count_pending)
+
+    def start(self) -> None:
+        """Запускает доставку в этом процессе"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._deliver_loop())
+
+    async def close(self, timeout: float = 10.0) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+            # Последняя попытка отправить то, что уже пора; что не ушло — уйдёт после рестарта
+            try:
+                await asyncio.wait_for(self.deliver_due(), timeout)
+            except Exception as e:
+                logger.warning("Outbox: заявки остались в очереди до следующего запуска: %s", e)
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+    # ---------- доставка ----------
+    async def deliver_due(self) -> int:
+        """Отправляет все заявки, которым пора; несколько сразу — одной сводкой"""
+        rows = await self._run(self._due, time.time())
+        if not rows:
+            return 0
+        sent: List[int] = []
+        try:
+            for batch, text in _digests(rows):
+                await self.send(text)
+                sent.extend(i for i, _, _ in batch)
+        except Exception as e:
+            done = set(sent)
+            rest = [row for row in rows if row[0] not in done]
+            self.failed += len(rest)
+            logger.error("Outbox: не удалось отправить %s заявок: %s", len(rest), e)
+            await self._run(self._mark_failed, rest)
+        if sent:
+            await self._run(self._mark_delivered, sent)
+            self.delivered += len(sent)
+        self._last_send = time.monotonic()
+        return len(sent)
+
+    async def _deliver_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # Заявки, пришедшие вскоре после отправки, копятся в сводку
+            pause = self._last_send + self.digest_interval - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            try:
+                await self.deliver_due()
+            except Exception as e:
+                logger.error("Outbox: ошибка доставки: %s", e)
+
+
+def _digests(rows: List[Tuple[int, str, int]]):
+    """Делит заявки на сообщения не длиннее лимита Telegram: [(строки, текст)]"""
+    if len(rows) == 1:
+        yield rows, rows[0][1]
+        return
+    header = f"СВОДКА ЗАЯВОК ({len(rows)})"
+    limit = MESSAGE_LIMIT - len(header)
+    batch, parts, size = [], [], 0
+    for row in rows:
+        text = row[1][:limit - len(DIGEST_SEPARATOR)]
+        if batch and size + len(DIGEST_SEPARATOR) + len(text) > limit:
+            yield batch, DIGEST_SEPARATOR.join([header] + parts)
+            batch, parts, size = [], [], 0
+        batch.append(row)
+        parts.append(text)
+        size += len(DIGEST_SEPARATOR) + len(text)
+    yield batch, DIGEST_SEPARATOR.join([header] + parts)
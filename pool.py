@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+from cluster import update_chat_id
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== ПУЛ ОБРАБОТЧИКОВ ====================
+class UpdatePool:
+    """
+    Ограниченная очередь апдейтов и ``workers`` задач, которые её разбирают.
+
+    У каждого чата своя очередь, а воркеры берут чаты из общей очереди готовых:
+    чат в работе у одного воркера, так что его апдейты обрабатываются по порядку,
+    а медленный апдейт держит только свой чат — остальные разбирают свободные
+    воркеры. После одного апдейта чат встаёт в конец очереди готовых, если у него
+    есть ещё. Всего в очереди не больше ``depth`` апдейтов; сверх этого ``submit``
+    возвращает False — это и есть обратное давление. ``len(pool)`` — апдейты
+    в очереди и в обработке (его ждёт WebhookDrain).
+    """
+
+    def __init__(self, workers: int = 8, depth: int = 1000) -> None:
+        self.workers = workers
+        self.depth = depth
+        # Чат → его необработанные апдейты; ключ есть, пока чат в очереди готовых или в работе
+        self._chats: Dict[Hashable, Deque[Dict[str, Any]]] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self.queued = 0
+        self.busy = 0
+        self.processed = 0
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return self.queued + self.busy
+
+    def start(self, handle: Callable[[Dict[str, Any]], Awaitable[Any]]) -> None:
+        """Запускает воркеры; handle(update) обрабатывает один апдейт"""
+        self._tasks = [asyncio.create_task(self._work(handle)) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, update: Dict[str, Any]) -> bool:
+        """Ставит апдейт в очередь его чата; False — очередь полна"""
+        if self.queued >= self.depth:
+            self.rejected += 1
+            return False
+        chat_id = update_chat_id(update)
+        # Апдейт без чата ни с чем не упорядочивается — своя очередь
+        key: Hashable = chat_id if chat_id is not None else ("update", update.get("update_id"))
+        updates = self._chats.get(key)
+        if updates is None:
+            self._chats[key] = deque((update,))
+            self._ready.put_nowait(key)
+        else:
+            updates.append(update)
+        self.queued += 1
+        return True
+
+    async def _work(self, handle: Callable[[Dict[str, Any]], Awaitable[Any]]) -> None:
+        while True:
+            key = await self._ready.get()
+            updates = self._chats[key]
+            update = updates.popleft()
+            self.queued -= 1
+            self.busy += 1
+            try:
+                await handle(update)
+            except Exception as e:
+                # Подробности уже в логе диспетчера; воркер продолжает работу
+                logger.error("Ошибка обработки апдейта %s: %s", update.get('update_id'), e)
+            finally:
+                self.busy -= 1
+                self.processed += 1
+                if updates:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+
+
+# ==================== БЫСТРЫЙ ОТВЕТ НА ВЕБХУК ====================
+class PooledRequestHandler(SimpleRequestHandler):
+    """
+    Вебхук, который отвечает 200 сразу после постановки апдейта в UpdatePool.
+
+    Telegram не ждёт медленных хендлеров (и не сбавляет из-за них доставку),
+    а если очередь полна — получает 503 с Retry-After и повторит апдейт позже.
+    Запрос, который вернул хендлер, отправляется отдельным вызовом Bot API.
+    """
+
+    def __init__(
+        self, dispatcher: Dispatcher, bot: Bot, pool: UpdatePool, secret_token: Optional[str] = None, **data: Any
+    ) -> None:
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.pool = pool
+
+    async def feed(self, update: Dict[str, Any]) -> None:
+        """Обработка апдейта воркером пула"""
+        await self._background_feed_update(self.bot, update)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        if not self.pool.submit(update):
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return web.json_response({}, dumps=bot.session.json_dumps)
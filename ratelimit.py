@@ -0,0 +1,231 @@
+import asyncio
+import itertools
+import logging
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих запросов: меньше — важнее
+INTERACTIVE = 0
+BULK = 1
+
+# Приоритет запросов текущей задачи; фоновые отправки выставляют BULK
+send_priority: ContextVar[int] = ContextVar("send_priority", default=INTERACTIVE)
+
+
+# ==================== ВЕДРО ТОКЕНОВ ====================
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до появления целого токена"""
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        # После block() ведро не пополняется до момента updated
+        return max(0.0, self.updated - now) + (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        """Опустошает ведро до момента until (после 429 от Telegram)"""
+        self.tokens = min(self.tokens, 0.0)
+        self.updated = max(self.updated, until)
+
+
+# ==================== ОГРАНИЧИТЕЛЬ ИСХОДЯЩИХ ЗАПРОСОВ ====================
+class OutboundLimiter(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: все запросы к Bot API с chat_id проходят через
+    общее ведро токенов (лимит бота) и ведро чата (лимит на один чат).
+
+    Когда токенов нет, запросы ждут в очереди; первыми выходят INTERACTIVE,
+    затем BULK. На TelegramRetryAfter отправка приостанавливается на retry_after
+    секунд, и запрос повторяется до max_retries раз.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        group_rate: float = 20 / 60,
+        max_retries: int = 3,
+        max_buckets: int = 10000,
+    ) -> None:
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_buckets = max_buckets
+
+        self._global: Optional[TokenBucket] = None
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._waiters: List[Tuple[int, int, Any, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Глубина очередей по приоритетам и счётчики отправок"""
+        depth = [0, 0]
+        for priority, *_ in self._waiters:
+            depth[priority] += 1
+        return {
+            "queued_interactive": depth[INTERACTIVE],
+            "queued_bulk": depth[BULK],
+            "sent": self.sent,
+            "retry_after": self.retries,
+            "failed": self.failed,
+        }
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Any,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # answerCallbackQuery, setWebhook и прочие запросы без чата не лимитируются
+            return await make_request(bot, method)
+
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, send_priority.get())
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retries += 1
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    raise
+                logger.warning("Telegram просит подождать %s с (%s, чат %s)", e.retry_after, type(method).__name__, chat_id)
+                self._pause(chat_id, e.retry_after)
+                continue
+            self.sent += 1
+            return response
+
+    # ---------- выдача токенов ----------
+    def _bucket(self, chat_id: Any, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_buckets:
+                self._prune(now)
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst, now)
+        return bucket
+
+    def _prune(self, now: float) -> None:
+        """Выбрасывает полные вёдра — они ничем не отличаются от новых"""
+        for chat_id, bucket in list(self._chats.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._chats[chat_id]
+
+    def _pause(self, chat_id: Any, retry_after: float) -> None:
+        loop = asyncio.get_running_loop()
+        until = loop.time() + retry_after
+        self._global_bucket(loop.time()).block(until)
+        self._bucket(chat_id, loop.time()).block(until)
+
+    def _global_bucket(self, now: float) -> TokenBucket:
+        if self._global is None:
+            self._global = TokenBucket(self.global_rate, self.global_rate, now)
+        return self._global
+
+    def try_acquire(self, chat_id: Any) -> bool:
+        """
+        Берёт токены, только если ждать не нужно: очереди нет и оба ведра не пусты.
+        Для запросов в обход сессии бота (ответ на вебхук) — их лимит учитывается здесь
+        """
+        now = asyncio.get_running_loop().time()
+        global_bucket = self._global_bucket(now)
+        bucket = self._bucket(chat_id, now)
+        if self._waiters or global_bucket.delay(now) > 0 or bucket.delay(now) > 0:
+            return False
+        global_bucket.take()
+        bucket.take()
+        return True
+
+    async def _acquire(self, chat_id: Any, priority: int) -> None:
+        # Быстрый путь без очереди
+        if self.try_acquire(chat_id):
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiters.append((priority, next(self._seq), chat_id, future))
+        if self._pump is None or self._pump.done():
+            self._wakeup = asyncio.Event()
+            self._pump = asyncio.create_task(self._run())
+        else:
+            self._wakeup.set()
+        await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._waiters:
+            self._wakeup.clear()
+            now = loop.time()
+            wait = self._global.delay(now)
+            if wait == 0:
+                wait = self._grant_one(now)
+                if wait == 0 or not self._waiters:
+                    continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _grant_one(self, now: float) -> float:
+        """Выдаёт токен самому приоритетному ожидающему, чей чат не упёрся в лимит"""
+        best = None
+        soonest = float("inf")
+        alive = []
+        for entry in self._waiters:
+            if entry[3].done():  # ожидание отменено
+                continue
+            alive.append(entry)
+            bucket = self._bucket(entry[2], now)
+            delay = bucket.delay(now)
+            if delay == 0:
+                if best is None or entry[:2] < best[0][:2]:
+                    best = (entry, bucket)
+            else:
+                soonest = min(soonest, delay)
+        self._waiters = alive
+        if best is None:
+            return soonest
+        entry, bucket = best
+        self._waiters.remove(entry)
+        self._global.take()
+        bucket.take()
+        # Ведро выбранного чата могло выпасть при _prune, пока создавались вёдра других чатов:
+        # возвращаем его, чтобы взятый токен учитывался
+        self._chats[entry[2]] = bucket
+        entry[3].set_result(None)
+        return 0.0
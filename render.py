@@ -0,0 +1,118 @@
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from callbacks import STAGE_BRANCH, STAGE_FINAL, STAGE_FIRST, pack
+
+# (stage, branch, index) -> (текст, клавиатура)
+RenderKey = Tuple[str, Optional[str], int]
+Rendered = Tuple[str, InlineKeyboardMarkup]
+
+
+# ==================== ЗАРАНЕЕ СОБРАННЫЕ КЛАВИАТУРЫ ====================
+class KeyboardRegistry:
+    """
+    Неизменяемые клавиатуры, собранные один раз, вместе с их готовым JSON.
+
+    Модели aiogram заморожены, поэтому JSON можно посчитать заранее и
+    подставлять в запрос к Bot API по id объекта (см. PreparedMarkupSession).
+    """
+
+    def __init__(self) -> None:
+        self._json: Dict[int, str] = {}
+        self._keep: Dict[int, InlineKeyboardMarkup] = {}
+
+    def markup(self, rows: Sequence[Sequence[Tuple[str, str]]]) -> InlineKeyboardMarkup:
+        """Строит клавиатуру из строк пар (текст, callback_data) и запоминает её JSON"""
+        markup = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=text, callback_data=data) for text, data in row] for row in rows
+        ])
+        self._json[id(markup)] = markup.model_dump_json(exclude_none=True)
+        # Держим ссылку, чтобы id не переиспользовался
+        self._keep[id(markup)] = markup
+        return markup
+
+    def discard(self, markup: InlineKeyboardMarkup) -> None:
+        """Забывает клавиатуру, которая больше не нужна (устаревший календарь записи)"""
+        self._json.pop(id(markup), None)
+        self._keep.pop(id(markup), None)
+
+    def adopt(self, other: "KeyboardRegistry") -> None:
+        """Переносит к себе клавиатуры другого реестра (новая версия контента прошла проверку)"""
+        self._json.update(other._json)
+        self._keep.update(other._keep)
+
+    def prepared(self, value: Any) -> Optional[str]:
+        return self._json.get(id(value))
+
+
+class PreparedMarkupSession(AiohttpSession):
+    """Сессия, которая берёт JSON заранее собранных клавиатур из реестра вместо сериализации"""
+
+    def __init__(self, registry: KeyboardRegistry, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.registry = registry
+
+    def prepare_value(self, value: Any, bot: Bot, files: Dict[str, Any], _dumps_json: bool = True) -> Any:
+        if _dumps_json and isinstance(value, InlineKeyboardMarkup):
+            prepared = self.registry.prepared(value)
+            if prepared is not None:
+                return prepared
+        return super().prepare_value(value, bot=bot, files=files, _dumps_json=_dumps_json)
+
+
+# ==================== КЭШ ВОПРОСОВ ====================
+def question_number(stage: str, index: int) -> int:
+    """Сквозной номер вопроса: 1–10 общие, 11–16 ветка, 17+ финальные"""
+    if stage == "first":
+        return index + 1
+    elif stage == "branch":
+        return 10 + index + 1
+    else:
+        return 16 + index + 1
+
+
+def question_text(stage: str, index: int, text: str, skipped: int = 0) -> str:
+    """Текст вопроса с номером; пропущенные вопросы в нумерацию не входят"""
+    return f"Вопрос {question_number(stage, index) - skipped}:\n\n{text}"
+
+
+def build_question_renders(
+    registry: KeyboardRegistry,
+    first_questions: Sequence[str],
+    branch_questions: Dict[str, Sequence[str]],
+    final_questions: Sequence[str],
+    frequency_options: Sequence[str],
+    sphere_options: Sequence[str],
+    tie_questions: Dict[str, str],
+) -> Dict[RenderKey, Rendered]:
+    """Готовит текст и клавиатуру каждого вопроса опроса"""
+    renders: Dict[RenderKey, Rendered] = {}
+
+    def scale(stage_code: int, index: int) -> InlineKeyboardMarkup:
+        return registry.markup([[(str(i), pack("q", stage_code, i, index))] for i in range(1, 6)])
+
+    for i, q_text in enumerate(first_questions):
+        renders[("first", None, i)] = (question_text("first", i, q_text), scale(STAGE_FIRST, i))
+
+    for branch, questions in branch_questions.items():
+        for j, q_text in enumerate(questions):
+            renders[("branch", branch, j)] = (question_text("branch", j, q_text), scale(STAGE_BRANCH, j))
+
+    final_keyboards = [
+        registry.markup([
+            [(str(i), pack("q", STAGE_FINAL, i, 0)) for i in row] for row in (range(1, 6), range(6, 11))
+        ]),
+        registry.markup([[(opt, pack("opt", 1, i))] for i, opt in enumerate(frequency_options)]),
+        registry.markup([[(opt, pack("opt", 2, i))] for i, opt in enumerate(sphere_options)]),
+    ]
+    for k, q_text in enumerate(final_questions):
+        renders[("final", None, k)] = (question_text("final", k, q_text), final_keyboards[k])
+
+    tie_keyboard = registry.markup([[("Вариант 1", pack("tie", 1)), ("Вариант 2", pack("tie", 2))]])
+    for pair, q_text in tie_questions.items():
+        renders[("branch_tie", pair, 0)] = (f"Чтобы точнее понять:\n\n{q_text}", tie_keyboard)
+
+    return renders
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== РЕЗУЛЬТАТ ====================
+class Result:
+    """
+    Итог диагностики одного пользователя.
+
+    ``rendered`` — готовые сообщения с результатом; в базу не пишется,
+    заполняется при первом показе и живёт, пока результат в LRU.
+    """
+
+    __slots__ = ("user_id", "version", "started", "finished", "scores", "top", "final", "rendered")
+
+    def __init__(
+        self,
+        user_id: int,
+        version: str,
+        started: float,
+        finished: float,
+        scores: Sequence[int],
+        top: Sequence[int],
+        final: Dict[str, Optional[int]],
+    ) -> None:
+        self.user_id = user_id
+        self.version = version
+        self.started = started
+        self.finished = finished
+        self.scores = list(scores)
+        self.top = list(top)
+        self.final = final
+        self.rendered: Optional[List[str]] = None
+
+    def row(self) -> tuple:
+        return (
+            self.user_id, self.version, self.started, self.finished,
+            json.dumps(self.scores), json.dumps(self.top), json.dumps(self.final),
+        )
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "Result":
+        user_id, version, started, finished, scores, top, final = row
+        return cls(user_id, version, started, finished, json.loads(scores), json.loads(top), json.loads(final))
+
+
+# ==================== ХРАНИЛИЩЕ ====================
+class ResultsStore:
+    """
+    Последний результат каждого пользователя: SQLite и LRU-кэш в памяти перед ней.
+
+    ``put`` кладёт результат в кэш и помечает его к записи; все результаты,
+    накопленные за ``flush_interval`` секунд, пишутся одной транзакцией
+    в отдельном потоке. ``get`` отвечает из кэша, а промах читает одну строку
+    по первичному ключу. Ключ — id пользователя (в личном чате равен chat_id).
+    """
+
+    def __init__(self, path: str = "results.sqlite3", capacity: int = 10000, flush_interval: float = 0.2) -> None:
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[int, Result]" = OrderedDict()
+        # Ещё не записанные результаты; из кэша их может вытеснить, отсюда — нет
+        self._pending: Dict[int, Result] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="results")
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (user_id INTEGER PRIMARY KEY, version TEXT NOT NULL, "
+            "started REAL, finished REAL NOT NULL, scores TEXT NOT NULL, top TEXT NOT NULL, final TEXT NOT NULL)"
+        )
+
+    # ---------- доступ к базе (выполняется в потоке) ----------
+    def _load(self, user_id: int) -> Optional[tuple]:
+        return self._conn.execute(
+            "SELECT user_id, version, started, finished, scores, top, final FROM results WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+
+    def _write_batch(self, batch: List[Result]) -> None:
+        # Сериализация тоже здесь, а не в цикле событий
+        rows = [r.row() for r in batch]
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results (user_id, version, started, finished, scores, top, final) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # ---------- кэш ----------
+    def _remember(self, result: Result) -> None:
+        self._cache[result.user_id] = result
+        self._cache.move_to_end(result.user_id)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    # ---------- интерфейс ----------
+    def put(self, result: Result) -> None:
+        """Сохраняет результат; запись на диск — пачкой в фоне"""
+        self._remember(result)
+        self._pending[result.user_id] = result
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def get(self, user_id: int) -> Optional[Result]:
+        result = self._cache.get(user_id) or self._pending.get(user_id)
+        if result is not None:
+            self.hits += 1
+            self._remember(result)
+            return result
+        self.misses += 1
+        row = await self._run(self._load, user_id)
+        if row is None:
+            return None
+        # Пока шло чтение, мог прийти свежий результат — он важнее
+        result = self._cache.get(user_id) or self._pending.get(user_id) or Result.from_row(row)
+        self._remember(result)
+        return result
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        batch = list(self._pending.values())
+        try:
+            await self._run(self._write_batch, batch)
+        except Exception as e:
+            logger.error("Ошибка записи результатов: %s", e)
+            # Результаты остаются в очереди; следующая попытка — через интервал
+            asyncio.get_running_loop().call_later(self.flush_interval, self._schedule_flush)
+            return
+        # Убираем только то, что не успели заменить новым результатом за время записи
+        for result in batch:
+            if self._pending.get(result.user_id) is result:
+                del self._pending[result.user_id]
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,137 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    # NumPy нужен только для пакетного подсчёта; бот работает и без него
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+BRANCHES = ("A", "B", "C", "D")
+
+
+# ==================== ДВИЖОК ПОДСЧЁТА ====================
+class ScoringEngine:
+    """
+    Подсчёт баллов по заранее построенной матрице «вопрос → программа».
+
+    first_stage_weights[q][p] — сколько раз ответ на общий вопрос q прибавляется
+    к программе p; branch_weights[ветка][q][p] — то же для вопросов ветки.
+    Одна сессия считается инкрементально (add_branch_answer), большие массивы
+    ответов — пакетно через score_batch.
+    """
+
+    def __init__(
+        self,
+        num_programs: int,
+        branch_programs: Dict[str, Sequence[int]],
+        first_stage_branches: Sequence[str],
+        branch_question_counts: Dict[str, int],
+        tie_threshold: int = 5,
+    ) -> None:
+        self.num_programs = num_programs
+        self.branch_programs = {b: list(branch_programs[b]) for b in BRANCHES}
+        self.tie_threshold = tie_threshold
+
+        # Общий вопрос q добавляет балл ко всем программам своей ветки
+        self.first_stage_weights = [
+            [1 if p in self.branch_programs[branch] else 0 for p in range(num_programs)]
+            for branch in first_stage_branches
+        ]
+        # Вопрос ветки j относится к j-й программе ветки; лишние вопросы баллов не дают
+        self.branch_weights = {
+            b: [
+                [1 if j < len(self.branch_programs[b]) and p == self.branch_programs[b][j] else 0
+                 for p in range(num_programs)]
+                for j in range(branch_question_counts[b])
+            ]
+            for b in BRANCHES
+        }
+        # Принадлежность программ веткам: programs x branches
+        self.membership = [[1 if p in self.branch_programs[b] else 0 for b in BRANCHES] for p in range(num_programs)]
+
+        # Разреженные строки матриц для горячего пути одной сессии
+        self._first_rows = [[p for p, w in enumerate(row) if w] for row in self.first_stage_weights]
+        self._branch_rows = {
+            b: [[p for p, w in enumerate(row) if w] for row in rows]
+            for b, rows in self.branch_weights.items()
+        }
+
+    # ---------- одна сессия ----------
+    def first_stage_scores(self, answers: Sequence[int]) -> List[int]:
+        """Баллы программ после общего этапа"""
+        scores = [0] * self.num_programs
+        for row, value in zip(self._first_rows, answers):
+            for p in row:
+                scores[p] += value
+        return scores
+
+    def add_branch_answer(self, scores: List[int], branch: str, question: int, value: int) -> None:
+        """Добавляет ответ на вопрос ветки к баллам (на месте)"""
+        for p in self._branch_rows[branch][question]:
+            scores[p] += value
+
+    def branch_scores(self, scores: Sequence[int]) -> Dict[str, int]:
+        return {b: sum(scores[p] for p in self.branch_programs[b]) for b in BRANCHES}
+
+    def top_branches(self, branch_scores: Dict[str, int]) -> List[str]:
+        """Лидирующая ветка или две, если разрыв не больше порога"""
+        ranked = sorted(branch_scores.items(), key=lambda x: x[1], reverse=True)
+        if len(ranked) > 1 and ranked[0][1] - ranked[1][1] <= self.tie_threshold:
+            return [ranked[0][0], ranked[1][0]]
+        return [ranked[0][0]]
+
+    def top_programs(self, scores: Sequence[int], n: int = 3) -> List[Tuple[int, int]]:
+        """Топ-n программ как (индекс, баллы); при равенстве раньше идёт меньший индекс"""
+        ranked = sorted(enumerate(scores), key=lambda x: x[1], reverse=True)
+        return ranked[:n]
+
+    # ---------- пакетный подсчёт ----------
+    def score_batch(self, first_answers, branches, branch_answers):
+        """
+        Считает баллы для N сессий сразу.
+
+        first_answers — N x (общие вопросы), branches — N кодов веток (индекс в BRANCHES),
+        branch_answers — N x (вопросы ветки), неотвеченные вопросы равны 0.
+        Возвращает матрицу N x программы (numpy.ndarray, если NumPy установлен).
+        """
+        if np is None:
+            return self._score_batch_python(first_answers, branches, branch_answers)
+
+        first_answers = np.asarray(first_answers, dtype=np.int32)
+        branches = np.asarray(branches)
+        branch_answers = np.asarray(branch_answers, dtype=np.int32)
+
+        scores = first_answers @ np.asarray(self.first_stage_weights, dtype=np.int32)
+        for code, b in enumerate(BRANCHES):
+            mask = branches == code
+            if mask.any():
+                weights = np.asarray(self.branch_weights[b], dtype=np.int32)
+                scores[mask] += branch_answers[mask][:, : weights.shape[0]] @ weights
+        return scores
+
+    def top_programs_batch(self, scores, n: int = 3):
+        """Индексы топ-n программ для каждой строки scores (тот же порядок, что у top_programs)"""
+        if np is None:
+            return [[p for p, _ in self.top_programs(row, n)] for row in scores]
+        return np.argsort(-np.asarray(scores), axis=1, kind="stable")[:, :n]
+
+    def branch_scores_batch(self, scores):
+        """Баллы веток для каждой строки scores: N x 4"""
+        if np is None:
+            return [[sum(row[p] for p in self.branch_programs[b]) for b in BRANCHES] for row in scores]
+        return np.asarray(scores) @ np.asarray(self.membership, dtype=np.int32)
+
+    def _score_batch_python(self, first_answers, branches, branch_answers) -> List[List[int]]:
+        result = []
+        for answers, code, extra in zip(first_answers, branches, branch_answers):
+            scores = self.first_stage_scores(answers)
+            branch = BRANCHES[code]
+            for question, value in enumerate(extra[: len(self._branch_rows[branch])]):
+                self.add_branch_answer(scores, branch, question, value)
+            result.append(scores)
+        return result
+
+
+def branch_code(branch: Optional[str]) -> int:
+    """Код ветки для пакетного подсчёта"""
+    return BRANCHES.index(branch) if branch in BRANCHES else 0
@@ -0,0 +1,192 @@
+import base64
+import struct
+import time
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from aiogram.fsm.context import FSMContext
+
+from scoring import BRANCHES
+
+# Ключ упакованной сессии в данных FSM
+SESSION_KEY = "session"
+
+VERSION = 3
+STAGES = ("first", "branch_tie", "branch", "final")
+NONE = 0xFF  # «нет значения» для однобайтовых полей
+
+# Заголовок фиксированной длины, за ним ответы общего этапа и баллы программ
+_HEADER = struct.Struct("<BBBBBBBBBB6sIHB")
+# version, stage, question_index, branch_questions_asked, current_branch, tie_branches,
+# final: intensity, frequency, sphere, число общих вопросов, session_id, started (unix),
+# версия контента, на которой начата диагностика, сколько вопросов пропущено адаптивным опросом
+(_VERSION, _STAGE, _INDEX, _BRANCH_ASKED, _BRANCH, _TIE,
+ _INTENSITY, _FREQUENCY, _SPHERE, _FIRST_COUNT) = range(10)
+_SESSION_ID = slice(10, 16)
+_STARTED = slice(16, 20)
+_CONTENT = slice(20, 22)
+_SKIPPED = 22
+HEADER_SIZE = _HEADER.size
+# Сессии версии 1 (до версий контента) начаты на контенте v1
+_V1_HEADER_SIZE = 20
+# В сессиях версии 2 (до счётчика пропусков) пропусков не было
+_V2_HEADER_SIZE = 22
+
+
+def _byte_field(offset: int, doc: str) -> property:
+    def get(self) -> Optional[int]:
+        value = self.buf[offset]
+        return None if value == NONE else value
+
+    def set(self, value: Optional[int]) -> None:
+        self.buf[offset] = NONE if value is None else value
+
+    return property(get, set, doc=doc)
+
+
+# ==================== УПАКОВАННАЯ СЕССИЯ ====================
+class Session:
+    """
+    Состояние одной диагностики в одном bytearray фиксированной разметки.
+
+    Все значения — маленькие целые (ответы 1–10, баллы программ до ~20,
+    индексы вопросов), поэтому каждое занимает байт. Ответы общего этапа
+    и баллы доступны как memoryview, так что ScoringEngine меняет их на месте.
+    В FSM сессия хранится одной base64-строкой (``dumps``) и подходит
+    для любого хранилища: памяти, SQLite, Redis.
+    """
+
+    __slots__ = ("buf",)
+
+    question_index = _byte_field(_INDEX, "Номер текущего вопроса этапа")
+    branch_questions_asked = _byte_field(_BRANCH_ASKED, "Сколько вопросов ветки уже задано")
+    intensity = _byte_field(_INTENSITY, "Ответ на финальный вопрос 1–10")
+    frequency = _byte_field(_FREQUENCY, "Индекс варианта частоты")
+    sphere = _byte_field(_SPHERE, "Индекс варианта сферы")
+
+    def __init__(self, buf: bytearray) -> None:
+        if buf[_VERSION] != VERSION:
+            raise ValueError(f"Неизвестная версия сессии: {buf[_VERSION]}")
+        if len(buf) < HEADER_SIZE + buf[_FIRST_COUNT]:
+            raise ValueError("Обрезанная запись сессии")
+        self.buf = buf
+
+    @classmethod
+    def new(cls, num_programs: int, first_questions: int, session_id: str,
+            started: Optional[float] = None, content_version: int = 1) -> "Session":
+        header = _HEADER.pack(
+            VERSION, 0, 0, 0, NONE, NONE, NONE, NONE, NONE, first_questions,
+            bytes.fromhex(session_id), int(started if started is not None else time.time()), content_version, 0,
+        )
+        return cls(bytearray(header) + bytes(first_questions + num_programs))
+
+    # ---------- сериализация ----------
+    def dumps(self) -> str:
+        return base64.b64encode(self.buf).decode("ascii")
+
+    @classmethod
+    def loads(cls, raw: str) -> "Session":
+        buf = bytearray(base64.b64decode(raw))
+        if buf[_VERSION] == 1:
+            buf[_V1_HEADER_SIZE:_V1_HEADER_SIZE] = (1).to_bytes(2, "little")
+            buf[_VERSION] = 2
+        if buf[_VERSION] == 2:
+            buf[_V2_HEADER_SIZE:_V2_HEADER_SIZE] = bytes(1)
+            buf[_VERSION] = VERSION
+        return cls(buf)
+
+    # ---------- поля ----------
+    @property
+    def stage(self) -> str:
+        return STAGES[self.buf[_STAGE]]
+
+    @stage.setter
+    def stage(self, value: str) -> None:
+        self.buf[_STAGE] = STAGES.index(value)
+
+    @property
+    def current_branch(self) -> Optional[str]:
+        code = self.buf[_BRANCH]
+        return None if code == NONE else BRANCHES[code]
+
+    @current_branch.setter
+    def current_branch(self, value: Optional[str]) -> None:
+        self.buf[_BRANCH] = NONE if value is None else BRANCHES.index(value)
+
+    @property
+    def tie_branches(self) -> Optional[Tuple[str, str]]:
+        code = self.buf[_TIE]
+        return None if code == NONE else (BRANCHES[code >> 4], BRANCHES[code & 0x0F])
+
+    @tie_branches.setter
+    def tie_branches(self, value: Optional[Sequence[str]]) -> None:
+        self.buf[_TIE] = NONE if value is None else BRANCHES.index(value[0]) << 4 | BRANCHES.index(value[1])
+
+    @property
+    def session_id(self) -> str:
+        return bytes(self.buf[_SESSION_ID]).hex()
+
+    @property
+    def started(self) -> int:
+        return int.from_bytes(self.buf[_STARTED], "little")
+
+    @property
+    def content_version(self) -> int:
+        return int.from_bytes(self.buf[_CONTENT], "little")
+
+    @property
+    def skipped(self) -> int:
+        """Сколько вопросов пропущено адаптивным опросом — на столько сдвигается номер вопроса"""
+        return self.buf[_SKIPPED]
+
+    @skipped.setter
+    def skipped(self, value: int) -> None:
+        self.buf[_SKIPPED] = value
+
+    @property
+    def first_stage_answers(self) -> memoryview:
+        return memoryview(self.buf)[HEADER_SIZE:HEADER_SIZE + self.buf[_FIRST_COUNT]]
+
+    @property
+    def scores(self) -> memoryview:
+        return memoryview(self.buf)[HEADER_SIZE + self.buf[_FIRST_COUNT]:]
+
+    @scores.setter
+    def scores(self, values: Sequence[int]) -> None:
+        start = HEADER_SIZE + self.buf[_FIRST_COUNT]
+        self.buf[start:] = bytes(values)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Поля сессии в прежнем словарном виде (логи, отладка)"""
+        return {
+            "session_id": self.session_id,
+            "stage": self.stage,
+            "question_index": self.question_index,
+            "branch_questions_asked": self.branch_questions_asked,
+            "current_branch": self.current_branch,
+            "tie_branches": self.tie_branches,
+            "first_stage_answers": list(self.first_stage_answers),
+            "scores": list(self.scores),
+            "final_answers": {"intensity": self.intensity, "frequency": self.frequency, "sphere": self.sphere},
+            "started": self.started,
+            "content_version": self.content_version,
+            "skipped": self.skipped,
+        }
+
+
+# ==================== FSM ====================
+async def load_session(state: FSMContext) -> Optional[Session]:
+    """Сессия из FSM или None, если диагностика не начата (или уже завершена)"""
+    raw = (await state.get_data()).get(SESSION_KEY)
+    return Session.loads(raw) if raw else None
+
+
+async def save_session(state: FSMContext, session: Session) -> None:
+    await state.update_data({SESSION_KEY: session.dumps()})
+
+
+def session_stage(data: Dict[str, Any]) -> Optional[str]:
+    """Этап по данным FSM без полной распаковки (для метрик)"""
+    raw = data.get(SESSION_KEY)
+    if not raw:
+        return None
+    return STAGES[base64.b64decode(raw[:4])[_STAGE]]
@@ -0,0 +1,366 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== SQLITE ХРАНИЛИЩЕ ====================
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище в SQLite (режим WAL) с кэшем в памяти и отложенной записью.
+
+    Чтения сессий идут из кэша процесса (ключ без сессии каждый раз читается
+    из базы и в кэш не попадает), а изменения копятся в наборе «грязных»
+    ключей и сбрасываются на диск одной транзакцией раз в ``flush_interval``
+    секунд. Так несколько ``update_data`` за один ответ превращаются в одну запись.
+    """
+
+    def __init__(self, path: str = "fsm.sqlite3", flush_interval: float = 0.05) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+        # Кэш: ключ -> [state, data]; ключи, которых нет в базе, попадают сюда только при записи
+        self._cache: Dict[str, list] = {}
+        self._dirty: set = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+        # Один поток на все обращения к базе — sqlite3 не любит конкурентный доступ
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL)"
+        )
+
+    # ---------- доступ к базе (выполняется в потоке) ----------
+    def _load(self, key: str) -> list:
+        row = self._conn.execute("SELECT state, data FROM fsm WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return [None, {}]
+        return [row[0], json.loads(row[1])]
+
+    def _write_batch(self, upserts: list, deletes: list) -> None:
+        self._conn.execute("BEGIN")
+        try:
+            if upserts:
+                self._conn.executemany(
+                    "INSERT INTO fsm (key, state, data) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data",
+                    upserts,
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _stored_keys(self) -> List[str]:
+        return [row[0] for row in self._conn.execute("SELECT key FROM fsm")]
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # ---------- кэш и отложенная запись ----------
+    async def _record(self, key: StorageKey, write: bool = False) -> list:
+        k = self.key_builder.build(key)
+        record = self._cache.get(k)
+        if record is None:
+            loaded = await self._run(self._load, k)
+            if not write and loaded[0] is None and not loaded[1]:
+                # Промах чтения не кэшируется: иначе каждый /start без сессии оставался бы в памяти навсегда
+                return self._cache.get(k, loaded)
+            # Пока шла загрузка, ключ мог быть записан — кэш важнее
+            record = self._cache.setdefault(k, loaded)
+        return record
+
+    def _mark_dirty(self, key: StorageKey) -> None:
+        self._dirty.add(self.key_builder.build(key))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Сбрасывает все накопленные изменения одной транзакцией"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for k in dirty:
+            state, data = self._cache[k]
+            if state is None and not data:
+                deletes.append((k,))
+            else:
+                upserts.append((k, state, json.dumps(data, ensure_ascii=False, separators=(",", ":"))))
+        try:
+            await self._run(self._write_batch, upserts, deletes)
+        except Exception as e:
+            logger.error("Ошибка записи FSM в SQLite: %s", e)
+            self._dirty |= dirty
+            return
+        # Очищенные сессии не держим в кэше, если за время записи их не заполнили снова
+        for (k,) in deletes:
+            record = self._cache.get(k)
+            if record is not None and record[0] is None and not record[1] and k not in self._dirty:
+                del self._cache[k]
+
+    # ---------- интерфейс BaseStorage ----------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key, write=True)
+        record[0] = state.state if isinstance(state, State) else state
+        self._mark_dirty(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._record(key, write=True)
+        record[1] = data.copy()
+        self._mark_dirty(key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(key))[1].copy()
+
+    async def stored_keys(self) -> List[StorageKey]:
+        """Ключи всех записей в базе — их ставит на учёт ExpiringStorage.restore после перезапуска"""
+        keys = []
+        for k in await self._run(self._stored_keys):
+            # Формат DefaultKeyBuilder: префикс, бот, чат, [тред], пользователь, назначение
+            parts = k.split(self.key_builder.separator)
+            if len(parts) not in (5, 6):
+                continue
+            bot_id, chat_id, *thread, user_id, destiny = parts[1:]
+            keys.append(StorageKey(
+                bot_id=int(bot_id), chat_id=int(chat_id), user_id=int(user_id),
+                thread_id=int(thread[0]) if thread else None, destiny=destiny,
+            ))
+        return keys
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+
+# ==================== ВЫТЕСНЕНИЕ СЕССИЙ ====================
+class ExpiringStorage(BaseStorage):
+    """
+    Обёртка FSM-хранилища, которая удаляет брошенные сессии.
+
+    Сессией считается ключ с непустыми данными. Для каждой хранится время
+    последнего обращения в OrderedDict (он же порядок LRU), а сроки лежат
+    в куче — по одной записи на ключ. Раз в ``interval`` секунд фоновая задача
+    снимает с вершины кучи только истёкшие сроки; если к ключу обращались,
+    срок переносится. При превышении ``max_sessions`` сразу вытесняется
+    самая давняя сессия. ``on_evict(reason)`` вызывается с "ttl" или "lru".
+    """
+
+    def __init__(
+        self,
+        inner: BaseStorage,
+        ttl: float,
+        max_sessions: int = 0,
+        interval: float = 30.0,
+        on_evict: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self.inner = inner
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.interval = interval
+        self.on_evict = on_evict
+        self._touched: "OrderedDict[StorageKey, float]" = OrderedDict()
+        self._heap: List[Tuple[float, int, StorageKey]] = []
+        self._scheduled: set = set()
+        self._seq = itertools.count()
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._touched)
+
+    # ---------- учёт обращений ----------
+    def _touch(self, key: StorageKey) -> None:
+        self._touched[key] = time.monotonic()
+        self._touched.move_to_end(key)
+        if self.ttl and key not in self._scheduled:
+            heapq.heappush(self._heap, (self._touched[key] + self.ttl, next(self._seq), key))
+            self._scheduled.add(key)
+            if self._sweep_task is None or self._sweep_task.done():
+                self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def _evict(self, key: StorageKey, reason: str) -> None:
+        self._touched.pop(key, None)
+        await forget(self.inner, key)
+        if self.on_evict is not None:
+            self.on_evict(reason)
+        logger.info("Сессия %s вытеснена (%s)", key.chat_id, reason)
+
+    async def _seen(self, key: StorageKey) -> None:
+        self._touch(key)
+        if self.max_sessions and len(self._touched) > self.max_sessions:
+            await self._enforce_limit()
+
+    async def restore(self, accept: Optional[Callable[[StorageKey], bool]] = None) -> int:
+        """
+        Ставит на учёт сессии, сохранённые до перезапуска (если хранилище умеет
+        их перечислить): иначе их не вытеснили бы ни срок, ни предел, пока к ним
+        не обратятся. Срок отсчитывается от запуска. ``accept`` отбирает ключи
+        этого процесса (воркеры кластера делят один файл). Возвращает число ключей.
+        """
+        stored_keys = getattr(self.inner, "stored_keys", None)
+        if stored_keys is None:
+            return 0
+        keys = [key for key in await stored_keys() if accept is None or accept(key)]
+        for key in keys:
+            if key not in self._touched:
+                self._touch(key)
+        await self._enforce_limit()
+        return len(keys)
+
+    async def _enforce_limit(self) -> None:
+        while self.max_sessions and len(self._touched) > self.max_sessions:
+            key = next(iter(self._touched))
+            await self._evict(key, "lru")
+
+    async def sweep(self) -> int:
+        """Вытесняет сессии с истёкшим сроком; возвращает их число"""
+        now = time.monotonic()
+        evicted = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, _, key = heapq.heappop(self._heap)
+            self._scheduled.discard(key)
+            last = self._touched.get(key)
+            if last is None:
+                continue
+            if last + self.ttl <= now:
+                await self._evict(key, "ttl")
+                evicted += 1
+                if evicted % 1000 == 0:
+                    # Массовое истечение (например, после рестарта) не должно стопорить апдейты
+                    await asyncio.sleep(0)
+            else:
+                heapq.heappush(self._heap, (last + self.ttl, next(self._seq), key))
+                self._scheduled.add(key)
+        return evicted
+
+    async def _sweep_loop(self) -> None:
+        while self._heap:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error("Ошибка вытеснения сессий: %s", e)
+
+    # ---------- интерфейс BaseStorage ----------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self.inner.set_state(key, state)
+        if key in self._touched:
+            self._touch(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state = await self.inner.get_state(key)
+        # Сессия, загруженная с диска, тоже попадает под срок и предел
+        if state is not None or key in self._touched:
+            await self._seen(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self.inner.set_data(key, data)
+        if data:
+            await self._seen(key)
+        else:
+            self._touched.pop(key, None)
+            drop_empty(self.inner, key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = await self.inner.get_data(key)
+        if data or key in self._touched:
+            await self._seen(key)
+        return data
+
+    async def close(self) -> None:
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+        await self.inner.close()
+
+
+async def forget(storage: BaseStorage, key: StorageKey) -> None:
+    """Удаляет ключ целиком, не оставляя пустой записи в памяти процесса"""
+    await storage.set_state(key, None)
+    await storage.set_data(key, {})
+    drop_empty(storage, key)
+
+
+def drop_empty(storage: BaseStorage, key: StorageKey) -> None:
+    """
+    MemoryStorage заводит запись на любой get_state и не удаляет её после clear().
+    SQLiteStorage чистит свой кэш сам при сбросе на диск.
+    """
+    if isinstance(storage, MemoryStorage):
+        record = storage.storage.get(key)
+        if record is not None and record.state is None and not record.data:
+            del storage.storage[key]
+
+
+def iter_session_data(storage: BaseStorage) -> Iterator[Dict[str, Any]]:
+    """Данные FSM, которые процесс держит в памяти (для метрик); Redis не перебирается"""
+    if isinstance(storage, ExpiringStorage):
+        yield from iter_session_data(storage.inner)
+    elif isinstance(storage, SQLiteStorage):
+        for _, data in list(storage._cache.values()):
+            yield data
+    elif isinstance(storage, MemoryStorage):
+        for record in list(storage.storage.values()):
+            yield record.data
+
+
+# ==================== ВЫБОР ХРАНИЛИЩА ====================
+def build_storage(on_evict: Optional[Callable[[str], None]] = None) -> BaseStorage:
+    """
+    Создаёт FSM-хранилище по переменным окружения:
+    FSM_STORAGE=sqlite (по умолчанию) | redis | memory,
+    FSM_DB_PATH — файл SQLite, REDIS_URL — адрес Redis-совместимого сервера,
+    SESSION_TTL — сколько секунд хранить брошенную сессию (0 — бессрочно),
+    SESSION_MAX — не больше стольких сессий в процессе (0 — без предела).
+    """
+    kind = os.getenv("FSM_STORAGE", "sqlite").lower()
+    ttl = float(os.getenv("SESSION_TTL", "86400"))
+    max_sessions = int(os.getenv("SESSION_MAX", "100000"))
+
+    if kind == "redis":
+        # Требует пакет redis: pip install redis
+        # Срок жизни ключей Redis соблюдает сам, а память — его забота, не процесса
+        from aiogram.fsm.storage.redis import RedisStorage
+        ttl_kwargs = {"state_ttl": int(ttl), "data_ttl": int(ttl)} if ttl else {}
+        return RedisStorage.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), **ttl_kwargs)
+
+    if kind == "memory":
+        inner = MemoryStorage()
+    else:
+        inner = SQLiteStorage(
+            path=os.getenv("FSM_DB_PATH", "fsm.sqlite3"),
+            flush_interval=float(os.getenv("FSM_FLUSH_INTERVAL", "0.05")),
+        )
+    if not ttl and not max_sessions:
+        return inner
+    return ExpiringStorage(inner, ttl=ttl, max_sessions=max_sessions, on_evict=on_evict)
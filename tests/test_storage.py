@@ -0,0 +1,74 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey
+
+from storage import ExpiringStorage, SQLiteStorage
+
+
+def key(chat_id: int, thread_id=None) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id, thread_id=thread_id)
+
+
+async def fill(path: str, keys) -> None:
+    storage = SQLiteStorage(path)
+    for k in keys:
+        await storage.set_state(k, "Form:first")
+        await storage.set_data(k, {"session": "x"})
+    await storage.close()
+
+
+def test_restored_sessions_expire_after_restart(tmp_path):
+    path = str(tmp_path / "fsm.sqlite3")
+    keys = [key(1), key(-100, thread_id=5)]
+
+    async def run():
+        await fill(path, keys)
+        # Перезапуск: к сессиям с диска никто не обращается
+        evicted = []
+        storage = ExpiringStorage(SQLiteStorage(path), ttl=0.05, interval=0.01, on_evict=evicted.append)
+        assert sorted(k.chat_id for k in await storage.inner.stored_keys()) == [-100, 1]
+        assert await storage.restore() == 2
+        await asyncio.sleep(0.2)
+        assert evicted == ["ttl", "ttl"]
+        assert len(storage) == 0
+        await storage.inner.flush()
+        assert await storage.inner.stored_keys() == []
+        assert not storage.inner._cache
+        await storage.close()
+
+    asyncio.run(run())
+
+
+def test_restore_keeps_only_accepted_shard(tmp_path):
+    path = str(tmp_path / "fsm.sqlite3")
+
+    async def run():
+        await fill(path, [key(1), key(2), key(3)])
+        storage = ExpiringStorage(SQLiteStorage(path), ttl=60)
+        assert await storage.restore(lambda k: k.chat_id % 2 == 1) == 2
+        assert len(storage) == 2
+        await storage.close()
+
+    asyncio.run(run())
+
+
+def test_session_read_after_restart_is_limited(tmp_path):
+    path = str(tmp_path / "fsm.sqlite3")
+
+    async def run():
+        await fill(path, [key(1), key(2), key(3)])
+        # Без restore: сессия попадает на учёт при первом чтении
+        storage = ExpiringStorage(SQLiteStorage(path), ttl=0, max_sessions=2)
+        for chat_id in (1, 2, 3):
+            assert await storage.get_data(key(chat_id)) == {"session": "x"}
+        assert len(storage) == 2
+        assert await storage.get_data(key(1)) == {}
+        assert await storage.get_state(key(4)) is None
+        assert len(storage) == 2
+        await storage.close()
+
+    asyncio.run(run())
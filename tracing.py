@@ -0,0 +1,374 @@
+import atexit
+import functools
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger(__name__)
+
+# Открытый спан текущего апдейта; None — апдейт не трассируется
+current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+# ==================== СПАНЫ ====================
+class Span:
+    """
+    Участок обработки апдейта: имя, начало и конец (нс), родитель и атрибуты.
+    ``links`` — спаны (trace_id, span_id), из-за которых начат этот корневой
+    спан, но которые его не дожидаются (см. Tracer.deferred).
+    """
+
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "start", "end", "attrs", "error", "links", "_token")
+
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: str,
+        trace_id: int,
+        parent_id: int,
+        attrs: Dict[str, Any],
+        links: Tuple[Tuple[int, int], ...] = (),
+    ) -> None:
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = 0
+        self.end = 0
+        self.error: Optional[str] = None
+        self.links = links
+
+    def set(self, key: str, value: Any) -> None:
+        self.attrs[key] = value
+
+    def __enter__(self) -> "Span":
+        self._token = current_span.set(self)
+        self.start = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.end = time.time_ns()
+        if exc_type is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        current_span.reset(self._token)
+        self.tracer.exporter.export(self)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": f"{self.trace_id:032x}",
+            "span_id": f"{self.span_id:016x}",
+            "parent_id": f"{self.parent_id:016x}" if self.parent_id else None,
+            "name": self.name,
+            "start": self.start,
+            "ms": round((self.end - self.start) / 1e6, 3),
+            "attrs": self.attrs,
+            "error": self.error,
+            "links": [{"trace_id": f"{t:032x}", "span_id": f"{s:016x}"} for t, s in self.links],
+        }
+
+
+class _NoopSpan:
+    """Спан неотслеживаемого апдейта: ничего не записывает"""
+
+    __slots__ = ()
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+NOOP = _NoopSpan()
+
+
+class Tracer:
+    """
+    Трассировка апдейтов с выборкой.
+
+    ``trace`` открывает корневой спан апдейта для доли ``sample`` апдейтов,
+    ``span`` — вложенный, если апдейт трассируется; иначе оба возвращают NOOP,
+    и цена спана — чтение contextvar. Работа, которую апдейт откладывает
+    (DelayedSender), обёрнута в ``deferred``: она идёт после ответа на апдейт
+    и получает свой корневой спан со ссылкой на спан, который её запланировал. С ``sample=0`` трассировка выключена:
+    ``traced`` возвращает функцию как есть, а middleware и обёртки хранилища
+    и сессии не ставятся (см. bot.py), так что выключенная трассировка
+    не стоит ничего, кроме этих проверок.
+    """
+
+    def __init__(self, sample: float = 0.0, exporter: Optional["SpanExporter"] = None) -> None:
+        self.sample = sample
+        self.exporter = exporter
+        self.enabled = sample > 0 and exporter is not None
+        self._random = random.random
+
+    def trace(self, name: str, **attrs: Any):
+        if not self.enabled or self._random() >= self.sample:
+            return NOOP
+        return Span(self, name, random.getrandbits(128), 0, attrs)
+
+    def span(self, name: str, **attrs: Any):
+        parent = current_span.get()
+        if parent is None:
+            return NOOP
+        return Span(self, name, parent.trace_id, parent.span_id, attrs)
+
+    def deferred(self, name: str, job: Callable[[], Awaitable[Any]]) -> Callable[[], Awaitable[Any]]:
+        """
+        Отложенная работа трассируемого апдейта — новый корневой спан со ссылкой
+        на текущий: дочерний спан закончился бы позже родителя. Апдейт не
+        трассируется — работа возвращается как есть.
+        """
+        parent = current_span.get()
+        if parent is None:
+            return job
+        link = ((parent.trace_id, parent.span_id),)
+
+        async def wrapper() -> Any:
+            with Span(self, name, random.getrandbits(128), 0, {}, link):
+                return await job()
+        return wrapper
+
+    def traced(self, name: Optional[str] = None):
+        """Декоратор корутины: её вызов — вложенный спан"""
+        def decorator(func: Callable[..., Awaitable[Any]]):
+            if not self.enabled:
+                return func
+            label = name or func.__name__
+
+            @functools.wraps(func)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                if current_span.get() is None:
+                    return await func(*args, **kwargs)
+                with self.span(label):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+# ==================== ЭКСПОРТ ====================
+class SpanExporter(ABC):
+    """
+    Экспорт законченных спанов пачками из отдельного потока: цикл событий
+    только кладёт спан в очередь. Если в очереди уже ``capacity`` спанов,
+    новые отбрасываются и считаются в ``dropped``. Наследник задаёт ``write``.
+    """
+
+    def __init__(self, batch: int = 512, interval: float = 1.0, capacity: int = 10000) -> None:
+        self.batch = batch
+        self.interval = interval
+        self.capacity = capacity
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        # Спаны, оставшиеся в очереди, дописываются до выхода
+        atexit.register(self.close)
+
+    def export(self, span: Span) -> None:
+        if self._queue.qsize() >= self.capacity:
+            self.dropped += 1
+            return
+        self._queue.put(span)
+
+    @abstractmethod
+    def write(self, spans: List[Span]) -> None:
+        """Записывает пачку спанов; вызывается из потока экспорта"""
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            spans: List[Span] = []
+            deadline = time.monotonic() + self.interval
+            while len(spans) < self.batch:
+                try:
+                    span = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if span is None:
+                    stopping = True
+                    break
+                spans.append(span)
+            if not spans:
+                continue
+            try:
+                self.write(spans)
+                self.exported += len(spans)
+            except Exception as e:
+                self.failed += len(spans)
+                logger.warning("Трассировка: не экспортировано %s спанов: %s", len(spans), e)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Дописывает очередь и останавливает поток"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+
+class JsonlExporter(SpanExporter):
+    """Спаны — строками JSON в локальный файл"""
+
+    def __init__(self, path: str, **kwargs: Any) -> None:
+        self._file = open(path, "a", encoding="utf-8")
+        super().__init__(**kwargs)
+
+    def write(self, spans: List[Span]) -> None:
+        self._file.write("".join(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n" for span in spans))
+        self._file.flush()
+
+    def close(self, timeout: float = 5.0) -> None:
+        super().close(timeout)
+        if not self._file.closed:
+            self._file.close()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpExporter(SpanExporter):
+    """Спаны — в коллектор OpenTelemetry по OTLP/HTTP в JSON (POST на .../v1/traces)"""
+
+    def __init__(self, url: str, service: str = "cob-bot", timeout: float = 5.0, **kwargs: Any) -> None:
+        self.url = url
+        self.service = service
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def payload(self, spans: List[Span]) -> Dict[str, Any]:
+        items = []
+        for span in spans:
+            item = {
+                "traceId": f"{span.trace_id:032x}",
+                "spanId": f"{span.span_id:016x}",
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start),
+                "endTimeUnixNano": str(span.end),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attrs.items() if v is not None],
+                # 2 — ошибка, 0 — статус не задан
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 0},
+            }
+            if span.parent_id:
+                item["parentSpanId"] = f"{span.parent_id:016x}"
+            if span.links:
+                item["links"] = [{"traceId": f"{t:032x}", "spanId": f"{s:016x}"} for t, s in span.links]
+            items.append(item)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}}]},
+            "scopeSpans": [{"scope": {"name": "cob-bot"}, "spans": items}],
+        }]}
+
+    def write(self, spans: List[Span]) -> None:
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(self.payload(spans), default=str).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+# ==================== ИСТОЧНИКИ СПАНОВ ====================
+class TracingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware диспетчера: корневой спан апдейта. Ставится перед
+    FSMContextMiddleware (см. bot.py), чтобы в спан вошли ожидание очереди
+    чата и чтение состояния.
+    """
+
+    def __init__(self, tracer: Tracer) -> None:
+        self.tracer = tracer
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        span = self.tracer.trace("update", type=getattr(event, "event_type", "unknown"))
+        if span is NOOP:
+            return await handler(event, data)
+        if isinstance(event, Update):
+            span.set("update_id", event.update_id)
+        chat = data.get("event_chat")
+        if chat is not None:
+            span.set("chat_id", chat.id)
+        with span:
+            result = await handler(event, data)
+            if isinstance(result, TelegramMethod):
+                # Запрос ушёл Telegram в ответе на вебхук, а не через сессию
+                span.set("webhook_reply", result.__api_method__)
+            return result
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: спан на каждый запрос к Bot API (вместе с ожиданием лимитера)"""
+
+    def __init__(self, tracer: Tracer) -> None:
+        self.tracer = tracer
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Any,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        with self.tracer.span(f"api.{method.__api_method__}"):
+            return await make_request(bot, method)
+
+
+class TracedStorage(BaseStorage):
+    """Обёртка FSM-хранилища: спан на каждую операцию"""
+
+    def __init__(self, inner: BaseStorage, tracer: Tracer) -> None:
+        self.inner = inner
+        self.tracer = tracer
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        with self.tracer.span("storage.set_state"):
+            await self.inner.set_state(key, state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        with self.tracer.span("storage.get_state"):
+            return await self.inner.get_state(key)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        with self.tracer.span("storage.set_data"):
+            await self.inner.set_data(key, data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        with self.tracer.span("storage.get_data"):
+            return await self.inner.get_data(key)
+
+    async def close(self) -> None:
+        await self.inner.close()